@@ -59,6 +59,55 @@ ORDER BY
     user_type, total_viajes DESC;
 
 
+-- Las mismas consultas sobre las tablas precalculadas por access_data.py
+-- (rutas_cube: un grouping set por fila; rutas_top: top 10 global y por tipo)
+
+-- Top 10 rutas con más viajes entre estaciones.
+SELECT 
+    station_origin_id,
+    station_dest_id,
+    total_viajes
+FROM 
+    rutas_top
+WHERE 
+    user_type IS NULL
+ORDER BY 
+    ranking;
+
+-- Total de viajes y rutas únicas por tipo de usuario.
+SELECT 
+    user_type,
+    total_viajes,
+    rutas_distintas
+FROM 
+    rutas_cube
+WHERE 
+    grouping_set = 'usuario';
+
+-- Promedio de duración y distancia de viajes por tipo de usuario.
+SELECT 
+    user_type,
+    avg_duration_seconds AS avg_duracion_segundos,
+    avg_distance_km AS avg_distancia_km
+FROM 
+    rutas_cube
+WHERE 
+    grouping_set = 'usuario';
+
+--Total de viajes por ruta y tipo de usuario, ordenado por tipo y viajes.
+SELECT 
+    user_type,
+    station_origin_id,
+    station_dest_id,
+    total_viajes
+FROM 
+    rutas_cube
+WHERE 
+    grouping_set = 'ruta_usuario'
+ORDER BY 
+    user_type, total_viajes DESC;
+
+
 -- Segunda pregunta 
 -- ¿Cómo  se  relaciona  la densidad de población de los distritos con la presencia de infraestructura de transporte público?"
 
@@ -1,26 +1,83 @@
 from utils import (
     download_dataframe_from_minio,
+    download_partitioned_dataframe_from_minio,
+    list_dataset_partitions,
+    open_object_file,
+    read_json_object,
+    write_json_object,
+    read_parquet_object,
+    write_parquet_object,
     upload_dataframe_to_minio,
     log_data_transformation,
-    execute_trino_query
+    execute_trino_query,
+    get_minio_client,
+    start_governance_run,
+    end_governance_run
 )
+from metrics import instrument, export_metrics
+import os
+import numpy as np
 import pandas as pd
-
-def create_trafico_congestion_summary():
+import pyarrow.parquet as pq
+
+# Columnas que necesita cada agregado (solo se descargan estas)
+CONGESTION_COLUMNS = [
+    'hour', 'congestion_level', 'total_vehicles', 'cars',
+    'motorcycles', 'trucks', 'buses', 'avg_speed_kmh'
+]
+# congestion_by_hour incremental: sumas parciales por partición de tráfico;
+# solo se agregan las particiones nuevas o modificadas desde la última ejecución
+CONGESTION_INCREMENTAL = os.environ.get('CONGESTION_INCREMENTAL', '1') == '1'
+CONGESTION_STATE_PREFIX = 'analytics/_state/congestion_by_hour/'
+RUTAS_COLUMNS = [
+    'station_origin_id', 'station_dest_id', 'user_type',
+    'user_id', 'duration_seconds', 'distance_km'
+]
+
+# Cubo de rutas: grouping sets sobre origen, destino y tipo de usuario que
+# responden a las consultas de objetivos/obj2consulta2.sql sin reagrupar
+RUTAS_GROUPING_SETS = {
+    'ruta_usuario': ['station_origin_id', 'station_dest_id', 'user_type'],
+    'ruta': ['station_origin_id', 'station_dest_id'],
+    'usuario': ['user_type'],
+    'origen': ['station_origin_id'],
+    'destino': ['station_dest_id'],
+    'total': [],
+}
+RUTAS_TOP_K = 10
+
+# Agregación de rutas: 'memory' carga todos los viajes y cuenta usuarios
+# exactos; 'stream' recorre cada partición por record batches y guarda
+# estados parciales combinables por día (conteos, sumas y usuarios distintos)
+RUTAS_AGG_MODE = os.environ.get('RUTAS_AGG_MODE', 'memory')
+RUTAS_BATCH_ROWS = int(os.environ.get('RUTAS_BATCH_ROWS', '500000'))
+# Grupos con hasta RUTAS_EXACT_USERS usuarios se cuentan exactos; el resto
+# con HyperLogLog de 2^RUTAS_HLL_PRECISION registros (error típico ~1.6% con 12)
+RUTAS_EXACT_USERS = int(os.environ.get('RUTAS_EXACT_USERS', '1000'))
+RUTAS_HLL_PRECISION = int(os.environ.get('RUTAS_HLL_PRECISION', '12'))
+RUTAS_STATE_PREFIX = 'analytics/_state/rutas_users/'
+
+# parkings-visualizaciones incremental: momentos (n, media, M2) combinables
+# de la ocupación por parking, por parking y hora y por parking y día
+PARKINGS_INCREMENTAL = os.environ.get('PARKINGS_INCREMENTAL', '1') == '1'
+PARKINGS_STATE_PREFIX = 'analytics/_state/parkings_variability/'
+
+# Datasets de process-zone que se combinan en los de aparcamientos
+PARKINGS_SOURCES = [
+    ('process-zone', 'invent/parkings/'),
+    ('process-zone', 'apar/aparcamientos.parquet'),
+]
+
+@instrument
+def summarize_congestion(df):
     """
-    Crea un resumen por hora del nivel de congestión y vehículos predominantes.
+    Resumen por hora y nivel de congestión de un DataFrame de tráfico estandarizado.
     """
-    print("Creando resumen de congestión de tráfico por hora...")
-
-    # Descargar datos procesados
-    df = download_dataframe_from_minio(
-        'process-zone',
-        'traf/trafico.parquet',
-        format='parquet'
-    )
+    # Los totales de un histórico largo no caben en UInt32: se suman en Int64
+    df = df.astype({col: 'Int64' for col in ['total_vehicles'] + _VEHICLE_COLUMNS})
 
     # Calcular promedio por hora y nivel de congestión
-    resumen = df.groupby(['hour', 'congestion_level']).agg({
+    resumen = df.groupby(['hour', 'congestion_level'], observed=True).agg({
         'total_vehicles': 'sum',
         'cars': 'sum',
         'motorcycles': 'sum',
@@ -35,16 +92,164 @@ def create_trafico_congestion_summary():
 
     return resumen
 
+@instrument
+def create_trafico_congestion_summary(partition_filter=None, filters=None):
+    """
+    Crea un resumen por hora del nivel de congestión y vehículos predominantes.
+    """
+    print("Creando resumen de congestión de tráfico por hora...")
 
-def rutes_users_popularity():
-    df_bicimad = download_dataframe_from_minio(
+    # Descargar datos procesados (solo las particiones year/month/day pedidas)
+    df = download_partitioned_dataframe_from_minio(
         'process-zone',
-        'data/bicimad.parquet',
-        format='parquet'
+        'traf/trafico/',
+        partition_filter=partition_filter,
+        columns=CONGESTION_COLUMNS,
+        filters=filters
+    )
+    return summarize_congestion(df)
+
+# Sumas combinables de congestion_by_hour por (hour, congestion_level): la
+# velocidad media se guarda como suma y número de valores no nulos y 'filas'
+# permite descartar los grupos que se quedan vacíos al restar una partición
+_CONGESTION_KEYS = ['hour', 'congestion_level']
+_VEHICLE_COLUMNS = ['cars', 'motorcycles', 'trucks', 'buses']
+_CONGESTION_SUMS = ['filas', 'total_vehicles'] + _VEHICLE_COLUMNS + ['speed_sum', 'speed_count']
+
+def congestion_partial(df):
+    """Mergeable sums by hour and congestion level of a standardized traffic DataFrame."""
+    speed = df['avg_speed_kmh'].astype('float64')
+    partial = pd.DataFrame({
+        'hour': df['hour'].astype('float64'),
+        'congestion_level': df['congestion_level'].astype('object'),
+        'filas': 1.0,
+        **{col: df[col].astype('float64') for col in ['total_vehicles'] + _VEHICLE_COLUMNS},
+        'speed_sum': speed,
+        'speed_count': speed.notna().astype('float64'),
+    })
+    return merge_congestion_partials([partial])
+
+def merge_congestion_partials(partials, sign=None):
+    """Add up partial sums; sign gives a +1/-1 factor per partial (to take a partition out)."""
+    if sign is not None:
+        partials = [partial.assign(**{col: partial[col] * factor for col in _CONGESTION_SUMS})
+                    for partial, factor in zip(partials, sign)]
+    merged = pd.concat(partials, ignore_index=True).groupby(_CONGESTION_KEYS)[_CONGESTION_SUMS].sum().reset_index()
+    return merged[merged['filas'].round() > 0].reset_index(drop=True)
+
+def finalize_congestion(totals):
+    """congestion_by_hour from merged partial sums (same columns as summarize_congestion)."""
+    totals = totals.sort_values(_CONGESTION_KEYS).reset_index(drop=True)
+    resumen = pd.DataFrame({
+        'hour': pd.array(totals['hour'].round().astype('int64'), dtype='UInt8'),
+        'congestion_level': pd.Categorical(totals['congestion_level'], categories=sorted(totals['congestion_level'].unique())),
+        **{col: pd.array(totals[col].round().astype('int64'), dtype='Int64') for col in ['total_vehicles'] + _VEHICLE_COLUMNS},
+    })
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resumen['avg_speed_kmh'] = totals['speed_sum'].to_numpy() / totals['speed_count'].to_numpy()
+
+    # El vehículo predominante se recalcula sobre los totales combinados
+    resumen['vehiculo_predominante'] = resumen[_VEHICLE_COLUMNS].idxmax(axis=1)
+    return resumen
+
+def _remove_state_object(object_name):
+    from minio.deleteobjects import DeleteObject
+    errors = list(get_minio_client().remove_objects('access-zone', [DeleteObject(object_name)]))
+    if errors:
+        print(f"Could not remove access-zone/{object_name}")
+
+def _partial_object(state_prefix, partition, etag):
+    # Un objeto por versión de la partición: el parcial que se resta es
+    # siempre el que se sumó a los totales, aunque haya uno más nuevo
+    etag = etag.strip('"')
+    return f"{state_prefix}partials/{partition}/{etag}.parquet"
+
+def update_partial_state(state_prefix, dataset_prefix, build_partial, merge_partials, empty):
+    """Merged partial aggregates of every partition of a process-zone dataset.
+
+    The totals and one partial per partition version (etag) are kept under
+    state_prefix in access-zone, with the etag of every partition folded in.
+    Only new or changed partitions are read (build_partial); changed and
+    removed ones are taken out of the totals with sign -1 in
+    merge_partials(partials, sign).
+    """
+    info = read_json_object('access-zone', state_prefix + 'state.json', default={'generation': 0, 'partitions': {}})
+    totals = None
+    if info['generation']:
+        totals = read_parquet_object('access-zone', f"{state_prefix}totals/{info['generation']}.parquet")
+    if totals is None:
+        info = {'generation': info['generation'], 'partitions': {}}
+
+    current = {p['partition']: p for p in list_dataset_partitions('process-zone', dataset_prefix)}
+    previous = dict(info['partitions'])
+    folded = info['partitions']
+    partials, sign = ([totals], [1]) if totals is not None else ([], [])
+
+    # Particiones ya sumadas que han cambiado o desaparecido: se restan
+    for name, etag in list(folded.items()):
+        if name in current and current[name]['etag'] == etag:
+            continue
+        old = read_parquet_object('access-zone', _partial_object(state_prefix, name, etag))
+        if old is None:
+            # Sin su parcial no se puede restar: se recalcula todo
+            print(f"Partial state of {dataset_prefix}{name} missing, rebuilding {state_prefix}")
+            partials, sign, folded = [], [], {}
+            break
+        partials.append(old)
+        sign.append(-1)
+        del folded[name]
+
+    # Particiones nuevas o modificadas: se calculan y se suman
+    new_partitions = [p for name, p in sorted(current.items()) if name not in folded]
+    for partition in new_partitions:
+        partial = build_partial(partition)
+        write_parquet_object('access-zone', _partial_object(state_prefix, partition['partition'], partition['etag']), partial)
+        partials.append(partial)
+        sign.append(1)
+        folded[partition['partition']] = partition['etag']
+    print(f"{dataset_prefix}: {len(new_partitions)} new or changed partitions of {len(current)}")
+
+    if len(partials) > 1 or totals is None:
+        totals = merge_partials(partials, sign) if partials else empty
+        # Los totales van a un objeto nuevo y state.json (escrito al final) pasa a apuntarle
+        generation = info['generation'] + 1
+        write_parquet_object('access-zone', f"{state_prefix}totals/{generation}.parquet", totals)
+        write_json_object('access-zone', state_prefix + 'state.json', {'generation': generation, 'partitions': folded})
+
+        # Solo con state.json ya escrito se borran los parciales sustituidos:
+        # si la ejecución se interrumpe antes, la siguiente resta los antiguos
+        for name, etag in previous.items():
+            if folded.get(name) != etag:
+                _remove_state_object(_partial_object(state_prefix, name, etag))
+        if info['generation']:
+            _remove_state_object(f"{state_prefix}totals/{info['generation']}.parquet")
+
+    return totals
+
+def _congestion_partition_partial(partition):
+    df = download_dataframe_from_minio('process-zone', partition['object_name'], format='parquet', columns=CONGESTION_COLUMNS)
+    return congestion_partial(df)
+
+@instrument
+def update_congestion_summary():
+    """
+    congestion_by_hour incremental: suma a los totales guardados solo las
+    particiones de tráfico nuevas o modificadas (y resta las eliminadas).
+    """
+    totals = update_partial_state(
+        CONGESTION_STATE_PREFIX, 'traf/trafico/',
+        _congestion_partition_partial, merge_congestion_partials,
+        empty=congestion_partial(pd.DataFrame(columns=CONGESTION_COLUMNS))
     )
+    return finalize_congestion(totals)
 
+@instrument
+def summarize_rutas(df_bicimad):
+    """
+    Viajes, duración y distancia medias y usuarios distintos por ruta y tipo de usuario.
+    """
     grouped_df = df_bicimad.groupby(
-    ['station_origin_id', 'station_dest_id', 'user_type']
+    ['station_origin_id', 'station_dest_id', 'user_type'], observed=True
         ).agg(
     total_viajes=('user_id', 'count'),
     avg_duration_seconds=('duration_seconds', 'mean'),
@@ -54,11 +259,304 @@ def rutes_users_popularity():
 
     return grouped_df
 
-def clean_and_merge_parkings():
-    # Descargar los datos parquet de MinIO usando la función proporcionada
-    parkings = download_dataframe_from_minio('process-zone', 'invent/parkings.parquet', format='parquet')
-    ubicaciones = download_dataframe_from_minio('process-zone', 'apar/aparcamientos.parquet', format='parquet')
+@instrument
+def rutes_users_popularity(partition_filter=None, filters=None, mode=RUTAS_AGG_MODE):
+    if mode == 'stream':
+        if filters is not None:
+            raise ValueError("Row filters are not supported by the stream route aggregation")
+        return rutes_users_popularity_stream(partition_filter)
+    if mode != 'memory':
+        raise ValueError(f"Unsupported route aggregation mode: {mode}")
+
+    df_bicimad = download_partitioned_dataframe_from_minio(
+        'process-zone',
+        'data/bicimad/',
+        partition_filter=partition_filter,
+        columns=RUTAS_COLUMNS,
+        filters=filters
+    )
+    return summarize_rutas(df_bicimad)
+
+# Estado parcial de rutas_users. Cada grupo (origen, destino, tipo de
+# usuario) se identifica con una clave entera: origen << 24 | destino << 8 |
+# posición del tipo de usuario en state['user_types']. Tablas del estado:
+#   groups:    key, viajes, duration_sum/count, distance_sum/count
+#   pairs:     key, user_hash (grupos en modo exacto)
+#   registers: key, register, rank (HyperLogLog disperso: solo registros no nulos)
+_STATE_TABLES = ('groups', 'pairs', 'registers')
+_GROUP_SUMS = ['viajes', 'duration_sum', 'duration_count', 'distance_sum', 'distance_count']
+
+def empty_rutas_state():
+    return {
+        'user_types': [],
+        'groups': pd.DataFrame({'key': pd.Series(dtype='int64'), **{col: pd.Series(dtype='float64') for col in _GROUP_SUMS}}),
+        'pairs': pd.DataFrame({'key': pd.Series(dtype='int64'), 'user_hash': pd.Series(dtype='uint64')}),
+        'registers': pd.DataFrame({'key': pd.Series(dtype='int64'), 'register': pd.Series(dtype='uint16'), 'rank': pd.Series(dtype='uint8')}),
+    }
+
+def _bit_length(values):
+    """Bit length of uint64 values, exact (float64 only sees 32-bit halves)."""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        return np.where(high > 0, 33 + np.floor(np.log2(np.maximum(high, 1))),
+                        np.where(low > 0, 1 + np.floor(np.log2(np.maximum(low, 1))), 0)).astype(np.int64)
+
+def _hll_registers(pairs, precision):
+    """HyperLogLog register and rank of every (key, user_hash) pair, max per register."""
+    hashes = pairs['user_hash'].to_numpy(dtype=np.uint64)
+    rest = (hashes << np.uint64(precision)) if precision else hashes
+    # rank = ceros iniciales de los 64 - p bits restantes + 1
+    rank = np.minimum(64 - _bit_length(rest) + 1, 64 - precision + 1)
+    registers = pd.DataFrame({
+        'key': pairs['key'].to_numpy(),
+        'register': (hashes >> np.uint64(64 - precision)).astype(np.uint16),
+        'rank': rank.astype(np.uint8),
+    })
+    return registers.groupby(['key', 'register'], sort=False)['rank'].max().reset_index()
+
+def _hll_estimate(registers, precision):
+    """Distinct count per key from its sparse HyperLogLog registers."""
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    per_key = registers.assign(inverse=np.ldexp(1.0, -registers['rank'].astype(np.int64))).groupby('key').agg(
+        inverse=('inverse', 'sum'), filled=('register', 'size'))
+    zeros = m - per_key['filled']
+    raw = alpha * m * m / (per_key['inverse'] + zeros)
+    # Corrección para cardinalidades pequeñas (linear counting)
+    small = m * np.log(m / zeros.where(zeros > 0, 1))
+    return pd.Series(np.where((raw <= 2.5 * m) & (zeros > 0), small, raw), index=per_key.index).round().astype('int64')
+
+def _max_registers(registers):
+    # Una sola clave entera (grupo << 16 | registro) agrupa mucho más rápido que dos columnas
+    slots = (registers['key'].to_numpy(dtype=np.int64) << 16) | registers['register'].to_numpy(dtype=np.int64)
+    ranks = pd.Series(registers['rank'].to_numpy(), index=slots).groupby(level=0, sort=False).max()
+    return pd.DataFrame({
+        'key': ranks.index.to_numpy() >> 16,
+        'register': (ranks.index.to_numpy() & 0xFFFF).astype(np.uint16),
+        'rank': ranks.to_numpy(dtype=np.uint8),
+    })
+
+def _compact_rutas_state(state, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    """Merge duplicate rows of a state and move groups past the exact limit to HyperLogLog."""
+    state['groups'] = state['groups'].groupby('key', sort=False)[_GROUP_SUMS].sum().reset_index()
+    pairs = state['pairs'].drop_duplicates()
+    registers = state['registers']
+
+    users = pairs.groupby('key', sort=False).size()
+    sketched = pairs['key'].isin(users.index[users > exact_users]) | pairs['key'].isin(registers['key'].unique())
+    if sketched.any():
+        registers = pd.concat([registers, _hll_registers(pairs[sketched], precision)], ignore_index=True)
+        pairs = pairs[~sketched]
+    state['pairs'] = pairs.reset_index(drop=True)
+    state['registers'] = _max_registers(registers)
+    state['pending'] = 0
+    state['compacted'] = sum(len(state[name]) for name in _STATE_TABLES)
+    return state
+
+def _add_to_rutas_state(state, tables, exact_users, precision):
+    """Append rows to a state, compacting it only once the appended rows outgrow it.
+
+    Compacting on every batch or partition would re-aggregate the whole
+    accumulated state each time; deferring it keeps the total work linear
+    while memory stays within about twice the compacted state.
+    """
+    for name, table in tables.items():
+        state[name] = pd.concat([state[name], table], ignore_index=True)
+        state['pending'] = state.get('pending', 0) + len(table)
+    if state['pending'] >= max(RUTAS_BATCH_ROWS, state.get('compacted', 0)):
+        _compact_rutas_state(state, exact_users, precision)
+    return state
+
+def _route_keys(df, user_types):
+    """Group key of every trip (appending new user types to user_types) and the rows that have one."""
+    valid = (df['station_origin_id'].notna() & df['station_dest_id'].notna() & df['user_type'].notna()).to_numpy()
+    df = df[valid]
+    origin = df['station_origin_id'].to_numpy(dtype=np.int64)
+    dest = df['station_dest_id'].to_numpy(dtype=np.int64)
+    if len(df) and max(origin.max(), dest.max()) > 0xFFFF:
+        raise ValueError("Station ids above 65535 do not fit in the route state key")
+
+    types = df['user_type'].astype(str)
+    for user_type in pd.unique(types):
+        if user_type not in user_types:
+            user_types.append(user_type)
+    codes = pd.Categorical(types, categories=user_types).codes.astype(np.int64)
+    return (origin << 24) | (dest << 8) | codes, valid
+
+def fold_rutas_batch(state, df, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    """Add a batch of trips (RUTAS_COLUMNS) to a partial state."""
+    keys, valid = _route_keys(df, state['user_types'])
+    df = df[valid]
+    duration = df['duration_seconds'].astype('float64')
+    distance = df['distance_km'].astype('float64')
+    groups = pd.DataFrame({
+        'key': keys,
+        'viajes': df['user_id'].notna().to_numpy(dtype=np.float64),
+        'duration_sum': duration.fillna(0).to_numpy(),
+        'duration_count': duration.notna().to_numpy(dtype=np.float64),
+        'distance_sum': distance.fillna(0).to_numpy(),
+        'distance_count': distance.notna().to_numpy(dtype=np.float64),
+    }).groupby('key', sort=False).sum().reset_index()
+
+    users = df['user_id'].notna().to_numpy()
+    pairs = pd.DataFrame({
+        'key': keys[users],
+        'user_hash': pd.util.hash_array(df['user_id'][users].to_numpy(dtype=np.uint64)),
+    }).drop_duplicates()
+
+    return _add_to_rutas_state(state, {'groups': groups, 'pairs': pairs}, exact_users, precision)
+
+def merge_rutas_states(state, other, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    """Merge another partial state (e.g. another day) into state."""
+    # Las posiciones de tipo de usuario de other se traducen a las de state
+    mapping = np.zeros(max(len(other['user_types']), 1), dtype=np.int64)
+    for position, user_type in enumerate(other['user_types']):
+        if user_type not in state['user_types']:
+            state['user_types'].append(user_type)
+        mapping[position] = state['user_types'].index(user_type)
+
+    tables = {}
+    for name in _STATE_TABLES:
+        table = other[name]
+        if len(table):
+            keys = table['key'].to_numpy(dtype=np.int64)
+            table = table.assign(key=(keys & ~np.int64(0xFF)) | mapping[keys & 0xFF])
+        tables[name] = table
+    return _add_to_rutas_state(state, tables, exact_users, precision)
+
+def finalize_rutas_state(state, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    """Build rutas_users from a partial state."""
+    _compact_rutas_state(state, exact_users, precision)
+    groups = state['groups']
+    keys = groups['key'].to_numpy(dtype=np.int64)
+    exact = state['pairs'].groupby('key').size()
+    estimated = _hll_estimate(state['registers'], precision) if len(state['registers']) else pd.Series(dtype='int64')
+    total_users = exact.reindex(keys).fillna(estimated.reindex(keys)).fillna(0).astype('int64')
+
+    user_types = np.array(state['user_types'] or [''], dtype=object)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rutas = pd.DataFrame({
+            'station_origin_id': pd.array(keys >> 24, dtype='UInt16'),
+            'station_dest_id': pd.array((keys >> 8) & 0xFFFF, dtype='UInt16'),
+            'user_type': pd.Categorical(user_types[keys & 0xFF], categories=sorted(state['user_types'])),
+            # Mismos tipos que la agregación en memoria (nullable como las columnas de origen)
+            'total_viajes': pd.array(groups['viajes'].to_numpy().astype('int64'), dtype='Int64'),
+            'avg_duration_seconds': pd.array(groups['duration_sum'].to_numpy() / groups['duration_count'].to_numpy(), dtype='Float64'),
+            'avg_distance_km': groups['distance_sum'].to_numpy() / groups['distance_count'].to_numpy(),
+            'total_users': total_users.to_numpy(),
+        })
+    return rutas.sort_values(['station_origin_id', 'station_dest_id', 'user_type']).reset_index(drop=True)
+
+def _state_prefix(partition):
+    return f"{RUTAS_STATE_PREFIX}{partition['partition']}/"
+
+def load_rutas_state(partition, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    """Stored state of a process-zone partition, if it was built from its current content."""
+    prefix = _state_prefix(partition)
+    info = read_json_object('access-zone', prefix + 'state.json')
+    if (not info or info['source_etag'] != partition['etag']
+            or info['exact_users'] != exact_users or info['precision'] != precision):
+        return None
+    state = {'user_types': info['user_types']}
+    for name in _STATE_TABLES:
+        state[name] = read_parquet_object('access-zone', f"{prefix}{name}.parquet")
+        if state[name] is None:
+            return None
+    return state
+
+def save_rutas_state(partition, state, exact_users=RUTAS_EXACT_USERS, precision=RUTAS_HLL_PRECISION):
+    prefix = _state_prefix(partition)
+    for name in _STATE_TABLES:
+        write_parquet_object('access-zone', f"{prefix}{name}.parquet", state[name])
+    # state.json se escribe al final: marca el estado como completo
+    write_json_object('access-zone', prefix + 'state.json', {
+        'source_etag': partition['etag'], 'exact_users': exact_users,
+        'precision': precision, 'user_types': state['user_types'],
+    })
+
+@instrument
+def build_rutas_partition_state(partition, batch_rows=RUTAS_BATCH_ROWS):
+    """Partial state of one process-zone partition, read in record batches."""
+    state = empty_rutas_state()
+    parquet_file = pq.ParquetFile(open_object_file('process-zone', partition['object_name']))
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=RUTAS_COLUMNS):
+        fold_rutas_batch(state, batch.to_pandas())
+    return _compact_rutas_state(state)
+
+@instrument
+def rutes_users_popularity_stream(partition_filter=None):
+    """
+    rutas_users en memoria acotada: un estado parcial por partición (día),
+    reutilizado si la partición no ha cambiado, y combinado en uno final.
+    """
+    state = empty_rutas_state()
+    for partition in list_dataset_partitions('process-zone', 'data/bicimad/', partition_filter):
+        partition_state = load_rutas_state(partition)
+        if partition_state is None:
+            partition_state = build_rutas_partition_state(partition)
+            save_rutas_state(partition, partition_state)
+        merge_rutas_states(state, partition_state)
+    return finalize_rutas_state(state)
+
+@instrument
+def create_rutas_cube(rutas_users):
+    """
+    Crea el cubo de rutas (una fila por grupo de cada grouping set) a partir de rutas_users.
+    """
+    # Clave numérica de ruta para contar rutas distintas sin construir strings
+    rutas = rutas_users.assign(
+        ruta=rutas_users['station_origin_id'].astype('int64') * 65536 + rutas_users['station_dest_id'].astype('int64')
+    )
+
+    grupos = []
+    for grouping_set, dims in RUTAS_GROUPING_SETS.items():
+        aggs = dict(
+            total_viajes=('total_viajes', 'sum'),
+            rutas_distintas=('ruta', 'nunique'),
+            avg_duration_seconds=('avg_duration_seconds', 'mean'),
+            avg_distance_km=('avg_distance_km', 'mean'),
+        )
+        if dims:
+            grupo = rutas.groupby(dims, observed=True).agg(**aggs).reset_index()
+        else:
+            grupo = rutas.assign(_total=0).groupby('_total').agg(**aggs).reset_index(drop=True)
+        grupos.append(grupo.assign(grouping_set=grouping_set))
+
+    cube = pd.concat(grupos, ignore_index=True)
+    cube['grouping_set'] = cube['grouping_set'].astype('category')
+
+    # Las dimensiones que no forman parte del grupo quedan a nulo
+    for col in ['station_origin_id', 'station_dest_id', 'user_type']:
+        cube[col] = cube[col].astype(rutas_users[col].dtype)
+
+    return cube[['grouping_set', 'station_origin_id', 'station_dest_id', 'user_type',
+                 'total_viajes', 'rutas_distintas', 'avg_duration_seconds', 'avg_distance_km']]
+
+@instrument
+def create_rutas_top(cube, k=RUTAS_TOP_K):
+    """
+    Top-k rutas por número de viajes, global (user_type nulo) y por tipo de usuario.
+    """
+    order = ['total_viajes', 'station_origin_id', 'station_dest_id']
+    ascending = [False, True, True]
+
+    top_global = cube[cube['grouping_set'] == 'ruta'].sort_values(order, ascending=ascending).head(k)
+    top_global = top_global.assign(ranking=range(1, len(top_global) + 1))
 
+    por_usuario = cube[cube['grouping_set'] == 'ruta_usuario'].sort_values(['user_type'] + order, ascending=[True] + ascending)
+    top_usuario = por_usuario.groupby('user_type', observed=True).head(k)
+    top_usuario = top_usuario.assign(ranking=top_usuario.groupby('user_type', observed=True).cumcount() + 1)
+
+    top = pd.concat([top_global, top_usuario], ignore_index=True)
+    top['ranking'] = top['ranking'].astype('UInt8')
+    return top[['user_type', 'ranking', 'station_origin_id', 'station_dest_id', 'total_viajes']]
+
+@instrument
+def merge_parkings(parkings, ubicaciones):
+    """
+    Limpia y une la ocupación de los parkings con su información y ubicación.
+    """
     # Limpieza básica
     parkings = parkings.dropna()  # Eliminar filas con valores nulos
     ubicaciones = ubicaciones.dropna()
@@ -72,14 +570,21 @@ def clean_and_merge_parkings():
 
     return merged
 
-def main():
-    print("Starting data preparation for the Access Zone...")
+@instrument
+def clean_and_merge_parkings(partition_filter=None):
+    # Descargar los datos parquet de MinIO usando la función proporcionada
+    parkings = download_partitioned_dataframe_from_minio('process-zone', 'invent/parkings/', partition_filter=partition_filter)
+    ubicaciones = download_dataframe_from_minio('process-zone', 'apar/aparcamientos.parquet', format='parquet')
+    return merge_parkings(parkings, ubicaciones)
 
-    # 1. Crear dataset de aparcamientos limpio y unido
-    parkings_unidos = clean_and_merge_parkings()
-    df = parkings_unidos.copy()
+@instrument
+def parkings_variability(parkings_unidos):
+    """
+    Ocupación media y variabilidad (total, por hora y por día de la semana) de cada parking.
+    """
+    df = parkings_unidos
 
-# Variabilidad total por parking
+    # Variabilidad total por parking
     agg_parking = df.groupby(['parking_id', 'name', 'address', 'latitude', 'longitude', 'total_capacity']).agg(
         avg_occupancy_pct=('occupancy_pct', 'mean'),
         std_occupancy_pct=('occupancy_pct', 'std')
@@ -95,6 +600,93 @@ def main():
 
     # Fusionar todo
     final_df = agg_parking.merge(hour_var, on='parking_id').merge(day_var, on='parking_id')
+    return final_df
+
+# Momentos de occupancy_pct: una fila por (level, parking_id, value), donde
+# value es la hora o el día de la semana (0 en el nivel 'parking')
+_MOMENT_LEVELS = {'parking': None, 'hour': 'hour', 'weekday': 'weekday'}
+_MOMENT_KEYS = ['level', 'parking_id', 'value']
+_PARKING_INFO = ['parking_id', 'name', 'address', 'latitude', 'longitude', 'total_capacity']
+
+def occupancy_moments(parkings):
+    """Count, mean and M2 of occupancy_pct per parking, parking and hour, and parking and weekday."""
+    # Misma limpieza que merge_parkings
+    parkings = parkings.dropna()
+    parkings.columns = parkings.columns.str.lower()
+
+    tables = []
+    for level, column in _MOMENT_LEVELS.items():
+        occupancy = pd.DataFrame({
+            'parking_id': parkings['parking_id'].astype('int64'),
+            'value': parkings[column].astype('int64') if column else 0,
+            'occupancy_pct': parkings['occupancy_pct'].astype('float64'),
+        }).groupby(['parking_id', 'value'])['occupancy_pct']
+        moments = occupancy.agg(['size', 'mean']).rename(columns={'size': 'count'})
+        moments['m2'] = occupancy.var(ddof=0) * moments['count']
+        tables.append(moments.reset_index().assign(level=level))
+    moments = pd.concat(tables, ignore_index=True)
+    moments['count'] = moments['count'].astype('float64')
+    return moments[_MOMENT_KEYS + ['count', 'mean', 'm2']]
+
+def merge_moments(partials, sign=None):
+    """Combine (count, mean, M2) states (Chan et al.); a sign of -1 takes a state out."""
+    sign = sign or [1] * len(partials)
+    moments = pd.concat([partial.assign(sign=float(factor)) for partial, factor in zip(partials, sign)], ignore_index=True)
+    moments['weight'] = moments['sign'] * moments['count']
+    moments['weighted_mean'] = moments['weight'] * moments['mean']
+    grouped = moments.groupby(_MOMENT_KEYS, sort=False)
+    merged = grouped[['weight', 'weighted_mean']].sum()
+    merged = merged[merged['weight'].round() > 0]
+    merged['mean'] = merged['weighted_mean'] / merged['weight']
+
+    # M2 = Σ signo · (M2_i + n_i · (media_i - media)²)
+    mean = merged['mean'].reindex(pd.MultiIndex.from_frame(moments[_MOMENT_KEYS])).to_numpy()
+    moments['m2'] = moments['sign'] * (moments['m2'] + moments['count'] * (moments['mean'] - mean) ** 2)
+    merged['m2'] = moments.groupby(_MOMENT_KEYS, sort=False)['m2'].sum().reindex(merged.index).clip(lower=0)
+    merged['count'] = merged['weight'].round()
+    return merged.reset_index()[_MOMENT_KEYS + ['count', 'mean', 'm2']]
+
+def variability_from_moments(moments, ubicaciones):
+    """parkings-visualizaciones (same columns as parkings_variability) from merged moments."""
+    ubicaciones = ubicaciones.dropna()
+    ubicaciones.columns = ubicaciones.columns.str.lower()
+
+    # Desviación típica muestral (ddof=1), nula con una sola observación
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(moments['m2'] / (moments['count'] - 1)).where(moments['count'] > 1)
+    moments = moments.assign(std=std, parking_id=moments['parking_id'].astype(ubicaciones['parking_id'].dtype))
+
+    parking = moments[moments['level'] == 'parking']
+    agg_parking = ubicaciones[_PARKING_INFO].merge(
+        parking[['parking_id', 'mean', 'std']].rename(columns={'mean': 'avg_occupancy_pct', 'std': 'std_occupancy_pct'}),
+        on='parking_id'
+    ).sort_values(_PARKING_INFO).reset_index(drop=True)
+
+    # Variabilidad por hora y por día: media de las desviaciones de cada grupo
+    hour_var = moments[moments['level'] == 'hour'].groupby('parking_id')['std'].mean().reset_index(name='hour_variability')
+    day_var = moments[moments['level'] == 'weekday'].groupby('parking_id')['std'].mean().reset_index(name='weekday_variability')
+    return agg_parking.merge(hour_var, on='parking_id').merge(day_var, on='parking_id')
+
+def _parkings_partition_moments(partition):
+    return occupancy_moments(download_dataframe_from_minio('process-zone', partition['object_name'], format='parquet'))
+
+@instrument
+def update_parkings_variability():
+    """
+    parkings-visualizaciones incremental: combina en los momentos guardados
+    solo las particiones de ocupación nuevas o modificadas.
+    """
+    moments = update_partial_state(
+        PARKINGS_STATE_PREFIX, 'invent/parkings/',
+        _parkings_partition_moments, merge_moments,
+        empty=occupancy_moments(pd.DataFrame(columns=['parking_id', 'occupancy_pct', 'hour', 'weekday']))
+    )
+    ubicaciones = download_dataframe_from_minio('process-zone', 'apar/aparcamientos.parquet', format='parquet')
+    return variability_from_moments(moments, ubicaciones)
+
+# Cada dataset de access-zone es una tarea independiente (ver pipeline.py)
+
+def _upload_parkings_variability(final_df):
     meta_parkings2 = {
         'description': 'Datos l3impios y unidos de aparcamientos públicos con ubicación',
         'purpose': 'Visualización3 y análisis para ciudadanos',
@@ -109,11 +701,32 @@ def main():
         metadata=meta_parkings2
     )
     log_data_transformation(
-        'process-zone', 'parkings_rotacion.parquet',
-        'access-zone', 'analytics/parkings_visualizaciones.parquet',
+        'multiple', PARKINGS_SOURCES,
+        'access-zone', 'analytics/parkings-visualizaciones.parquet',
         'PAra visualizaciones'
     )
 
+@instrument
+def access_parkings_variability():
+    """
+    parkings-visualizaciones incremental: solo lee las particiones de
+    ocupación nuevas o modificadas, sin reconstruir parkings_unidos.
+    """
+    _upload_parkings_variability(update_parkings_variability())
+
+@instrument
+def access_parkings():
+    """
+    parkings_unidos: copia fila a fila de todo el histórico de ocupación con
+    la ubicación, que se reconstruye completa en cada ejecución. Con
+    PARKINGS_INCREMENTAL=0 también calcula parkings-visualizaciones a partir
+    de ella; si no, la refresca access_parkings_variability.
+    """
+    # 1. Crear dataset de aparcamientos limpio y unido
+    parkings_unidos = clean_and_merge_parkings()
+    if not PARKINGS_INCREMENTAL:
+        _upload_parkings_variability(parkings_variability(parkings_unidos))
+
     # 2. Subir el dataset unido a la zona access en formato parquet
     meta_parkings = {
         'description': 'Datos limpios y unidos de aparcamientos públicos con ubicación',
@@ -131,21 +744,17 @@ def main():
     )
 
     log_data_transformation(
-        'process-zone', 'parkings_rotacion.parquet',
+        'multiple', PARKINGS_SOURCES,
         'access-zone', 'analytics/parkings_unidos.parquet',
         'Datos limpios y unidos de aparcamientos públicos con ubicación'
     )
 
-    print("Access Zone preparation complete!")
-
-    print("Starting data preparation for the Access Zone...")
-
-
-    conegestion_hora = create_trafico_congestion_summary()
-    rutas_users = rutes_users_popularity()
-
-    # 2. Upload to access-zone
-    print("\nUploading analytics-ready data to access-zone...")
+@instrument
+def access_congestion():
+    if CONGESTION_INCREMENTAL:
+        conegestion_hora = update_congestion_summary()
+    else:
+        conegestion_hora = create_trafico_congestion_summary()
 
     sales_meta = {
         'description': 'Congestion summary by hour',
@@ -161,11 +770,15 @@ def main():
         metadata=sales_meta
     )
     log_data_transformation(
-        'process-zone', 'traf/trafico.parquet',
+        'process-zone', 'traf/trafico/',
         'access-zone', 'analytics/congestion_by_hour.parquet',
         'Congestion summary by hour',
     )
 
+@instrument
+def access_rutas():
+    rutas_users = rutes_users_popularity()
+
     # 3. Create additional datasets
     meta2 = {
         'description': 'Usos de rutas por tipo de usuario',
@@ -181,13 +794,69 @@ def main():
         metadata=meta2
     )
     log_data_transformation(
-        'process-zone', 'data/bicimad.parquet',
+        'process-zone', 'data/bicimad/',
         'access-zone', 'analytics/rutas_users.parquet',
         'Rutas populares por tipo de usuario',
     )
 
+    # 4. Cubo de rutas y top-k precalculados para los dashboards
+    rutas_cube = create_rutas_cube(rutas_users)
+    rutas_top = create_rutas_top(rutas_cube)
+
+    meta_cube = {
+        'description': 'Cubo de rutas BiciMAD por origen, destino y tipo de usuario',
+        'purpose': 'Consultas de rutas precalculadas para dashboards',
+        'refresh_frequency': 'Daily',
+        'target_users': 'Traffic analysts, city planners',
+    }
+    upload_dataframe_to_minio(
+        rutas_cube,
+        'access-zone',
+        'analytics/rutas_cube.parquet',
+        format='parquet',
+        metadata=meta_cube
+    )
+    log_data_transformation(
+        'access-zone', 'analytics/rutas_users.parquet',
+        'access-zone', 'analytics/rutas_cube.parquet',
+        'Rollup de rutas por grouping sets',
+    )
+
+    meta_top = {
+        'description': f'Top {RUTAS_TOP_K} rutas BiciMAD global y por tipo de usuario',
+        'purpose': 'Consultas de rutas precalculadas para dashboards',
+        'refresh_frequency': 'Daily',
+        'target_users': 'Traffic analysts, city planners',
+    }
+    upload_dataframe_to_minio(
+        rutas_top,
+        'access-zone',
+        'analytics/rutas_top.parquet',
+        format='parquet',
+        metadata=meta_top
+    )
+    log_data_transformation(
+        'access-zone', 'analytics/rutas_cube.parquet',
+        'access-zone', 'analytics/rutas_top.parquet',
+        f'Top {RUTAS_TOP_K} rutas por tipo de usuario',
+    )
+
+def main():
+    print("Starting data preparation for the Access Zone...")
+
+    access_parkings()
+    if PARKINGS_INCREMENTAL:
+        access_parkings_variability()
+
+    print("Access Zone preparation complete!")
 
+    print("Starting data preparation for the Access Zone...")
+
+    # 2. Upload to access-zone
+    print("\nUploading analytics-ready data to access-zone...")
 
+    access_congestion()
+    access_rutas()
 
     print("\nAccess Zone preparation complete!")
     print("Note: The Access Zone now contains analytics-ready datasets optimized for:")
@@ -198,4 +867,10 @@ def main():
     print("\nThese datasets are structured for easy consumption by various tools and users.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Metadata, lineage and quality events are written as one governance log
+    start_governance_run()
+    try:
+        main()
+    finally:
+        run = end_governance_run()
+        export_metrics(run.run_id)
@@ -0,0 +1,659 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import datetime
+import platform
+import resource
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from utils import (
+    get_minio_client,
+    upload_dataframe_to_minio,
+    upload_partitioned_dataframe_to_minio,
+    download_dataframe_from_minio,
+    download_partitioned_dataframe_from_minio,
+    validate_data_quality,
+    write_json_object,
+    start_governance_run,
+    end_governance_run,
+    QUALITY_MODE,
+    GOVERNANCE_BUCKET
+)
+import metrics
+from metrics import export_metrics
+import ingest_data
+import process_data
+import access_data
+import dimensional_bbdd
+
+# Filas de cada fuente de alto volumen (BiciMAD, tráfico, rotación de parkings)
+BENCH_ROWS = int(float(os.environ.get('BENCH_ROWS', '1e6')))
+# Los avisos son mucho menos frecuentes que los viajes o las lecturas horarias
+BENCH_AVISA_ROWS = int(float(os.environ.get('BENCH_AVISA_ROWS', str(max(BENCH_ROWS // 100, 1)))))
+BENCH_SEED = int(os.environ.get('BENCH_SEED', '42'))
+# Cardinalidades de Madrid: estaciones BiciMAD, abonados, puntos de medida
+# de tráfico y aparcamientos públicos
+BENCH_STATIONS = int(os.environ.get('BENCH_STATIONS', '611'))
+BENCH_USERS = int(os.environ.get('BENCH_USERS', '250000'))
+BENCH_SENSORS = int(os.environ.get('BENCH_SENSORS', '4200'))
+BENCH_PARKINGS = int(os.environ.get('BENCH_PARKINGS', '270'))
+# Los ficheros se generan por bloques: la memoria no depende de la escala
+BENCH_CHUNK_ROWS = int(float(os.environ.get('BENCH_CHUNK_ROWS', '1e6')))
+
+# Mismos nombres de fichero que ingest_data.SOURCES: BENCH_DIR sirve también
+# como RAW_DATA_DIR para ejecutar el pipeline completo a escala
+BENCH_DIR = os.environ.get('BENCH_DIR', '/tmp/benchmark/raw')
+BENCH_RESULTS_DIR = os.environ.get('BENCH_RESULTS_DIR', '/tmp/benchmark/results')
+# Resultados de una ejecución anterior con los que comparar
+BENCH_BASELINE = os.environ.get('BENCH_BASELINE')
+BENCH_DATASETS = os.environ.get('BENCH_DATASETS', 'bicimad,aparcamientos,parkings,trafico,avisa').split(',')
+BENCH_POSTGRES = os.environ.get('BENCH_POSTGRES', '1') == '1'
+BENCH_KEEP_OBJECTS = os.environ.get('BENCH_KEEP_OBJECTS', '0') == '1'
+BENCH_BUCKET = 'benchmark-zone'
+BENCH_PREFIX = 'benchmarks/'
+BENCH_MANIFEST = '_benchmark.json'
+
+START_DATE = np.datetime64('2024-12-01T00:00:00', 's')
+
+# Perfiles horarios (peso relativo de cada hora del día)
+TRIP_HOUR_PROFILE = np.array([
+    0.6, 0.3, 0.2, 0.1, 0.1, 0.3, 1.2, 3.5, 6.0, 4.5, 3.0, 3.2,
+    3.8, 4.2, 5.0, 4.0, 3.8, 4.8, 6.2, 6.0, 4.2, 2.8, 1.8, 1.1,
+])
+TRIP_HOUR_PROFILE = TRIP_HOUR_PROFILE / TRIP_HOUR_PROFILE.sum()
+TRAFFIC_HOUR_PROFILE = np.array([
+    0.25, 0.15, 0.10, 0.08, 0.10, 0.25, 0.55, 0.90, 1.00, 0.85, 0.70, 0.70,
+    0.75, 0.80, 0.85, 0.75, 0.75, 0.85, 0.95, 0.90, 0.70, 0.55, 0.45, 0.35,
+])
+PARKING_HOUR_PROFILE = np.array([
+    0.30, 0.25, 0.22, 0.20, 0.20, 0.22, 0.30, 0.45, 0.65, 0.78, 0.85, 0.88,
+    0.90, 0.88, 0.82, 0.80, 0.82, 0.85, 0.88, 0.85, 0.75, 0.60, 0.45, 0.35,
+])
+
+AVISA_CATEGORIES = {
+    'Aceras y calzadas': ['Baldosa suelta', 'Socavón', 'Asfalto deteriorado', 'Bache', 'Bordillo roto'],
+    'Alcantarillado': ['Alcantarilla atascada', 'Inundación', 'Malos olores', 'Tapa de registro rota'],
+    'Alumbrado': ['Farola apagada', 'Cable suelto', 'Farola intermitente', 'Tapa abierta'],
+    'Contenedores y papeleras': ['Contenedor desbordado', 'Papelera llena', 'Contenedor roto', 'Papelera rota'],
+    'Fuentes': ['Fuente sin agua', 'Botón averiado', 'Fuente perdiendo agua', 'Fuente sucia'],
+    'Grafitis': ['Grafiti en fachada', 'Grafiti en mobiliario', 'Grafiti en señal', 'Tag'],
+    'Limpieza': ['Residuos', 'Excrementos caninos', 'Manchas en pavimento', 'Pintadas'],
+    'Mobiliario urbano': ['Bancos', 'Vallas', 'Barandillas', 'Bolardos', 'Marquesinas'],
+    'Señalización': ['Semáforo averiado', 'Paso de peatones borrado', 'Señal dañada', 'Pintura desgastada'],
+    'Zonas verdes': ['Rama peligrosa', 'Árbol caído', 'Falta riego', 'Plaga', 'Cesped deteriorado'],
+}
+DISTRICTS = [
+    'Centro', 'Arganzuela', 'Retiro', 'Salamanca', 'Chamartín', 'Tetuán', 'Chamberí',
+    'Fuencarral-El Pardo', 'Moncloa-Aravaca', 'Latina', 'Carabanchel', 'Usera',
+    'Puente de Vallecas', 'Moratalaz', 'Ciudad Lineal', 'Hortaleza', 'Villaverde',
+    'Villa de Vallecas', 'Vicálvaro', 'San Blas-Canillejas', 'Barajas',
+]
+STREETS = [
+    'Calle Mayor', 'Calle de Alcalá', 'Gran Vía', 'Calle de Serrano', 'Paseo de la Castellana',
+    'Calle de Atocha', 'Calle de Princesa', 'Calle de Bravo Murillo', 'Paseo del Prado',
+    'Calle de Velázquez', 'Calle de Goya', 'Calle de Fuencarral', 'Avenida de América',
+]
+
+# ---------------------------------------------------------------------------
+# Generador sintético
+# ---------------------------------------------------------------------------
+
+def _source_rng(seed, source_index):
+    """Random stream of the per-source constants (popularity, capacities...)."""
+    return np.random.default_rng([seed, source_index])
+
+def _chunk_rng(seed, source_index, chunk_index):
+    """Independent random stream of one chunk: same seed, same bytes."""
+    return np.random.default_rng([seed, source_index, chunk_index])
+
+def _labels(codes, values):
+    """String array from category codes without building Python strings."""
+    return pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()), pa.array(values)).dictionary_decode()
+
+def _popularity(rng, count, exponent):
+    """Zipf-like weights over randomly ordered ids (a few very popular ones)."""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+def _write_csv_chunks(path, chunks):
+    """Write Arrow tables to one CSV file, with an unquoted header like the sources."""
+    with open(path, 'wb') as f:
+        for index, table in enumerate(chunks):
+            if index == 0:
+                f.write((','.join(table.column_names) + '\n').encode('utf-8'))
+            pacsv.write_csv(table, f, write_options=pacsv.WriteOptions(include_header=False, quoting_style='none'))
+
+def _chunks(rows, chunk_rows):
+    for start in range(0, rows, chunk_rows):
+        yield start // chunk_rows, start, min(chunk_rows, rows - start)
+
+def aparcamientos_capacities(seed=BENCH_SEED, parkings=BENCH_PARKINGS):
+    """Capacity of every generated parking (shared by the rotation data)."""
+    return _source_rng(seed, 3).integers(150, 1200, parkings)
+
+def generate_bicimad(path, rows, seed=BENCH_SEED, stations=BENCH_STATIONS, users=BENCH_USERS, chunk_rows=BENCH_CHUNK_ROWS):
+    """BiciMAD trips: popular stations, commuting peaks and lognormal durations."""
+    station_weights = _popularity(_source_rng(seed, 0), stations, 0.8)
+    # Unos 20.000 viajes al día
+    days = max(1, math.ceil(rows / 20000))
+
+    def chunk(chunk_index, start, n):
+        rng = _chunk_rng(seed, 0, chunk_index)
+        day = rng.integers(0, days, n)
+        hour = rng.choice(24, n, p=TRIP_HOUR_PROFILE)
+        start_time = START_DATE + (day * 86400 + hour * 3600 + rng.integers(0, 3600, n)).astype('timedelta64[s]')
+        duration = np.clip(rng.lognormal(np.log(780), 0.5, n), 120, 10800).astype(np.int64)
+        speed = np.clip(rng.normal(11, 2, n), 5, 20)
+        distance = np.round(duration / 3600 * speed, 2)
+        return pa.table({
+            'id': np.arange(start + 1, start + n + 1),
+            'usuario_id': rng.integers(1, users + 1, n),
+            'tipo_usuario': _labels(rng.random(n) >= 0.85, ['Anual', 'Ocasional']),
+            'estacion_origen': rng.choice(stations, n, p=station_weights) + 1,
+            'estacion_destino': rng.choice(stations, n, p=station_weights) + 1,
+            'fecha_hora_inicio': start_time,
+            'fecha_hora_fin': start_time + duration.astype('timedelta64[s]'),
+            'duracion_segundos': duration,
+            'distancia_km': distance,
+            'calorias_estimadas': np.round(distance * 53.3).astype(np.int64),
+            'co2_evitado_gramos': np.round(distance * 200).astype(np.int64),
+        })
+
+    _write_csv_chunks(path, (chunk(*args) for args in _chunks(rows, chunk_rows)))
+
+def generate_trafico(path, rows, seed=BENCH_SEED, sensors=BENCH_SENSORS, chunk_rows=BENCH_CHUNK_ROWS):
+    """Hourly readings per sensor, ordered by sensor and hour like the source file."""
+    hours = max(1, math.ceil(rows / sensors))
+    # Volumen en hora punta de cada punto de medida
+    peak_volume = _source_rng(seed, 1).lognormal(np.log(900), 0.6, sensors)
+
+    def chunk(chunk_index, start, n):
+        rng = _chunk_rng(seed, 1, chunk_index)
+        row = np.arange(start, start + n)
+        sensor = row // hours
+        hour_index = row % hours
+        load = TRAFFIC_HOUR_PROFILE[hour_index % 24] * rng.lognormal(0, 0.15, n)
+        total = np.round(peak_volume[sensor] * load).astype(np.int64)
+        speed = np.clip(np.round(80 - 55 * np.minimum(load, 1.2) + rng.normal(0, 6, n)), 5, 110).astype(np.int64)
+        congestion = np.select([speed >= 55, speed >= 40, speed >= 25], [0, 1, 2], 3)
+        return pa.table({
+            'sensor_id': sensor + 1,
+            'fecha_hora': START_DATE + (hour_index * 3600).astype('timedelta64[s]'),
+            'total_vehiculos': total,
+            'coches': np.floor(total * 0.75).astype(np.int64),
+            'motos': np.floor(total * 0.06).astype(np.int64),
+            'camiones': np.floor(total * 0.17).astype(np.int64),
+            'buses': np.floor(total * 0.02).astype(np.int64),
+            'velocidad_media_kmh': speed,
+            'nivel_congestion': _labels(congestion, ['Baja', 'Moderada', 'Alta', 'Muy Alta']),
+        })
+
+    _write_csv_chunks(path, (chunk(*args) for args in _chunks(rows, chunk_rows)))
+
+def generate_parkings(path, rows, seed=BENCH_SEED, parkings=BENCH_PARKINGS, chunk_rows=BENCH_CHUNK_ROWS):
+    """Hourly occupancy per parking, consistent with the published percentage."""
+    hours = max(1, math.ceil(rows / parkings))
+    capacity = aparcamientos_capacities(seed, parkings)
+    fill = _source_rng(seed, 2).uniform(0.5, 1.0, parkings)
+
+    def chunk(chunk_index, start, n):
+        rng = _chunk_rng(seed, 2, chunk_index)
+        row = np.arange(start, start + n)
+        parking = row // hours
+        hour_index = row % hours
+        hour = hour_index % 24
+        ratio = np.clip(PARKING_HOUR_PROFILE[hour] * fill[parking] + rng.normal(0, 0.05, n), 0, 1)
+        occupied = np.round(capacity[parking] * ratio).astype(np.int64)
+        return pa.table({
+            'aparcamiento_id': parking + 1,
+            'fecha': (START_DATE + (hour_index // 24 * 86400).astype('timedelta64[s]')).astype('datetime64[D]'),
+            'hora': hour,
+            'plazas_ocupadas': occupied,
+            'plazas_libres': capacity[parking] - occupied,
+            'porcentaje_ocupacion': np.round(occupied * 100 / capacity[parking], 1),
+        })
+
+    _write_csv_chunks(path, (chunk(*args) for args in _chunks(rows, chunk_rows)))
+
+def generate_aparcamientos(path, seed=BENCH_SEED, parkings=BENCH_PARKINGS):
+    """Parking master data (one row per parking)."""
+    rng = _chunk_rng(seed, 3, 0)
+    capacity = aparcamientos_capacities(seed, parkings)
+    ids = np.arange(1, parkings + 1)
+    streets = rng.integers(0, len(STREETS), parkings)
+    pd.DataFrame({
+        'aparcamiento_id': ids,
+        'nombre': [f"Aparcamiento {STREETS[street]} {i}" for i, street in zip(ids, streets)],
+        'direccion': [f"{STREETS[street]} {number} Madrid" for street, number in zip(streets, rng.integers(1, 200, parkings))],
+        'capacidad_total': capacity,
+        'plazas_movilidad_reducida': np.round(capacity * 0.02).astype(int) + 1,
+        'plazas_vehiculos_electricos': np.round(capacity * rng.uniform(0.02, 0.06, parkings)).astype(int),
+        'tarifa_hora_euros': np.round(rng.uniform(2.5, 3.6, parkings), 2),
+        'horario': np.where(rng.random(parkings) < 0.85, '24 horas', '07:00 - 23:00'),
+        'latitud': np.round(rng.uniform(40.38, 40.48, parkings), 4),
+        'longitud': np.round(rng.uniform(-3.75, -3.63, parkings), 4),
+    }).to_csv(path, index=False)
+
+def generate_avisa(path, rows, seed=BENCH_SEED, chunk_rows=BENCH_CHUNK_ROWS):
+    """Avisa Madrid incidents as one JSON array, written chunk by chunk."""
+    categories = list(AVISA_CATEGORIES)
+    subcategories = [(category, sub) for category in categories for sub in AVISA_CATEGORIES[category]]
+    days = max(1, math.ceil(rows / 2000))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for chunk_index, start, n in _chunks(rows, chunk_rows):
+            rng = _chunk_rng(seed, 4, chunk_index)
+            sub = rng.integers(0, len(subcategories), n)
+            district = rng.integers(0, len(DISTRICTS), n)
+            reported = START_DATE + rng.integers(0, days * 86400, n).astype('timedelta64[s]')
+            state = rng.choice(4, n, p=[0.25, 0.25, 0.12, 0.38])
+            resolved = reported + rng.integers(3600, 10 * 86400, n).astype('timedelta64[s]')
+            chunk = pd.DataFrame({
+                'id': np.arange(start + 1, start + n + 1),
+                'categoria': [subcategories[i][0] for i in sub],
+                'subcategoria': [subcategories[i][1] for i in sub],
+                'descripcion': [f"{subcategories[i][1]} en {DISTRICTS[d]}" for i, d in zip(sub, district)],
+                'distrito': np.array(DISTRICTS)[district],
+                'fecha_reporte': np.datetime_as_string(reported).astype(object),
+                'estado': np.array(['Recibida', 'Asignada', 'En tramitación', 'Resuelta'])[state],
+                'fecha_resolucion': np.where(state == 3, np.datetime_as_string(resolved).astype(object), None),
+                'latitud': np.round(rng.uniform(40.35, 40.50, n), 4),
+                'longitud': np.round(rng.uniform(-3.80, -3.58, n), 4),
+                'prioridad': np.array(['Baja', 'Media', 'Alta'])[rng.choice(3, n, p=[0.2, 0.45, 0.35])],
+                'origen': np.array(['App móvil', 'Web', 'Teléfono 010'])[rng.choice(3, n, p=[0.6, 0.3, 0.1])],
+                'likes': rng.poisson(11, n),
+            })
+            for col in ('fecha_reporte', 'fecha_resolucion'):
+                chunk[col] = chunk[col].str.replace('T', ' ', regex=False)
+            records = chunk.to_json(orient='records', force_ascii=False)
+            f.write((',' if start else '') + records[1:-1])
+        f.write(']')
+
+# Fuente -> generador; el fichero es el de ingest_data.SOURCES
+GENERATORS = {
+    'bicimad': lambda path, config: generate_bicimad(path, config['rows'], config['seed'], config['stations'], config['users'], config['chunk_rows']),
+    'trafico': lambda path, config: generate_trafico(path, config['rows'], config['seed'], config['sensors'], config['chunk_rows']),
+    'parkings': lambda path, config: generate_parkings(path, config['rows'], config['seed'], config['parkings'], config['chunk_rows']),
+    'aparcamientos': lambda path, config: generate_aparcamientos(path, config['seed'], config['parkings']),
+    'avisa': lambda path, config: generate_avisa(path, config['avisa_rows'], config['seed'], config['chunk_rows']),
+}
+
+def source_path(name, directory=BENCH_DIR):
+    source = next(source for source in ingest_data.SOURCES if source['name'] == name)
+    return os.path.join(directory, source['file'])
+
+def benchmark_config():
+    return {
+        'rows': BENCH_ROWS,
+        'avisa_rows': BENCH_AVISA_ROWS,
+        'seed': BENCH_SEED,
+        'stations': BENCH_STATIONS,
+        'users': BENCH_USERS,
+        'sensors': BENCH_SENSORS,
+        'parkings': BENCH_PARKINGS,
+        'chunk_rows': BENCH_CHUNK_ROWS,
+    }
+
+# ---------------------------------------------------------------------------
+# Medición por etapa
+# ---------------------------------------------------------------------------
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss_bytes():
+    """Resident memory of this process right now (peak RSS where /proc is missing)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class RssSampler(threading.Thread):
+    """Sample the RSS in the background to get the peak of a single stage.
+
+    ru_maxrss only grows, so after the first large stage it says nothing
+    about the next ones.
+    """
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = current_rss_bytes()
+        self.peak_rss = self.start_rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+def measure(results, dataset, stage, rows, func, *args, **kwargs):
+    """Run one stage, append its timings, memory and MinIO I/O to results and return its value."""
+    minio_before = metrics.snapshot()['minio']
+    sampler = RssSampler()
+    sampler.start()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    error = None
+    value = None
+    try:
+        value = func(*args, **kwargs)
+        return value
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        sampler.stop()
+        minio_after = metrics.snapshot()['minio']
+        if rows is None and isinstance(value, pd.DataFrame):
+            rows = len(value)
+        results.append({
+            'dataset': dataset,
+            'stage': stage,
+            'status': 'failed' if error else 'done',
+            'error': error,
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'cpu_seconds': round(cpu_seconds, 4),
+            'rows_per_second': round(rows / seconds, 1) if rows and seconds else None,
+            'peak_rss_bytes': sampler.peak_rss,
+            'rss_growth_bytes': sampler.peak_rss - sampler.start_rss,
+            'minio_requests': minio_after['requests'] - minio_before['requests'],
+            'minio_bytes_read': minio_after['bytes_read'] - minio_before['bytes_read'],
+            'minio_bytes_written': minio_after['bytes_written'] - minio_before['bytes_written'],
+        })
+
+def generate_sources(results, config, directory=BENCH_DIR, datasets=BENCH_DATASETS):
+    """Generate the raw files, reusing them if they were built with the same config."""
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, BENCH_MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('config') != config:
+        manifest = {'config': config, 'sources': {}}
+
+    # parkings referencia los aparcamientos generados
+    names = set(datasets) | ({'aparcamientos'} if 'parkings' in datasets else set())
+    for name in GENERATORS:
+        if name not in names:
+            continue
+        path = source_path(name, directory)
+        if name in manifest['sources'] and os.path.exists(path):
+            print(f"Reusing {path}")
+            continue
+        rows = config['avisa_rows'] if name == 'avisa' else config['parkings'] if name == 'aparcamientos' else config['rows']
+        measure(results, name, 'generate', rows, GENERATORS[name], path, config)
+        manifest['sources'][name] = {'file': os.path.basename(path), 'bytes': os.path.getsize(path), 'rows': rows}
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Generated {path} ({rows} rows)")
+
+    # El dump municipal no se escala: se copia para poder ingerir BENCH_DIR entero
+    dump = source_path('municipal_db', ingest_data.RAW_DATA_DIR)
+    if os.path.exists(dump) and not os.path.exists(source_path('municipal_db', directory)):
+        shutil.copy(dump, source_path('municipal_db', directory))
+    return manifest
+
+# ---------------------------------------------------------------------------
+# Benchmark de las etapas del pipeline
+# ---------------------------------------------------------------------------
+
+STANDARDIZERS = {
+    'bicimad': process_data.standardize_bicimad_usos,
+    'aparcamientos': process_data.standardize_aparcamientos_info,
+    'parkings': process_data.standardize_parkings_rotacion,
+    'trafico': process_data.standardize_trafico_horario,
+    'avisa': process_data.standardize_avisa,
+}
+
+# Mismo destino que process_data, bajo benchmark-zone/{run_id}/
+PROCESS_OBJECTS = {
+    'bicimad': ('data/bicimad', True),
+    'aparcamientos': ('apar/aparcamientos.parquet', False),
+    'parkings': ('invent/parkings', True),
+    'trafico': ('traf/trafico', True),
+    'avisa': ('avisa/avisos.parquet', False),
+}
+
+def _read_source(name, path):
+    if name == 'avisa':
+        return pd.read_json(path, encoding='utf-8')
+    return pd.read_csv(path)
+
+def benchmark_process(results, name, run_id, directory, aparcamientos_ids=None):
+    """Read, standardize, validate and upload one raw source."""
+    path = source_path(name, directory)
+    raw = measure(results, name, 'read', None, _read_source, name, path)
+    rows = len(raw)
+    std = measure(results, name, 'standardize', rows, STANDARDIZERS[name], raw)
+    del raw
+
+    rules = process_data.QUALITY_RULES[name]
+    if name == 'parkings' and aparcamientos_ids is not None:
+        rules = dict(rules, references={'parking_id': aparcamientos_ids})
+    measure(results, name, 'validate', rows, validate_data_quality, std, f"benchmark_{name}", rules=rules, store=False)
+
+    object_name, partitioned = PROCESS_OBJECTS[name]
+    if partitioned:
+        measure(results, name, 'upload', rows, upload_partitioned_dataframe_to_minio, std, BENCH_BUCKET, f"{run_id}/{object_name}")
+    else:
+        measure(results, name, 'upload', rows, upload_dataframe_to_minio, std, BENCH_BUCKET, f"{run_id}/{object_name}", format='parquet')
+    return std
+
+def _download(run_id, name, columns=None):
+    object_name, partitioned = PROCESS_OBJECTS[name]
+    if partitioned:
+        return download_partitioned_dataframe_from_minio(BENCH_BUCKET, f"{run_id}/{object_name}/", columns=columns)
+    return download_dataframe_from_minio(BENCH_BUCKET, f"{run_id}/{object_name}", format='parquet', columns=columns)
+
+def _rutas(df):
+    rutas_users = access_data.summarize_rutas(df)
+    cube = access_data.create_rutas_cube(rutas_users)
+    access_data.create_rutas_top(cube)
+    return rutas_users
+
+def benchmark_access(results, run_id, datasets):
+    """Download the processed data back and build the access-zone aggregates."""
+    outputs = {}
+    if 'bicimad' in datasets:
+        df = measure(results, 'rutas', 'download', None, _download, run_id, 'bicimad', access_data.RUTAS_COLUMNS)
+        outputs['rutas_users'] = measure(results, 'rutas', 'aggregate', len(df), _rutas, df)
+    if 'trafico' in datasets:
+        df = measure(results, 'congestion', 'download', None, _download, run_id, 'trafico', access_data.CONGESTION_COLUMNS)
+        measure(results, 'congestion', 'aggregate', len(df), access_data.summarize_congestion, df)
+    if 'parkings' in datasets:
+        parkings = measure(results, 'parkings_access', 'download', None, _download, run_id, 'parkings')
+        ubicaciones = _download(run_id, 'aparcamientos')
+        merged = measure(results, 'parkings_access', 'aggregate', len(parkings), access_data.merge_parkings, parkings, ubicaciones)
+        measure(results, 'parkings_access', 'aggregate_variability', len(merged), access_data.parkings_variability, merged)
+        outputs['parkings_unidos'] = merged
+    return outputs
+
+def _load_and_drop(spec):
+    result = dimensional_bbdd.load_table(spec, mode='replace')
+    connection = dimensional_bbdd.get_engine().raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {dimensional_bbdd.quote_identifier(spec['table'])}")
+        connection.commit()
+    finally:
+        connection.close()
+    return result
+
+def benchmark_load(results, run_id, outputs):
+    """Upload the access outputs and COPY them into scratch PostgreSQL tables."""
+    for table_name, df in outputs.items():
+        spec = next(spec for spec in dimensional_bbdd.TABLE_SPECS if spec['table'] == table_name)
+        object_name = f"{run_id}/{spec['object']}"
+        measure(results, table_name, 'upload', len(df), upload_dataframe_to_minio, df, BENCH_BUCKET, object_name, format='parquet')
+        if not BENCH_POSTGRES:
+            continue
+        spec = dict(spec, bucket=BENCH_BUCKET, object=object_name, table=f"benchmark_{table_name}")
+        try:
+            measure(results, table_name, 'load', len(df), _load_and_drop, spec)
+        except Exception as e:
+            # Sin PostgreSQL accesible el resto del benchmark sigue siendo válido
+            print(f"Postgres load of {table_name} failed: {type(e).__name__}: {e}")
+
+def remove_benchmark_objects(run_id):
+    client = get_minio_client()
+    names = [obj.object_name for obj in client.list_objects(BENCH_BUCKET, prefix=f"{run_id}/", recursive=True)]
+    if names:
+        from minio.deleteobjects import DeleteObject
+        errors = list(client.remove_objects(BENCH_BUCKET, [DeleteObject(name) for name in names]))
+        if errors:
+            print(f"Could not remove {len(errors)} benchmark objects")
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment_info():
+    return {
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'quality_mode': QUALITY_MODE,
+    }
+
+def compare_results(current, baseline):
+    """Ratio current/baseline of time and peak memory for every stage both runs measured."""
+    previous = {(stage['dataset'], stage['stage']): stage for stage in baseline['stages'] if stage['status'] == 'done'}
+    comparison = []
+    for stage in current['stages']:
+        before = previous.get((stage['dataset'], stage['stage']))
+        if before is None or stage['status'] != 'done':
+            continue
+        comparison.append({
+            'dataset': stage['dataset'],
+            'stage': stage['stage'],
+            'seconds': stage['seconds'],
+            'baseline_seconds': before['seconds'],
+            'seconds_ratio': round(stage['seconds'] / before['seconds'], 3) if before['seconds'] else None,
+            # El pico absoluto es más estable que el crecimiento: la memoria
+            # liberada por una etapa suele quedar reservada para la siguiente
+            'peak_rss_bytes': stage['peak_rss_bytes'],
+            'baseline_peak_rss_bytes': before['peak_rss_bytes'],
+            'peak_rss_ratio': round(stage['peak_rss_bytes'] / before['peak_rss_bytes'], 3) if before['peak_rss_bytes'] else None,
+        })
+    return {
+        'run_id': baseline['run_id'],
+        'same_config': baseline['config'] == current['config'],
+        'stages': comparison,
+    }
+
+def run_benchmark(run_id=None, directory=BENCH_DIR, datasets=BENCH_DATASETS):
+    """Generate the sources and benchmark every pipeline stage on them."""
+    run_id = run_id or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    config = benchmark_config()
+    started_at = datetime.datetime.now().isoformat()
+    stages = []
+    metrics.reset()
+
+    generate_sources(stages, config, directory, datasets)
+
+    processed = []
+    aparcamientos_ids = None
+    # aparcamientos antes que parkings: la regla referencial usa sus claves
+    for name in ['aparcamientos', 'bicimad', 'parkings', 'trafico', 'avisa']:
+        if name not in datasets and not (name == 'aparcamientos' and 'parkings' in datasets):
+            continue
+        try:
+            std = benchmark_process(stages, name, run_id, directory, aparcamientos_ids)
+            processed.append(name)
+            if name == 'aparcamientos':
+                aparcamientos_ids = std['parking_id']
+        except Exception as e:
+            print(f"Benchmark of {name} failed: {type(e).__name__}: {e}")
+
+    try:
+        outputs = benchmark_access(stages, run_id, processed)
+        benchmark_load(stages, run_id, outputs)
+    except Exception as e:
+        print(f"Benchmark of the access stages failed: {type(e).__name__}: {e}")
+    finally:
+        if not BENCH_KEEP_OBJECTS:
+            remove_benchmark_objects(run_id)
+
+    return {
+        'run_id': run_id,
+        'started_at': started_at,
+        'finished_at': datetime.datetime.now().isoformat(),
+        'config': config,
+        'environment': environment_info(),
+        'stages': stages,
+        'functions': metrics.snapshot()['functions'],
+    }
+
+def save_results(results, results_dir=BENCH_RESULTS_DIR):
+    """Write the results file locally and keep a copy in govern-zone-metadata."""
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{results['run_id']}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    write_json_object(GOVERNANCE_BUCKET, f"{BENCH_PREFIX}{results['run_id']}.json", results)
+    print(f"Benchmark results stored in {path} and {GOVERNANCE_BUCKET}/{BENCH_PREFIX}{results['run_id']}.json")
+    return path
+
+def _mib(value):
+    return value / (1024 * 1024)
+
+def print_results(results):
+    print(f"\nBenchmark {results['run_id']} ({results['config']['rows']} rows, seed {results['config']['seed']}):")
+    print(f"  {'dataset':<16} {'stage':<22} {'rows':>12} {'seconds':>9} {'rows/s':>12} {'RSS MiB':>9} {'+MiB':>7}  status")
+    for stage in results['stages']:
+        rows_per_second = f"{stage['rows_per_second']:.0f}" if stage['rows_per_second'] else '-'
+        print(f"  {stage['dataset']:<16} {stage['stage']:<22} {stage['rows'] or 0:>12} {stage['seconds']:>9.3f} "
+              f"{rows_per_second:>12} {_mib(stage['peak_rss_bytes']):>9.1f} {_mib(stage['rss_growth_bytes']):>7.1f}  {stage['status']}")
+
+    baseline = results.get('baseline')
+    if baseline:
+        note = '' if baseline['same_config'] else ' (different config: ratios are not comparable)'
+        print(f"\nAgainst baseline {baseline['run_id']}{note}:")
+        for stage in baseline['stages']:
+            print(f"  {stage['dataset']:<16} {stage['stage']:<22} x{stage['seconds_ratio'] or 0:<7.3f} time  "
+                  f"x{stage['peak_rss_ratio'] or 0:<7.3f} peak RSS")
+
+def main(baseline_path=BENCH_BASELINE):
+    results = run_benchmark()
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            results['baseline'] = compare_results(results, json.load(f))
+    print_results(results)
+    save_results(results)
+    return results
+
+if __name__ == "__main__":
+    start_governance_run()
+    try:
+        results = main()
+    finally:
+        run = end_governance_run()
+        export_metrics(run.run_id)
+    if any(stage['status'] == 'failed' for stage in results['stages']):
+        sys.exit(1)
@@ -1,12 +1,28 @@
 
-from utils import get_minio_client
+from utils import (
+    get_minio_client,
+    fetch_json_objects,
+    read_event_log,
+    read_json_object,
+    write_json_object,
+    read_parquet_object,
+    write_parquet_object,
+    load_lineage_index,
+    lineage_key,
+    open_metadata_catalog,
+    refresh_metadata_catalog,
+    list_new_event_logs
+)
+from metrics import instrument, export_metrics
 import json
 import pandas as pd
 import io
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
-def list_all_metadata():
+@instrument
+def list_all_metadata(refresh=True):
     """List all metadata stored in the govern-zone-metadata bucket."""
     client = get_minio_client()
 
@@ -16,32 +32,56 @@ def list_all_metadata():
 
     print("Retrieving metadata catalog from govern-zone-metadata:")
 
-    # Collect all metadata objects
-    objects = list(client.list_objects('govern-zone-metadata', prefix='metadata/'))
+    # Merge only the records written since the last refresh
+    if refresh:
+        refresh_metadata_catalog()
 
     metadata_catalog = {}
-    for obj in objects:
-        try:
-            # Download metadata
-            response = client.get_object('govern-zone-metadata', obj.object_name)
-            metadata_json = json.loads(response.read().decode('utf-8'))
-
-            # Extract source information
-            source_bucket = metadata_json.get('source_bucket', 'unknown')
-            object_name = metadata_json.get('object_name', 'unknown')
-
+    with open_metadata_catalog() as catalog:
+        for source_bucket, object_name, metadata_json in catalog.execute(
+                'SELECT source_bucket, object_name, metadata FROM objects ORDER BY source_bucket, object_name'):
             # Build catalog structure
             if source_bucket not in metadata_catalog:
                 metadata_catalog[source_bucket] = {}
 
-            metadata_catalog[source_bucket][object_name] = metadata_json
-        except Exception as e:
-            print(f"Error reading metadata for {obj.object_name}: {e}")
+            metadata_catalog[source_bucket][object_name] = json.loads(metadata_json)
 
     return metadata_catalog
 
+@instrument
+def query_metadata_catalog(bucket=None, name=None, format=None, min_rows=None, max_rows=None,
+                           uploaded_after=None, uploaded_before=None):
+    """Look up catalog entries by bucket, name (SQL LIKE pattern), format, row count or upload time."""
+    conditions, params = [], []
+    for clause, value in [
+        ('source_bucket = ?', bucket),
+        ('object_name LIKE ?', name),
+        ('format = ?', format),
+        ('rows >= ?', min_rows),
+        ('rows <= ?', max_rows),
+        ('uploaded_at >= ?', uploaded_after),
+        ('uploaded_at < ?', uploaded_before),
+    ]:
+        if value is not None:
+            conditions.append(clause)
+            params.append(value.isoformat() if isinstance(value, datetime.datetime) else value)
+
+    query = ('SELECT source_bucket, object_name, format, rows, uploaded_at, file_hash, size_bytes, metadata_key '
+             'FROM objects')
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY source_bucket, object_name'
+
+    with open_metadata_catalog() as catalog:
+        return pd.read_sql_query(query, catalog, params=params)
+
+@instrument
 def trace_data_lineage(target_object, target_bucket='access-zone'):
-    """Trace the lineage of a specific dataset back to its origins."""
+    """Trace the lineage of a specific dataset back to its origins.
+
+    Walks the persisted lineage index, following every source of
+    multi-source transformations. Steps are returned upstream first.
+    """
     client = get_minio_client()
 
     if not client.bucket_exists('govern-zone-metadata'):
@@ -50,55 +90,167 @@ def trace_data_lineage(target_object, target_bucket='access-zone'):
 
     print(f"Tracing data lineage for {target_bucket}/{target_object}:")
 
-    # Find lineage objects where this dataset is the target
-    lineage_objects = list(client.list_objects('govern-zone-metadata', prefix='lineage/'))
+    upstream = load_lineage_index().get('upstream', {})
 
-    # Build the lineage chain
+    # Build the lineage chain (depth-first, sources before their targets)
     lineage_chain = []
-    current_target = (target_bucket, target_object)
-
-    while current_target:
-        found_source = False
-
-        for obj in lineage_objects:
-            try:
-                response = client.get_object('govern-zone-metadata', obj.object_name)
-                lineage = json.loads(response.read().decode('utf-8'))
-
-                # Check if this lineage record has our current target
-                if (lineage['target']['bucket'] == current_target[0] and
-                        lineage['target']['object'] == current_target[1]):
-
-                    # Add to lineage chain
-                    lineage_chain.append(lineage)
-
-                    # Move to the source of this transformation
-                    if lineage['source'] != 'multiple':
-                        current_target = (lineage['source']['bucket'], lineage['source']['object'])
-                        found_source = True
-                        break
-                    else:
-                        # Multiple sources - need to handle differently
-                        lineage_chain.append({
-                            'timestamp': lineage['timestamp'],
-                            'note': 'This dataset was created from multiple source datasets',
-                            'transformation': lineage['transformation']
-                        })
-                        current_target = None
-                        break
-            except Exception as e:
-                print(f"Error reading lineage for {obj.object_name}: {e}")
-
-        # If we didn't find a source, we've reached the beginning of the chain
-        if not found_source:
-            current_target = None
-
-    # Reverse to get chronological order
-    lineage_chain.reverse()
+    visited = set()
+    pending = [(lineage_key(target_bucket, target_object), False)]
+
+    while pending:
+        key, expanded = pending.pop()
+        edge = upstream.get(key)
+        if edge is None:
+            continue
+        if expanded:
+            lineage_chain.append(edge)
+            continue
+        if key in visited:
+            continue
+        visited.add(key)
+
+        pending.append((key, True))
+        for source in reversed(edge['sources']):
+            pending.append((lineage_key(source['bucket'], source['object']), False))
+
     return lineage_chain
 
-def generate_data_quality_report():
-    """Generate a report of data quality checks."""
+@instrument
+def trace_data_downstream(source_object, source_bucket='raw-ingestion-zone'):
+    """Find every dataset derived (directly or not) from a given dataset."""
+    index = load_lineage_index()
+    upstream = index.get('upstream', {})
+    downstream = index.get('downstream', {})
+
+    print(f"Tracing downstream datasets of {source_bucket}/{source_object}:")
+
+    # Breadth-first, so direct consumers come first
+    steps = []
+    visited = set()
+    queue = list(downstream.get(lineage_key(source_bucket, source_object), []))
+    while queue:
+        key = queue.pop(0)
+        if key in visited:
+            continue
+        visited.add(key)
+        steps.append(upstream[key])
+        queue.extend(downstream.get(key, []))
+
+    return steps
+
+# El histórico de calidad es un dataset de partes: cada refresco escribe solo
+# las filas nuevas en su propia parte, sin releer ni reescribir las anteriores
+QUALITY_HISTORY_PREFIX = 'reports/quality_history/'
+QUALITY_HISTORY_STATE = 'reports/quality_history_state.json'
+QUALITY_HISTORY_COLUMNS = ['dataset', 'timestamp', 'check_type', 'column', 'passed', 'details', 'source_object']
+
+def _quality_rows(source_object, quality_check):
+    """Flatten one quality result into report rows."""
+    return [{
+        'dataset': quality_check['dataset'],
+        'timestamp': quality_check['timestamp'],
+        'check_type': check['check'],
+        'column': check['column'],
+        'passed': check['passed'],
+        'details': check['details'],
+        'source_object': source_object,
+    } for check in quality_check['checks']]
+
+def _empty_quality_state():
+    return {'parts': 0, 'watermark': '', 'seen_at_watermark': [], 'events_watermark': '', 'events_seen': []}
+
+@instrument
+def refresh_quality_history(max_workers=16):
+    """Append the quality results written since the last refresh as a new history part.
+
+    quality/ objects are taken in write order (last_modified watermark) and
+    events logs with list_new_event_logs, so a refresh reads only what was
+    written since the previous one. Returns the number of rows added.
+    """
+    client = get_minio_client()
+
+    state = read_json_object('govern-zone-metadata', QUALITY_HISTORY_STATE, default={})
+    if 'events_seen' not in state:
+        # Sin estado (o con el de la tabla única anterior): se reconstruye
+        # el histórico desde cero, sin partes que puedan duplicarse
+        stale = [obj.object_name for obj in client.list_objects('govern-zone-metadata', prefix=QUALITY_HISTORY_PREFIX, recursive=True)]
+        if stale:
+            from minio.deleteobjects import DeleteObject
+            list(client.remove_objects('govern-zone-metadata', [DeleteObject(name) for name in stale]))
+        state = _empty_quality_state()
+
+    watermark = state['watermark']
+    seen_at_watermark = set(state['seen_at_watermark'])
+
+    # Quality objects written after the watermark (same instant: not seen yet)
+    new_objects = []
+    for obj in client.list_objects('govern-zone-metadata', prefix='quality/', recursive=True):
+        modified = obj.last_modified.isoformat() if obj.last_modified else ''
+        if modified > watermark or (modified == watermark and obj.object_name not in seen_at_watermark):
+            new_objects.append((modified, obj.object_name))
+
+    # Buffered runs keep their quality results in the events logs
+    new_logs, events_watermark, events_seen = list_new_event_logs(state['events_watermark'], state['events_seen'])
+
+    rows = []
+    for object_name, quality_check in fetch_json_objects([name for _, name in new_objects], max_workers):
+        try:
+            rows.extend(_quality_rows(object_name, quality_check))
+        except Exception as e:
+            print(f"Error reading quality check for {object_name}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for events in executor.map(read_event_log, new_logs):
+            for event in events:
+                if event['kind'] == 'quality':
+                    rows.extend(_quality_rows(event['object_name'], event['record']))
+
+    # Advance the watermarks
+    if new_objects:
+        latest = max(modified for modified, _ in new_objects)
+        if latest > watermark:
+            watermark, seen_at_watermark = latest, set()
+        seen_at_watermark.update(name for modified, name in new_objects if modified == latest)
+
+    parts = state['parts']
+    if rows:
+        # La parte lleva el número de secuencia del estado: si la ejecución se
+        # interrumpe antes de guardar el estado, la siguiente la sobrescribe
+        part = pd.DataFrame(rows, columns=QUALITY_HISTORY_COLUMNS).astype({'passed': bool})
+        write_parquet_object('govern-zone-metadata', f"{QUALITY_HISTORY_PREFIX}part-{parts:06d}.parquet", part)
+        parts += 1
+
+    if rows or new_objects or new_logs:
+        write_json_object('govern-zone-metadata', QUALITY_HISTORY_STATE, {
+            'parts': parts,
+            'watermark': watermark,
+            'seen_at_watermark': sorted(seen_at_watermark),
+            'events_watermark': events_watermark,
+            'events_seen': events_seen,
+            'updated_at': datetime.datetime.now().isoformat(),
+        })
+
+    print(f"{len(new_objects)} new quality results and {len(new_logs)} events logs added to the report")
+    return len(rows)
+
+def read_quality_history():
+    """The whole quality history: every part written by refresh_quality_history."""
+    client = get_minio_client()
+    parts = [read_parquet_object('govern-zone-metadata', obj.object_name)
+             for obj in client.list_objects('govern-zone-metadata', prefix=QUALITY_HISTORY_PREFIX, recursive=True)
+             if obj.object_name.endswith('.parquet')]
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return pd.DataFrame(columns=QUALITY_HISTORY_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+@instrument
+def generate_data_quality_report(refresh=True, max_workers=16):
+    """Generate a report of data quality checks.
+
+    The report is the quality-history dataset; with refresh=True the
+    results written since the last refresh are appended to it first.
+    """
     client = get_minio_client()
 
     if not client.bucket_exists('govern-zone-metadata'):
@@ -106,39 +258,30 @@ def generate_data_quality_report():
         return pd.DataFrame()
 
     print("Generating data quality report:")
-
-    # Find quality check objects
-    quality_objects = list(client.list_objects('govern-zone-metadata', prefix='quality/'))
-
-    # Collect quality check results
-    quality_results = []
-    for obj in quality_objects:
-        try:
-            response = client.get_object('govern-zone-metadata', obj.object_name)
-            quality_check = json.loads(response.read().decode('utf-8'))
-
-            # Process each individual check
-            for check in quality_check['checks']:
-                result = {
-                    'dataset': quality_check['dataset'],
-                    'timestamp': quality_check['timestamp'],
-                    'check_type': check['check'],
-                    'column': check['column'],
-                    'passed': check['passed'],
-                    'details': check['details']
-                }
-                quality_results.append(result)
-        except Exception as e:
-            print(f"Error reading quality check for {obj.object_name}: {e}")
-
-    # Convert to DataFrame
-    return pd.DataFrame(quality_results)
-
-
+    if refresh:
+        refresh_quality_history(max_workers)
+    return read_quality_history()
+
+@instrument
+def summarize_data_quality(quality_report):
+    """Compute the pass rate of every (dataset, check type) in the quality history."""
+    quality_summary = quality_report.groupby(['dataset', 'check_type']).agg({
+        'passed': ['sum', 'count'],
+    }).reset_index()
+    quality_summary.columns = ['dataset', 'check_type', 'passed_count', 'total_count']
+    quality_summary['pass_rate'] = quality_summary['passed_count'] / quality_summary['total_count'] * 100
+    return quality_summary
 
 def main():
     print("Demonstrating Govern Zone functionality...\n")
 
+    # 1. Browse the metadata catalog
+    print("\n=== Metadata Catalog ===")
+    refresh_metadata_catalog()
+    datasets = query_metadata_catalog(bucket='access-zone')
+    for _, entry in datasets.iterrows():
+        print(f"  {entry['source_bucket']}/{entry['object_name']} ({entry['format']}, {entry['rows']} rows, {entry['uploaded_at']})")
+
     # 2. Trace data lineage for an analytics dataset
     print("\n\n=== Data Lineage Tracing ===")
     lineage = trace_data_lineage('analytics/rutas_users.parquet')
@@ -148,16 +291,20 @@ def main():
         print("\nLineage chain:")
         for step_num, step in enumerate(lineage, 1):
             print(f"\nStep {step_num}:")
-            if 'note' in step:
-                print(f"  Note: {step['note']}")
-            else:
-                print(f"  From: {step['source']['bucket']}/{step['source']['object']}")
-                print(f"  To: {step['target']['bucket']}/{step['target']['object']}")
+            sources = [f"{source['bucket']}/{source['object']}" for source in step['sources']]
+            print(f"  From: {', '.join(sources)}")
+            print(f"  To: {step['target']['bucket']}/{step['target']['object']}")
             print(f"  Transformation: {step['transformation']}")
             print(f"  Timestamp: {step['timestamp']}")
     else:
         print("No lineage information found.")
 
+    downstream = trace_data_downstream('data/bicimad.csv')
+    if downstream:
+        print("\nDatasets derived from raw-ingestion-zone/data/bicimad.csv:")
+        for step in downstream:
+            print(f"  - {step['target']['bucket']}/{step['target']['object']}")
+
     # 3. Generate data quality report
     print("\n\n=== Data Quality Report ===")
     quality_report = generate_data_quality_report()
@@ -165,11 +312,7 @@ def main():
     if not quality_report.empty:
         # Print quality report summary
         print("\nQuality Check Summary:")
-        quality_summary = quality_report.groupby(['dataset', 'check_type']).agg({
-            'passed': ['sum', 'count'],
-        }).reset_index()
-        quality_summary.columns = ['dataset', 'check_type', 'passed_count', 'total_count']
-        quality_summary['pass_rate'] = quality_summary['passed_count'] / quality_summary['total_count'] * 100
+        quality_summary = summarize_data_quality(quality_report)
 
         for _, row in quality_summary.iterrows():
             print(f"\n  Dataset: {row['dataset']}")
@@ -199,4 +342,7 @@ def main():
     print("\nThese governance capabilities ensure data is trustworthy, secure, and compliant with regulations.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        export_metrics()
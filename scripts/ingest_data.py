@@ -1,64 +1,223 @@
 import pandas as pd
 import os
-from utils import upload_dataframe_to_minio, get_minio_client, upload_json_to_minio, upload_file_to_minio
+import sys
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from minio.commonconfig import CopySource
+from utils import (
+    upload_dataframe_to_minio,
+    get_minio_client,
+    upload_json_to_minio,
+    upload_file_to_minio,
+    store_file_metadata,
+    stream_file_to_minio,
+    load_ingestion_manifest,
+    write_json_object,
+    start_governance_run,
+    end_governance_run,
+    INGESTION_MANIFEST
+)
+from metrics import instrument, export_metrics
 import json
-def main():
-
-    # Save sample data to local CSV files
-    bicimad_df = pd.read_csv('/data/raw/bicimad-usos.csv')
-    trafico_df = pd.read_csv('/data/raw/trafico-horario.csv')
-    parkings_df = pd.read_csv('/data/raw/parkings-rotacion.csv')
-
-    aparcamiento_df = pd.read_csv('/data/raw/ext_aparcamientos_info.csv')
-
-    upload_dataframe_to_minio(
-        bicimad_df,
-        'raw-ingestion-zone',
-        'data/bicimad.csv'
-    )
-
-    upload_dataframe_to_minio(
-        trafico_df,
-        'raw-ingestion-zone',
-        'traf/trafcio-horario.csv',
-    )
-
-    upload_dataframe_to_minio(
-        parkings_df,
-        'raw-ingestion-zone',
-        'invent/parkings-rotacion.csv',
-    )
-
-    upload_dataframe_to_minio(
-        aparcamiento_df,
-        'raw-ingestion-zone',
-        'apar/ext_aparcamientos_info.csv',
-    )
-
-    with open('../data/raw/avisamadrid.json', 'r', encoding='utf-8') as f:
-        avisos_data = f.read()
-
-    upload_json_to_minio(
-    avisos_data,
-    'raw-ingestion-zone',
-    'avisos/avisamadrid.json'
-    )
-
-    upload_file_to_minio('/data/raw/dump-bbdd-municipal.sql', 'raw-ingestion-zone', 'db/avisos.sql')
 
-    # Verify that the files were uploaded
+RAW_DATA_DIR = os.environ.get('RAW_DATA_DIR', '/data/raw')
+RAW_BUCKET = 'raw-ingestion-zone'
+
+# 'raw' streams the source files byte-for-byte; 'parsed' keeps the old
+# read_csv + re-serialization path
+INGEST_MODE = os.environ.get('INGEST_MODE', 'raw')
+INGEST_MAX_WORKERS = int(os.environ.get('INGEST_MAX_WORKERS', '4'))
+# Skip sources whose content did not change since the last recorded run
+INGEST_INCREMENTAL = os.environ.get('INGEST_INCREMENTAL', '1') == '1'
+
+# Local source file -> object in raw-ingestion-zone
+SOURCES = [
+    {'name': 'bicimad', 'file': 'bicimad-usos.csv', 'object': 'data/bicimad.csv', 'format': 'csv'},
+    {'name': 'trafico', 'file': 'trafico-horario.csv', 'object': 'traf/trafcio-horario.csv', 'format': 'csv'},
+    {'name': 'parkings', 'file': 'parkings-rotacion.csv', 'object': 'invent/parkings-rotacion.csv', 'format': 'csv'},
+    {'name': 'aparcamientos', 'file': 'ext_aparcamientos_info.csv', 'object': 'apar/ext_aparcamientos_info.csv', 'format': 'csv'},
+    {'name': 'avisa', 'file': 'avisamadrid.json', 'object': 'avisos/avisamadrid.json', 'format': 'json'},
+    {'name': 'municipal_db', 'file': 'dump-bbdd-municipal.sql', 'object': 'db/avisos.sql', 'format': 'sql'},
+]
+
+def versioned_object_name(object_name, file_hash):
+    """Build the content-addressed key a raw source version is stored under."""
+    directory, file_name = os.path.split(object_name)
+    stem, extension = os.path.splitext(file_name)
+    return f"{directory}/_versions/{stem}.{file_hash[:16]}{extension}"
+
+@instrument
+def ingest_source(source, mode=INGEST_MODE):
+    """Upload one source file (and its metadata) to raw-ingestion-zone."""
+    file_path = os.path.join(RAW_DATA_DIR, source['file'])
+
+    if mode == 'raw' or source['format'] == 'sql':
+        upload_file_to_minio(file_path, RAW_BUCKET, source['object'])
+    elif mode == 'parsed' and source['format'] == 'csv':
+        upload_dataframe_to_minio(pd.read_csv(file_path), RAW_BUCKET, source['object'])
+    elif mode == 'parsed' and source['format'] == 'json':
+        with open(file_path, 'r', encoding='utf-8') as f:
+            upload_json_to_minio(f.read(), RAW_BUCKET, source['object'])
+    else:
+        raise ValueError(f"Unsupported ingestion mode: {mode}")
+
+@instrument
+def ingest_source_incremental(source, previous=None):
+    """Upload a source only if its content differs from the manifest entry.
+
+    Returns the status ('uploaded' or 'unchanged') and the new manifest entry.
+    """
+    file_path = os.path.join(RAW_DATA_DIR, source['file'])
+    file_stat = os.stat(file_path)
+
+    # Same size and mtime: trust the previous hash without reading the file
+    if (previous and previous['file_size'] == file_stat.st_size
+            and previous['mtime'] == file_stat.st_mtime):
+        return 'unchanged', previous
+
+    # The file is read once: the streaming upload hashes it in the same pass
+    upload = stream_file_to_minio(file_path, RAW_BUCKET, source['object'])
+    file_hash = upload['file_hash']
+    if previous and previous['file_hash'] == file_hash:
+        # Only the mtime changed: the canonical object got the same bytes back
+        return 'unchanged', dict(previous, mtime=file_stat.st_mtime)
+
+    # New content: keep it under a hash-keyed name with a server-side copy
+    versioned_object = versioned_object_name(source['object'], file_hash)
+    get_minio_client().copy_object(RAW_BUCKET, versioned_object, CopySource(RAW_BUCKET, source['object']))
+    store_file_metadata(RAW_BUCKET, source['object'], file_path, file_hash=file_hash, file_size=upload['file_size'])
+
+    return 'uploaded', {
+        'source': source['name'],
+        'file_path': file_path,
+        'file_hash': file_hash,
+        'file_size': upload['file_size'],
+        'mtime': file_stat.st_mtime,
+        'versioned_object': versioned_object,
+        'ingested_at': datetime.datetime.now().isoformat(),
+    }
+
+def _run_source(source, mode, manifest=None):
+    """Ingest a source and report its status instead of raising."""
+    start = time.perf_counter()
+    entry = None
+    try:
+        if manifest is not None:
+            status, entry = ingest_source_incremental(source, manifest['sources'].get(source['object']))
+        else:
+            ingest_source(source, mode)
+            status = 'uploaded'
+        error = None
+    except Exception as e:
+        status, error = 'failed', f"{type(e).__name__}: {e}"
+
+    return {
+        'source': source['name'],
+        'object': f"{RAW_BUCKET}/{source['object']}",
+        'status': status,
+        'error': error,
+        'seconds': round(time.perf_counter() - start, 3),
+        'manifest_entry': entry,
+    }
+
+def ingest_sources(sources=SOURCES, mode=INGEST_MODE, max_workers=INGEST_MAX_WORKERS, manifest=None):
+    """Ingest independent sources concurrently on a bounded thread pool.
+
+    With a manifest, unchanged sources are skipped (incremental mode).
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_source, source, mode, manifest): source for source in sources}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['source']] = result
+
+    # Keep the declaration order for reporting
+    return [results[source['name']] for source in sources]
+
+@instrument
+def update_ingestion_manifest(manifest, sources, results):
+    """Record the new source versions and what changed in this run."""
+    run = {
+        'run_id': datetime.datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'changed': [],
+        'unchanged': [],
+        'failed': [],
+    }
+    for source, result in zip(sources, results):
+        if result['status'] == 'uploaded':
+            run['changed'].append(source['object'])
+        else:
+            run[result['status']].append(source['object'])
+
+        # Failed sources keep their previous entry
+        entry = result['manifest_entry']
+        if entry is not None:
+            if result['status'] == 'uploaded':
+                entry = dict(entry, run_id=run['run_id'])
+            manifest['sources'][source['object']] = entry
+
+    manifest['updated_at'] = datetime.datetime.now().isoformat()
+    manifest['last_run'] = run
+    write_json_object('govern-zone-metadata', INGESTION_MANIFEST, manifest)
+    print(f"Ingestion manifest stored in govern-zone-metadata/{INGESTION_MANIFEST}")
+    return manifest
+
+@instrument
+def list_uploaded_objects(prefixes, max_workers=INGEST_MAX_WORKERS):
+    """List several raw-ingestion-zone prefixes concurrently."""
     client = get_minio_client()
+
+    def list_prefix(prefix):
+        return [obj.object_name for obj in client.list_objects(RAW_BUCKET, prefix=prefix)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(prefixes, executor.map(list_prefix, prefixes)))
+
+def main(mode=INGEST_MODE, max_workers=INGEST_MAX_WORKERS, incremental=INGEST_INCREMENTAL):
+
+    # Incremental ingestion only makes sense for byte-for-byte uploads
+    manifest = load_ingestion_manifest() if incremental and mode == 'raw' else None
+
+    results = ingest_sources(SOURCES, mode=mode, max_workers=max_workers, manifest=manifest)
+
+    if manifest is not None:
+        update_ingestion_manifest(manifest, SOURCES, results)
+
+    print("\nIngestion status per source:")
+    for result in results:
+        line = f"  {result['source']:<15} {result['status']:<9} {result['seconds']:>8.2f}s  {result['object']}"
+        if result['error']:
+            line += f"  ({result['error']})"
+        print(line)
+
+    # Verify that the files were uploaded
     print("\nVerifying uploaded files in raw-ingestion-zone:")
 
-    for prefix in ['data/', 'traf/', 'invent/', 'apar/', 'avisos/', 'db/']:
-        objects = list(client.list_objects('raw-ingestion-zone', prefix=prefix))
+    prefixes = ['data/', 'traf/', 'invent/', 'apar/', 'avisos/', 'db/']
+    for prefix, objects in list_uploaded_objects(prefixes, max_workers).items():
         if objects:
-            print(f"Files in {prefix}: {[obj.object_name for obj in objects]}")
+            print(f"Files in {prefix}: {objects}")
         else:
             print(f"No objects found in {prefix}")
 
-    print("\nData ingestion into raw-ingestion-zone complete!")
+    failed = [result['source'] for result in results if result['status'] == 'failed']
+    if failed:
+        print(f"\nData ingestion finished with errors in: {', '.join(failed)}")
+    else:
+        print("\nData ingestion into raw-ingestion-zone complete!")
     print("Note: The data in this zone is stored in its original format without modifications.")
 
+    return results
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Metadata of all sources is written as one governance log at the end
+    start_governance_run()
+    try:
+        results = main()
+    finally:
+        run = end_governance_run()
+        export_metrics(run.run_id)
+    if any(result['status'] == 'failed' for result in results):
+        sys.exit(1)
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import datetime
+import resource
+import threading
+import functools
+import urllib3
+import pandas as pd
+import pyarrow as pa
+
+# Métricas por función instrumentada y por petición a MinIO
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Directorio de ficheros .prom (p. ej. el textfile collector de node_exporter)
+METRICS_TEXTFILE_DIR = os.environ.get('METRICS_TEXTFILE_DIR', '/tmp/metrics')
+METRICS_PREFIX = 'metrics/'
+
+_FUNCTION_FIELDS = ('calls', 'errors', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out',
+                    'bytes_read', 'bytes_written', 'minio_requests')
+
+_lock = threading.Lock()
+_functions = {}
+_minio = {'requests': 0, 'bytes_read': 0, 'bytes_written': 0, 'by_method': {}}
+_started_at = datetime.datetime.now().isoformat()
+
+def _peak_rss_bytes():
+    # ru_maxrss está en KiB en Linux (en bytes en macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (pa.Table, pa.RecordBatch)):
+        return value.num_rows
+    return 0
+
+def _io_totals():
+    with _lock:
+        return _minio['requests'], _minio['bytes_read'], _minio['bytes_written']
+
+def record_minio_request(method, bytes_read=0, bytes_written=0):
+    """Count one HTTP request to MinIO and the bytes it moved."""
+    with _lock:
+        _minio['requests'] += 1
+        _minio['bytes_read'] += bytes_read
+        _minio['bytes_written'] += bytes_written
+        _minio['by_method'][method] = _minio['by_method'].get(method, 0) + 1
+
+class CountingPoolManager(urllib3.PoolManager):
+    """urllib3 pool that counts the requests and bytes of every MinIO call."""
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        body = kw.get('body')
+        response = super().urlopen(method, url, redirect=redirect, **kw)
+        bytes_written = len(body) if isinstance(body, (bytes, bytearray, memoryview)) else 0
+        if kw.get('preload_content', True):
+            bytes_read = len(response.data or b'')
+        else:
+            bytes_read = int(response.headers.get('Content-Length') or 0)
+        record_minio_request(method, bytes_read, bytes_written)
+        return response
+
+def _metric_name(func):
+    module = func.__module__
+    if module in ('__main__', '__mp_main__'):
+        # Script ejecutado directamente (o su copia en un worker spawn)
+        path = getattr(sys.modules.get(module), '__file__', None) or sys.argv[0]
+        module = os.path.splitext(os.path.basename(path))[0]
+    return f"{module}.{func.__qualname__}"
+
+def instrument(func):
+    """Record wall/CPU time, peak RSS, rows in/out and MinIO I/O of every call.
+
+    CPU time, RSS and MinIO counters are process-wide: a call also accounts
+    for work done meanwhile by other threads (e.g. its own thread pools).
+    """
+    if not METRICS_ENABLED:
+        return func
+
+    name = _metric_name(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        requests_before, read_before, written_before = _io_totals()
+        rss_before = _peak_rss_bytes()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        failed = True
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            rss_after = _peak_rss_bytes()
+            requests_after, read_after, written_after = _io_totals()
+            rows_in = sum(_count_rows(value) for value in args) + sum(_count_rows(value) for value in kwargs.values())
+            with _lock:
+                stats = _functions.setdefault(name, dict.fromkeys(_FUNCTION_FIELDS, 0))
+                stats['calls'] += 1
+                stats['errors'] += int(failed)
+                stats['wall_seconds'] += wall
+                stats['cpu_seconds'] += cpu
+                stats['rows_in'] += rows_in
+                stats['rows_out'] += _count_rows(result)
+                stats['bytes_read'] += read_after - read_before
+                stats['bytes_written'] += written_after - written_before
+                stats['minio_requests'] += requests_after - requests_before
+                stats['peak_rss_bytes'] = max(stats.get('peak_rss_bytes', 0), rss_after)
+                stats['rss_growth_bytes'] = max(stats.get('rss_growth_bytes', 0), rss_after - rss_before)
+
+    return wrapper
+
+def snapshot():
+    """Return a copy of the metrics collected so far in this process."""
+    with _lock:
+        return {
+            'functions': {name: dict(stats) for name, stats in _functions.items()},
+            'minio': dict(_minio, by_method=dict(_minio['by_method'])),
+            'peak_rss_bytes': _peak_rss_bytes(),
+        }
+
+def reset():
+    """Forget the collected metrics (e.g. between tasks of a reused worker)."""
+    with _lock:
+        _functions.clear()
+        _minio.update({'requests': 0, 'bytes_read': 0, 'bytes_written': 0, 'by_method': {}})
+
+def merge(other):
+    """Add the snapshot of another process (a worker) to this one."""
+    with _lock:
+        for name, other_stats in other['functions'].items():
+            stats = _functions.setdefault(name, dict.fromkeys(_FUNCTION_FIELDS, 0))
+            for field in _FUNCTION_FIELDS:
+                stats[field] += other_stats[field]
+            for field in ('peak_rss_bytes', 'rss_growth_bytes'):
+                stats[field] = max(stats.get(field, 0), other_stats.get(field, 0))
+        for field in ('requests', 'bytes_read', 'bytes_written'):
+            _minio[field] += other['minio'][field]
+        for method, count in other['minio']['by_method'].items():
+            _minio['by_method'][method] = _minio['by_method'].get(method, 0) + count
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def to_prometheus(data, script):
+    """Render a metrics snapshot in the Prometheus text exposition format."""
+    series = [
+        ('calls', 'pipeline_function_calls_total', 'counter', 'Calls of an instrumented function'),
+        ('errors', 'pipeline_function_errors_total', 'counter', 'Calls that raised an exception'),
+        ('wall_seconds', 'pipeline_function_wall_seconds_total', 'counter', 'Wall-clock time spent in the function'),
+        ('cpu_seconds', 'pipeline_function_cpu_seconds_total', 'counter', 'Process CPU time while in the function'),
+        ('rows_in', 'pipeline_function_rows_in_total', 'counter', 'Rows of the DataFrame/Arrow arguments'),
+        ('rows_out', 'pipeline_function_rows_out_total', 'counter', 'Rows of the DataFrame/Arrow results'),
+        ('bytes_read', 'pipeline_function_minio_bytes_read_total', 'counter', 'Bytes read from MinIO while in the function'),
+        ('bytes_written', 'pipeline_function_minio_bytes_written_total', 'counter', 'Bytes written to MinIO while in the function'),
+        ('minio_requests', 'pipeline_function_minio_requests_total', 'counter', 'MinIO requests while in the function'),
+        ('peak_rss_bytes', 'pipeline_function_peak_rss_bytes', 'gauge', 'Process peak RSS after the function'),
+        ('rss_growth_bytes', 'pipeline_function_rss_growth_bytes', 'gauge', 'Largest peak RSS growth during one call'),
+    ]
+    lines = []
+    for field, metric, kind, help_text in series:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, stats in sorted(data['functions'].items()):
+            lines.append(f'{metric}{{script="{_label(script)}",function="{_label(name)}"}} {stats.get(field, 0)}')
+
+    lines.append("# HELP pipeline_minio_requests_total MinIO requests by HTTP method")
+    lines.append("# TYPE pipeline_minio_requests_total counter")
+    for method, count in sorted(data['minio']['by_method'].items()):
+        lines.append(f'pipeline_minio_requests_total{{script="{_label(script)}",method="{_label(method)}"}} {count}')
+    for field in ('bytes_read', 'bytes_written'):
+        metric = f"pipeline_minio_{field}_total"
+        lines.append(f"# HELP {metric} Bytes moved to/from MinIO")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f'{metric}{{script="{_label(script)}"}} {data["minio"][field]}')
+    lines.append("# HELP pipeline_peak_rss_bytes Peak RSS of the process")
+    lines.append("# TYPE pipeline_peak_rss_bytes gauge")
+    lines.append(f'pipeline_peak_rss_bytes{{script="{_label(script)}"}} {data["peak_rss_bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+def export_metrics(run_id=None, script=None, textfile_dir=METRICS_TEXTFILE_DIR):
+    """Store this run's metrics in govern-zone-metadata and as a Prometheus text file."""
+    from utils import write_json_object, GOVERNANCE_BUCKET
+
+    if not METRICS_ENABLED:
+        return None
+
+    script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    run_id = run_id or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    data = snapshot()
+    report = dict(data, run_id=run_id, script=script, pid=os.getpid(),
+                  started_at=_started_at, finished_at=datetime.datetime.now().isoformat())
+
+    object_name = f"{METRICS_PREFIX}run={run_id}/{script}-{os.getpid()}.json"
+    write_json_object(GOVERNANCE_BUCKET, object_name, report)
+
+    # Escritura atómica para que el collector nunca lea un fichero a medias
+    os.makedirs(textfile_dir, exist_ok=True)
+    prom_path = os.path.join(textfile_dir, f"{script}.prom")
+    with open(prom_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(to_prometheus(data, script))
+    os.replace(prom_path + '.tmp', prom_path)
+
+    print(f"Metrics stored in {GOVERNANCE_BUCKET}/{object_name} and {prom_path}")
+    return report
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from minio.error import S3Error
+import utils
+from utils import (
+    get_minio_client,
+    calculate_file_hash,
+    read_json_object,
+    write_json_object,
+    start_governance_run,
+    end_governance_run,
+    GOVERNANCE_BUCKET
+)
+from metrics import export_metrics
+import ingest_data
+import process_data
+import access_data
+import dimensional_bbdd
+
+# Estado de la última ejecución correcta de cada tarea
+PIPELINE_STATE = 'pipeline/state.json'
+PIPELINE_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', '4'))
+# Ejecutar todas las tareas aunque sus entradas no hayan cambiado
+PIPELINE_FORCE = os.environ.get('PIPELINE_FORCE', '0') == '1'
+
+def run_ingestion():
+    """Ingest the raw sources, failing the task if any of them failed."""
+    results = ingest_data.main()
+    failed = [result['source'] for result in results if result['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f"Ingestion failed for: {', '.join(failed)}")
+
+# Tareas del pipeline. Entradas y salidas: 'bucket/objeto', 'bucket/prefijo/'
+# para datasets particionados, 'file:/ruta' para ficheros locales y
+# 'postgres:tabla' para tablas cargadas. Las dependencias se deducen de
+# qué tarea produce cada entrada.
+TASKS = [
+    {
+        'name': 'ingest',
+        'run': run_ingestion,
+        'module': ingest_data,
+        'inputs': ['file:' + os.path.join(ingest_data.RAW_DATA_DIR, source['file']) for source in ingest_data.SOURCES],
+        'outputs': [f"{ingest_data.RAW_BUCKET}/{source['object']}" for source in ingest_data.SOURCES],
+    },
+    {
+        'name': 'process_bicimad',
+        'run': process_data.process_bicimad,
+        'module': process_data,
+        'inputs': ['raw-ingestion-zone/data/bicimad.csv'],
+        'outputs': ['process-zone/data/bicimad/'],
+    },
+    {
+        'name': 'process_aparcamientos',
+        'run': process_data.process_aparcamientos,
+        'module': process_data,
+        'inputs': ['raw-ingestion-zone/apar/ext_aparcamientos_info.csv'],
+        'outputs': ['process-zone/apar/aparcamientos.parquet'],
+    },
+    {
+        'name': 'process_parkings',
+        'run': process_data.process_parkings,
+        'module': process_data,
+        'inputs': ['raw-ingestion-zone/invent/parkings-rotacion.csv', 'process-zone/apar/aparcamientos.parquet'],
+        'outputs': ['process-zone/invent/parkings/'],
+    },
+    {
+        'name': 'process_trafico',
+        'run': process_data.process_trafico,
+        'module': process_data,
+        'inputs': ['raw-ingestion-zone/traf/trafcio-horario.csv'],
+        'outputs': ['process-zone/traf/trafico/'],
+    },
+    {
+        'name': 'process_avisa',
+        'run': process_data.process_avisa,
+        'module': process_data,
+        'inputs': ['raw-ingestion-zone/avisos/avisamadrid.json'],
+        'outputs': ['process-zone/avisa/avisos.parquet'],
+    },
+    {
+        'name': 'access_parkings',
+        'run': access_data.access_parkings,
+        'module': access_data,
+        'inputs': [f"{bucket}/{name}" for bucket, name in access_data.PARKINGS_SOURCES],
+        'outputs': ['access-zone/analytics/parkings_unidos.parquet'] + (
+            [] if access_data.PARKINGS_INCREMENTAL else ['access-zone/analytics/parkings-visualizaciones.parquet']
+        ),
+    },
+] + ([
+    # Variabilidad incremental: no depende de reconstruir parkings_unidos
+    {
+        'name': 'access_parkings_variability',
+        'run': access_data.access_parkings_variability,
+        'module': access_data,
+        'inputs': [f"{bucket}/{name}" for bucket, name in access_data.PARKINGS_SOURCES],
+        'outputs': ['access-zone/analytics/parkings-visualizaciones.parquet'],
+    },
+] if access_data.PARKINGS_INCREMENTAL else []) + [
+    {
+        'name': 'access_congestion',
+        'run': access_data.access_congestion,
+        'module': access_data,
+        'inputs': ['process-zone/traf/trafico/'],
+        'outputs': ['access-zone/analytics/congestion_by_hour.parquet'],
+    },
+    {
+        'name': 'access_rutas',
+        'run': access_data.access_rutas,
+        'module': access_data,
+        'inputs': ['process-zone/data/bicimad/'],
+        'outputs': [
+            'access-zone/analytics/rutas_users.parquet',
+            'access-zone/analytics/rutas_cube.parquet',
+            'access-zone/analytics/rutas_top.parquet',
+        ],
+    },
+] + [
+    {
+        'name': f"load_{spec['table']}",
+        'run': lambda spec=spec: dimensional_bbdd.load_table(spec),
+        'module': dimensional_bbdd,
+        'inputs': [f"{dimensional_bbdd.ACCESS_BUCKET}/{spec['object']}"],
+        'outputs': [f"postgres:{spec['table']}"],
+    }
+    for spec in dimensional_bbdd.TABLE_SPECS
+]
+
+def task_dependencies(tasks):
+    """Map every task to the tasks that produce its inputs."""
+    producers = {output: task['name'] for task in tasks for output in task['outputs']}
+    return {
+        task['name']: sorted({producers[name] for name in task['inputs']
+                              if name in producers and producers[name] != task['name']})
+        for task in tasks
+    }
+
+def select_tasks(tasks, targets):
+    """Keep the target tasks and everything upstream of them."""
+    dependencies = task_dependencies(tasks)
+    selected, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in dependencies:
+            raise ValueError(f"Unknown pipeline task: {name}")
+        if name not in selected:
+            selected.add(name)
+            stack.extend(dependencies[name])
+    return [task for task in tasks if task['name'] in selected]
+
+_code_versions = {}
+_state_lock = threading.Lock()
+
+def file_fingerprint(file_path, state):
+    """Content hash of a local file, reusing the stored one if size and mtime match."""
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+
+    with _state_lock:
+        previous = state['files'].get(file_path)
+    if previous and previous['file_size'] == file_stat.st_size and previous['mtime'] == file_stat.st_mtime:
+        return previous['file_hash']
+
+    file_hash = calculate_file_hash(file_path)
+    with _state_lock:
+        state['files'][file_path] = {'file_size': file_stat.st_size, 'mtime': file_stat.st_mtime, 'file_hash': file_hash}
+    return file_hash
+
+def object_fingerprint(name):
+    """Content fingerprint of an object or partitioned dataset (None if it does not exist)."""
+    client = get_minio_client()
+    bucket_name, _, object_name = name.partition('/')
+    if object_name.endswith('/'):
+        # Dataset particionado: el ETag de cada parte identifica su contenido
+        parts = sorted(
+            f"{obj.object_name}:{obj.etag}"
+            for obj in client.list_objects(bucket_name, prefix=object_name, recursive=True)
+        )
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest() if parts else None
+    try:
+        return client.stat_object(bucket_name, object_name).etag
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchBucket'):
+            return None
+        raise
+
+def input_fingerprint(name, state):
+    """Content fingerprint of a task input."""
+    if name.startswith('file:'):
+        return file_fingerprint(name[len('file:'):], state)
+    return object_fingerprint(name)
+
+def outputs_exist(task):
+    """Check that the object outputs of a task are still in MinIO."""
+    return all(
+        object_fingerprint(name) is not None
+        for name in task['outputs'] if not name.startswith('postgres:')
+    )
+
+def code_version(task):
+    """Hash of the code a task runs: its module and the shared utils."""
+    paths = [task['module'].__file__, utils.__file__]
+    key = tuple(paths)
+    if key not in _code_versions:
+        digest = hashlib.sha256()
+        for path in paths:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _code_versions[key] = digest.hexdigest()
+    return _code_versions[key]
+
+def save_pipeline_state(state):
+    with _state_lock:
+        state['updated_at'] = datetime.datetime.now().isoformat()
+        write_json_object(GOVERNANCE_BUCKET, PIPELINE_STATE, state)
+
+def run_task(task, state, force=PIPELINE_FORCE):
+    """Run a task unless its inputs and code match its last successful run."""
+    start = time.perf_counter()
+    error = None
+    try:
+        inputs = {name: input_fingerprint(name, state) for name in task['inputs']}
+        fingerprint = hashlib.sha256(
+            json.dumps({'code': code_version(task), 'inputs': inputs}, sort_keys=True).encode()
+        ).hexdigest()
+
+        with _state_lock:
+            previous = state['tasks'].get(task['name'])
+        if not force and previous and previous['fingerprint'] == fingerprint and outputs_exist(task):
+            status = 'skipped'
+        else:
+            task['run']()
+            status = 'done'
+            with _state_lock:
+                state['tasks'][task['name']] = {
+                    'fingerprint': fingerprint,
+                    'inputs': inputs,
+                    'finished_at': datetime.datetime.now().isoformat(),
+                }
+            save_pipeline_state(state)
+    except Exception as e:
+        status, error = 'failed', f"{type(e).__name__}: {e}"
+
+    return {
+        'task': task['name'],
+        'status': status,
+        'error': error,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+def run_pipeline(tasks=TASKS, targets=None, force=PIPELINE_FORCE, max_workers=PIPELINE_MAX_WORKERS):
+    """Run the task DAG, with independent branches in parallel.
+
+    A task starts as soon as the tasks producing its inputs finished; tasks
+    downstream of a failure are blocked.
+    """
+    if targets:
+        tasks = select_tasks(tasks, targets)
+    dependencies = task_dependencies(tasks)
+    state = read_json_object(GOVERNANCE_BUCKET, PIPELINE_STATE, default={})
+    state.setdefault('tasks', {})
+    state.setdefault('files', {})
+
+    pending = {task['name']: task for task in tasks}
+    running = {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, task in list(pending.items()):
+                upstream = [results.get(dependency) for dependency in dependencies[name]]
+                if any(result is None for result in upstream):
+                    continue
+                del pending[name]
+                if any(result['status'] in ('failed', 'blocked') for result in upstream):
+                    results[name] = {'task': name, 'status': 'blocked', 'error': None, 'seconds': 0.0}
+                else:
+                    running[executor.submit(run_task, task, state, force)] = name
+
+            if not running:
+                if pending and not any(all(dependency in results for dependency in dependencies[name]) for name in pending):
+                    raise ValueError(f"Pipeline tasks with circular dependencies: {', '.join(pending)}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    # Mismo orden que la declaración
+    return [results[task['name']] for task in tasks]
+
+def main(targets=None):
+    results = run_pipeline(targets=targets)
+
+    print("\nPipeline status per task:")
+    for result in results:
+        line = f"  {result['task']:<32} {result['status']:<8} {result['seconds']:>8.2f}s"
+        if result['error']:
+            line += f"  ({result['error']})"
+        print(line)
+    return results
+
+if __name__ == "__main__":
+    start_governance_run()
+    try:
+        results = main(sys.argv[1:])
+    finally:
+        run = end_governance_run()
+        export_metrics(run.run_id)
+    if any(result['status'] in ('failed', 'blocked') for result in results):
+        sys.exit(1)
@@ -1,6 +1,167 @@
 import pandas as pd
-from utils import download_dataframe_from_minio, upload_dataframe_to_minio, log_data_transformation, validate_data_quality,download_file_from_minio
+import numpy as np
+from utils import download_dataframe_from_minio, upload_dataframe_to_minio, upload_partitioned_dataframe_to_minio, log_data_transformation, validate_data_quality,download_file_from_minio, start_governance_run, end_governance_run, governance_run_id, index_governance_logs, dataframe_to_arrow_ipc, dataframe_from_arrow_ipc
 import json
+import os
+import time
+import multiprocessing
+import metrics
+from metrics import instrument, export_metrics
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Modo paralelo: cada dataset se procesa en su propio proceso
+PROCESS_PARALLEL = os.environ.get('PROCESS_PARALLEL', '0') == '1'
+PROCESS_MAX_WORKERS = int(os.environ.get('PROCESS_MAX_WORKERS', str(os.cpu_count() or 1)))
+
+# Formato de las fechas en los CSV/JSON de origen
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+@instrument
+def parse_timestamps(values, format=TIMESTAMP_FORMAT):
+    """Parse date strings with a known format instead of per-element inference."""
+    try:
+        return pd.to_datetime(values, format=format)
+    except (ValueError, TypeError):
+        # Formato inesperado: recurrir a la inferencia de pandas
+        return pd.to_datetime(values)
+
+@instrument
+def add_temporal_fields(df, timestamp_col, fields=('year', 'month', 'day', 'hour', 'weekday')):
+    """Derive calendar fields from a timestamp column in one vectorized pass.
+
+    Uses datetime64 unit truncation and integer arithmetic on the underlying
+    values instead of one .dt accessor (and conversion) per field.
+    """
+    timestamps = df[timestamp_col]
+    if getattr(timestamps.dt, 'tz', None) is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+
+    values = timestamps.to_numpy(dtype='datetime64[ns]')
+    missing = np.isnat(values)
+
+    days = values.astype('datetime64[D]')
+    months = values.astype('datetime64[M]')
+    years = values.astype('datetime64[Y]')
+
+    calendar = {
+        'year': years.astype(np.int64) + 1970,
+        'month': (months - years.astype('datetime64[M]')).astype(np.int64) + 1,
+        'day': (days - months.astype('datetime64[D]')).astype(np.int64) + 1,
+        'hour': (values - days.astype('datetime64[ns]')).astype('timedelta64[h]').astype(np.int64),
+        # 1970-01-01 fue jueves (weekday 3)
+        'weekday': (days.astype(np.int64) + 3) % 7,
+    }
+
+    for field in fields:
+        if missing.any():
+            df[field] = pd.arrays.IntegerArray(np.where(missing, 0, calendar[field]), missing)
+        else:
+            df[field] = calendar[field]
+    return df
+
+# Perfil de tipos compacto por dataset: 'category' para textos de baja
+# cardinalidad (se guarda como diccionario en Parquet) y el entero más
+# estrecho seguro para cada columna numérica
+COMPACT_SCHEMAS = {
+    'bicimad': {
+        'user_type': 'category',
+        'id': 'UInt32', 'user_id': 'UInt32',
+        'station_origin_id': 'UInt16', 'station_dest_id': 'UInt16',
+        'duration_seconds': 'UInt32', 'estimated_calories': 'UInt16', 'co2_saved_grams': 'UInt32',
+        'year': 'UInt16', 'month': 'UInt8', 'day': 'UInt8', 'hour': 'UInt8', 'weekday': 'UInt8',
+    },
+    'aparcamientos': {
+        'schedule': 'category',
+        'parking_id': 'UInt16', 'total_capacity': 'UInt16',
+        'reduced_mobility_spaces': 'UInt16', 'ev_spaces': 'UInt16',
+    },
+    'parkings': {
+        'parking_id': 'UInt16', 'occupied_spaces': 'UInt16', 'free_spaces': 'UInt16',
+        'year': 'UInt16', 'month': 'UInt8', 'day': 'UInt8', 'hour': 'UInt8', 'weekday': 'UInt8',
+    },
+    'trafico': {
+        'congestion_level': 'category',
+        'sensor_id': 'UInt16', 'total_vehicles': 'UInt32', 'cars': 'UInt32',
+        'motorcycles': 'UInt32', 'trucks': 'UInt32', 'buses': 'UInt32',
+        'year': 'UInt16', 'month': 'UInt8', 'day': 'UInt8', 'hour': 'UInt8', 'weekday': 'UInt8',
+    },
+    'avisa': {
+        'categoria': 'category', 'subcategoria': 'category', 'distrito': 'category',
+        'estado': 'category', 'prioridad': 'category', 'origen': 'category',
+        'id': 'UInt32', 'likes': 'UInt32',
+    },
+}
+
+# Enteros nullable de menor a mayor, para ensanchar si un valor no cabe
+_INTEGER_DTYPES = ['UInt8', 'Int8', 'UInt16', 'Int16', 'UInt32', 'Int32', 'UInt64', 'Int64']
+
+def _narrowest_integer_dtype(values, dtype):
+    """Return dtype if every value fits in it, else the next integer type that does."""
+    low, high = values.min(), values.max()
+    if pd.isna(low):
+        return dtype
+
+    for candidate in _INTEGER_DTYPES[_INTEGER_DTYPES.index(dtype):]:
+        info = np.iinfo(pd.api.types.pandas_dtype(candidate).numpy_dtype)
+        if info.min <= low and high <= info.max:
+            return candidate
+    return 'Int64'
+
+@instrument
+def apply_compact_schema(df, dataset):
+    """Cast a standardized dataset to its compact dtype profile."""
+    for col, dtype in COMPACT_SCHEMAS[dataset].items():
+        if col not in df.columns:
+            continue
+        if dtype == 'category':
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = df[col].astype(_narrowest_integer_dtype(df[col], dtype))
+    return df
+
+# Reglas de calidad por dataset estandarizado (ver validate_data_quality)
+QUALITY_RULES = {
+    'bicimad': {
+        'no_nulls': ['id', 'user_id', 'start_time'],
+        'unique': ['id'],
+        'allowed': {'user_type': ['annual', 'occasional']},
+        'range': {'duration_seconds': (0, 24 * 3600), 'distance_km': (0, None), 'hour': (0, 23)},
+        'expressions': {'end_after_start': 'end_time >= start_time'},
+    },
+    'aparcamientos': {
+        'no_nulls': ['parking_id', 'name'],
+        'unique': ['parking_id'],
+        'range': {'latitude': (-90, 90), 'longitude': (-180, 180), 'hourly_rate_eur': (0, None)},
+        'expressions': {'special_spaces_within_capacity': 'reduced_mobility_spaces + ev_spaces <= total_capacity'},
+    },
+    'parkings': {
+        'no_nulls': ['parking_id', 'timestamp'],
+        'unique': [],
+        'range': {'occupancy_pct': (0, 100), 'hour': (0, 23)},
+        # El porcentaje publicado viene redondeado a un decimal
+        'expressions': {
+            'occupancy_matches_spaces':
+                'abs(occupied_spaces * 100 / (occupied_spaces + free_spaces) - occupancy_pct) <= 0.1',
+        },
+        # 'references' se añade en main con los parking_id de aparcamientos
+    },
+    'trafico': {
+        'no_nulls': ['sensor_id', 'timestamp'],
+        'unique': [],
+        'allowed': {'congestion_level': ['low', 'moderate', 'high', 'muy alta']},
+        'range': {'avg_speed_kmh': (0, 200), 'hour': (0, 23)},
+        'expressions': {'vehicle_breakdown': 'cars + motorcycles + trucks + buses <= total_vehicles'},
+    },
+    'avisa': {
+        'no_nulls': ['id', 'fecha_reporte', 'categoria'],
+        'unique': ['id'],
+        'allowed': {'prioridad': ['Baja', 'Media', 'Alta']},
+        'range': {'latitud': (-90, 90), 'longitud': (-180, 180)},
+    },
+}
+
+@instrument
 def standardize_bicimad_usos(df):
     # Renombrado de columnas y tipos
     df = df.rename(columns={
@@ -19,21 +180,16 @@ def standardize_bicimad_usos(df):
     # Normalización de tipo de usuario
     df['user_type'] = df['user_type'].str.lower().replace({'anual': 'annual', 'ocasional': 'occasional'})
     # Fechas a datetime
-    df['start_time'] = pd.to_datetime(df['start_time'])
-    df['end_time'] = pd.to_datetime(df['end_time'])
+    df['start_time'] = parse_timestamps(df['start_time'])
+    df['end_time'] = parse_timestamps(df['end_time'])
     # Derivar campos temporales
-    df['year'] = df['start_time'].dt.year
-    df['month'] = df['start_time'].dt.month
-    df['day'] = df['start_time'].dt.day
-    df['hour'] = df['start_time'].dt.hour
-    df['weekday'] = df['start_time'].dt.weekday
+    add_temporal_fields(df, 'start_time')
     # Tipos
-    int_cols = ['id', 'user_id', 'station_origin_id', 'station_dest_id', 'duration_seconds', 'estimated_calories', 'co2_saved_grams', 'year', 'month', 'day', 'hour', 'weekday']
     float_cols = ['distance_km']
-    df[int_cols] = df[int_cols].astype('Int64')
     df[float_cols] = df[float_cols].astype(float)
-    return df
+    return apply_compact_schema(df, 'bicimad')
 
+@instrument
 def standardize_aparcamientos_info(df):
     df = df.rename(columns={
         'aparcamiento_id': 'parking_id',
@@ -50,13 +206,11 @@ def standardize_aparcamientos_info(df):
     df['hourly_rate_eur'] = df['hourly_rate_eur'].astype(float)
     df['latitude'] = df['latitude'].astype(float)
     df['longitude'] = df['longitude'].astype(float)
-    df['total_capacity'] = df['total_capacity'].astype('Int64')
-    df['reduced_mobility_spaces'] = df['reduced_mobility_spaces'].astype('Int64')
-    df['ev_spaces'] = df['ev_spaces'].astype('Int64')
     # Normalizar horario
     df['schedule'] = df['schedule'].str.lower().replace({'24 horas': '24h'})
-    return df
+    return apply_compact_schema(df, 'aparcamientos')
 
+@instrument
 def standardize_parkings_rotacion(df):
     df = df.rename(columns={
         'aparcamiento_id': 'parking_id',
@@ -66,20 +220,15 @@ def standardize_parkings_rotacion(df):
         'plazas_libres': 'free_spaces',
         'porcentaje_ocupacion': 'occupancy_pct'
     })
-    # Unir fecha y hora en timestamp
-    df['timestamp'] = pd.to_datetime(df['date'] + ' ' + df['hour'].astype(str).str.zfill(2) + ':00:00')
-    df['year'] = df['timestamp'].dt.year
-    df['month'] = df['timestamp'].dt.month
-    df['day'] = df['timestamp'].dt.day
-    df['weekday'] = df['timestamp'].dt.weekday
+    # Unir fecha y hora en timestamp (fecha + hora * 1h, sin construir strings)
+    df['timestamp'] = parse_timestamps(df['date'], format=DATE_FORMAT) + pd.to_timedelta(df['hour'], unit='h')
+    add_temporal_fields(df, 'timestamp', fields=('year', 'month', 'day', 'weekday'))
     # Tipos
-    df['parking_id'] = df['parking_id'].astype('Int64')
-    df['occupied_spaces'] = df['occupied_spaces'].astype('Int64')
-    df['free_spaces'] = df['free_spaces'].astype('Int64')
     df['occupancy_pct'] = df['occupancy_pct'].astype(float)
-    df['hour'] = df['hour'].astype('Int64')
+    apply_compact_schema(df, 'parkings')
     return df[['parking_id', 'timestamp', 'occupied_spaces', 'free_spaces', 'occupancy_pct', 'year', 'month', 'day', 'hour', 'weekday']]
 
+@instrument
 def standardize_trafico_horario(df):
     df = df.rename(columns={
         'sensor_id': 'sensor_id',
@@ -92,21 +241,16 @@ def standardize_trafico_horario(df):
         'velocidad_media_kmh': 'avg_speed_kmh',
         'nivel_congestion': 'congestion_level'
     })
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['timestamp'] = parse_timestamps(df['timestamp'])
     # Normalizar nivel de congestión
     df['congestion_level'] = df['congestion_level'].str.lower().replace({'baja': 'low', 'moderada': 'moderate', 'alta': 'high'})
     # Tipos
-    int_cols = ['sensor_id', 'total_vehicles', 'cars', 'motorcycles', 'trucks', 'buses']
-    df[int_cols] = df[int_cols].astype('Int64')
     df['avg_speed_kmh'] = df['avg_speed_kmh'].astype(float)
     # Derivar campos temporales
-    df['year'] = df['timestamp'].dt.year
-    df['month'] = df['timestamp'].dt.month
-    df['day'] = df['timestamp'].dt.day
-    df['hour'] = df['timestamp'].dt.hour
-    df['weekday'] = df['timestamp'].dt.weekday
-    return df
+    add_temporal_fields(df, 'timestamp')
+    return apply_compact_schema(df, 'trafico')
 
+@instrument
 def standardize_avisa(df):
     """Enrich and standardize customer data."""
     # Make a copy to avoid modifying the original
@@ -114,55 +258,153 @@ def standardize_avisa(df):
 
     # Convert date string to datetime if needed
     if not pd.api.types.is_datetime64_any_dtype(processed_df['fecha_reporte']):
-        processed_df['fecha_reporte'] = pd.to_datetime(processed_df['fecha_reporte'])
-   
+        processed_df['fecha_reporte'] = parse_timestamps(processed_df['fecha_reporte'])
 
+    return apply_compact_schema(processed_df, 'avisa')
 
-    return processed_df
 
 
+# Cada dataset se procesa de forma independiente (descarga, estandarización,
+# validación y subida); el runner de pipeline.py los ejecuta como tareas
 
-def main():
-    # Leer datos desde raw-ingestion-zone
+@instrument
+def process_bicimad():
     bicimad_df = download_dataframe_from_minio('raw-ingestion-zone', 'data/bicimad.csv', format='csv')
-    aparcamientos_df = download_dataframe_from_minio('raw-ingestion-zone', 'apar/ext_aparcamientos_info.csv', format='csv')
-    parkings_df = download_dataframe_from_minio('raw-ingestion-zone', 'invent/parkings-rotacion.csv', format='csv')
-    trafico_df = download_dataframe_from_minio('raw-ingestion-zone', 'traf/trafcio-horario.csv', format='csv')
-    download_file_from_minio('raw-ingestion-zone', 'avisos/avisamadrid.json', '/avisos/avisamadrid.json')
-    # Estandarización
-
     bicimad_std = standardize_bicimad_usos(bicimad_df)
+    validate_data_quality(bicimad_std, 'bicimad_process', rules=QUALITY_RULES['bicimad'])
+
+    # Particionado por year/month/day (dataset con histórico)
+    upload_partitioned_dataframe_to_minio(bicimad_std, 'process-zone', 'data/bicimad')
+    log_data_transformation('raw-ingestion-zone', 'data/bicimad.csv', 'process-zone', 'data/bicimad/', 'Estandarización de BiciMAD usos y enriquecimiento temporal')
+    return bicimad_std
+
+@instrument
+def process_aparcamientos():
+    aparcamientos_df = download_dataframe_from_minio('raw-ingestion-zone', 'apar/ext_aparcamientos_info.csv', format='csv')
     aparcamientos_std = standardize_aparcamientos_info(aparcamientos_df)
+    validate_data_quality(aparcamientos_std, 'aparcamientos_process', rules=QUALITY_RULES['aparcamientos'])
+
+    upload_dataframe_to_minio(aparcamientos_std, 'process-zone', 'apar/aparcamientos.parquet', format='parquet')
+    log_data_transformation('raw-ingestion-zone', 'apar/ext_aparcamientos_info.csv', 'process-zone', 'apar/aparcamientos.parquet', 'Estandarización de información de aparcamientos')
+    return aparcamientos_std
+
+@instrument
+def process_parkings(aparcamientos_ids=None):
+    # La regla referencial necesita los parking_id de aparcamientos ya procesados
+    if aparcamientos_ids is None:
+        aparcamientos_ids = download_dataframe_from_minio('process-zone', 'apar/aparcamientos.parquet', format='parquet', columns=['parking_id'])['parking_id']
+
+    parkings_df = download_dataframe_from_minio('raw-ingestion-zone', 'invent/parkings-rotacion.csv', format='csv')
     parkings_std = standardize_parkings_rotacion(parkings_df)
+    validate_data_quality(parkings_std, 'parkings_process',
+                          rules=dict(QUALITY_RULES['parkings'], references={'parking_id': aparcamientos_ids}))
+
+    upload_partitioned_dataframe_to_minio(parkings_std, 'process-zone', 'invent/parkings')
+    log_data_transformation('raw-ingestion-zone', 'invent/parkings-rotacion.csv', 'process-zone', 'invent/parkings/', 'Estandarización y enriquecimiento temporal de parkings de rotación')
+    return parkings_std
+
+@instrument
+def process_trafico():
+    trafico_df = download_dataframe_from_minio('raw-ingestion-zone', 'traf/trafcio-horario.csv', format='csv')
     trafico_std = standardize_trafico_horario(trafico_df)
+    validate_data_quality(trafico_std, 'trafico_process', rules=QUALITY_RULES['trafico'])
+
+    upload_partitioned_dataframe_to_minio(trafico_std, 'process-zone', 'traf/trafico')
+    log_data_transformation('raw-ingestion-zone', 'traf/trafcio-horario.csv', 'process-zone', 'traf/trafico/', 'Estandarización y enriquecimiento temporal de tráfico horario')
+    return trafico_std
+
+@instrument
+def process_avisa():
+    download_file_from_minio('raw-ingestion-zone', 'avisos/avisamadrid.json', '/avisos/avisamadrid.json')
     avisa_df = pd.read_json('/avisos/avisamadrid.json', encoding='utf-8')
     avisa_std = standardize_avisa(avisa_df)
-    
-    # Validación de calidad (puedes ajustar las reglas)
-    validate_data_quality(avisa_std, 'avisa_process', rules={'no_nulls': ['id', 'fecha', 'tipo'], 'unique': ['id']})
-    validate_data_quality(bicimad_std, 'bicimad_process', rules={'no_nulls': ['id', 'user_id', 'start_time'], 'unique': ['id']})
-    validate_data_quality(aparcamientos_std, 'aparcamientos_process', rules={'no_nulls': ['parking_id', 'name'], 'unique': ['parking_id']})
-    validate_data_quality(parkings_std, 'parkings_process', rules={'no_nulls': ['parking_id', 'timestamp'], 'unique': []})
-    validate_data_quality(trafico_std, 'trafico_process', rules={'no_nulls': ['sensor_id', 'timestamp'], 'unique': []})
-    
-    # Subir a process-zone en formato parquet
-    upload_dataframe_to_minio(bicimad_std, 'process-zone', 'data/bicimad.parquet', format='parquet')
-    log_data_transformation('raw-ingestion-zone', 'data/bicimad.csv', 'process-zone', 'data/bicimad.parquet', 'Estandarización de BiciMAD usos y enriquecimiento temporal')
-    
-    upload_dataframe_to_minio(aparcamientos_std, 'process-zone', 'apar/aparcamientos.parquet', format='parquet')
-    log_data_transformation('raw-ingestion-zone', 'apar/ext_aparcamientos_info.csv', 'process-zone', 'apar/aparcamientos.parquet', 'Estandarización de información de aparcamientos')
-    
-    upload_dataframe_to_minio(parkings_std, 'process-zone', 'invent/parkings.parquet', format='parquet')
-    log_data_transformation('raw-ingestion-zone', 'invent/parkings-rotacion.csv', 'process-zone', 'invent/parkings.parquet', 'Estandarización y enriquecimiento temporal de parkings de rotación')
-    
-    upload_dataframe_to_minio(trafico_std, 'process-zone', 'traf/trafico.parquet', format='parquet')
-    log_data_transformation('raw-ingestion-zone', 'traf/trafcio-horario.csv', 'process-zone', 'traf/trafico.parquet', 'Estandarización y enriquecimiento temporal de tráfico horario')
-    
+    validate_data_quality(avisa_std, 'avisa_process', rules=QUALITY_RULES['avisa'])
+
     upload_dataframe_to_minio(avisa_std, 'process-zone', 'avisa/avisos.parquet', format='parquet')
     log_data_transformation('raw-ingestion-zone', 'avisos/avisamadrid.json', 'process-zone', 'avisa/avisos.parquet', 'Estandarización y enriquecimiento de avisos del portal Avisa Madrid')
+    return avisa_std
+
+PROCESS_DATASETS = {
+    'avisa': process_avisa,
+    'bicimad': process_bicimad,
+    'aparcamientos': process_aparcamientos,
+    'trafico': process_trafico,
+}
+
+def _process_dataset_worker(dataset, run_id=None, aparcamientos_ipc=None):
+    """Run one dataset chain in a worker process.
+
+    Events go to the parent's governance run through the worker's own
+    buffer; the parent indexes the logs it wrote. The aparcamientos keys
+    needed by parkings travel as Arrow IPC.
+    """
+    start = time.perf_counter()
+    # Los workers se reutilizan: cada tarea devuelve solo sus métricas
+    metrics.reset()
+    buffer = None
+    if run_id is not None:
+        # Los índices de gobernanza los actualiza el proceso padre, en serie
+        buffer = start_governance_run(run_id, index_records=False)
+    try:
+        if dataset == 'parkings':
+            aparcamientos_ids = None
+            if aparcamientos_ipc is not None:
+                aparcamientos_ids = dataframe_from_arrow_ipc(aparcamientos_ipc)['parking_id']
+            df = process_parkings(aparcamientos_ids)
+        else:
+            df = PROCESS_DATASETS[dataset]()
+    finally:
+        if buffer is not None:
+            end_governance_run()
+
+    return {
+        'dataset': dataset,
+        'rows': len(df),
+        'seconds': round(time.perf_counter() - start, 3),
+        'event_logs': buffer.written_objects if buffer is not None else [],
+        'keys_ipc': dataframe_to_arrow_ipc(df[['parking_id']]) if dataset == 'aparcamientos' else None,
+        'metrics': metrics.snapshot(),
+    }
+
+def main_parallel(max_workers=PROCESS_MAX_WORKERS):
+    """Process every dataset in its own worker process.
+
+    parkings is submitted as soon as aparcamientos is done, so the
+    download of one dataset overlaps the processing of the others.
+    """
+    run_id = governance_run_id()
+    # spawn: los workers no heredan el buffer de gobernanza ni el cliente de MinIO
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        pending = {executor.submit(_process_dataset_worker, dataset, run_id): dataset for dataset in PROCESS_DATASETS}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                result = future.result()
+                print(f"Dataset {result['dataset']} procesado: {result['rows']} filas en {result['seconds']:.2f}s")
+                index_governance_logs(result['event_logs'])
+                metrics.merge(result['metrics'])
+                if result['dataset'] == 'aparcamientos':
+                    pending[executor.submit(_process_dataset_worker, 'parkings', run_id, result['keys_ipc'])] = 'parkings'
+
+def main(parallel=PROCESS_PARALLEL):
+    if parallel:
+        main_parallel()
+    else:
+        process_avisa()
+        process_bicimad()
+        aparcamientos_std = process_aparcamientos()
+        process_parkings(aparcamientos_std['parking_id'])
+        process_trafico()
 
     print("Procesamiento y subida a process-zone completados.")
 
 if __name__ == "__main__":
-    main()
-
+    # Metadata, lineage and quality events are written as one governance log
+    start_governance_run()
+    try:
+        main()
+    finally:
+        run = end_governance_run()
+        export_metrics(run.run_id)
@@ -0,0 +1,357 @@
+import os
+import io
+import shutil
+import hashlib
+import datetime
+import tempfile
+import threading
+import pyarrow as pa
+from minio.error import S3Error
+from minio.datatypes import Object
+
+# Backend del almacenamiento de objetos: 'minio' (por defecto), 'local'
+# (un directorio por bucket bajo STORAGE_ROOT) o 'memory' (solo dura lo que
+# el proceso; no sirve con PROCESS_PARALLEL=1)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'minio')
+STORAGE_ROOT = os.environ.get('STORAGE_ROOT', '/tmp/storage')
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Directorio de STORAGE_ROOT con los ETag de los objetos locales (no es un bucket)
+_ETAG_DIR = '.etags'
+
+def storage_error(code, bucket_name, object_name=None):
+    """S3Error with the same codes MinIO returns, so callers handle both alike."""
+    resource = f"/{bucket_name}/{object_name}" if object_name else f"/{bucket_name}"
+    return S3Error(code=code, message=code, resource=resource, request_id=None, host_id=None,
+                   response=None, bucket_name=bucket_name, object_name=object_name)
+
+class ObjectWriteResult:
+    """What put_object returns (the subset callers use)."""
+
+    def __init__(self, bucket_name, object_name, etag):
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.etag = etag
+        self.version_id = None
+
+class ObjectResponse:
+    """File-like response of get_object, with the urllib3 methods callers use."""
+
+    def __init__(self, file_obj, length):
+        self._file_obj = file_obj
+        self._remaining = length
+        self.headers = {'Content-Length': str(length)}
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file_obj.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')[:self._remaining]
+        n = self._file_obj.readinto(view)
+        self._remaining -= n
+        return n
+
+    @property
+    def data(self):
+        return self.read()
+
+    def stream(self, amt=COPY_CHUNK_SIZE):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._file_obj.close()
+
+    def release_conn(self):
+        pass
+
+def _read_stream(data, length, part_size=COPY_CHUNK_SIZE):
+    """Yield the chunks of an upload stream (length -1: until EOF)."""
+    remaining = length
+    while remaining != 0:
+        size = part_size if remaining < 0 else min(part_size, remaining)
+        chunk = data.read(size)
+        if not chunk:
+            break
+        if remaining > 0:
+            remaining -= len(chunk)
+        yield chunk
+
+def _list_keys(keys, bucket_name, prefix, recursive, describe, start_after=None):
+    """List sorted keys the way MinIO does: folders as prefixes unless recursive."""
+    prefix = prefix or ''
+    folders = set()
+    for key in sorted(keys):
+        if not key.startswith(prefix) or (start_after and key <= start_after):
+            continue
+        if not recursive:
+            slash = key.find('/', len(prefix))
+            if slash >= 0:
+                folder = key[:slash + 1]
+                if folder not in folders:
+                    folders.add(folder)
+                    yield Object(bucket_name, folder)
+                continue
+        yield describe(key)
+
+class LocalStorage:
+    """Object storage on the local filesystem, with the Minio client methods the pipeline uses.
+
+    Each bucket is a directory under root and each object a file; writes
+    go through a temporary file and an atomic rename. Parquet readers get
+    memory-mapped files (open_arrow_file).
+    """
+
+    def __init__(self, root=STORAGE_ROOT):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _bucket_path(self, bucket_name):
+        return os.path.join(self.root, bucket_name)
+
+    def _check_bucket(self, bucket_name):
+        if not os.path.isdir(self._bucket_path(bucket_name)):
+            raise storage_error('NoSuchBucket', bucket_name)
+
+    def local_path(self, bucket_name, object_name):
+        """Path of the file that holds an object."""
+        return os.path.join(self.root, bucket_name, *object_name.split('/'))
+
+    def _etag_path(self, bucket_name, object_name):
+        return os.path.join(self.root, _ETAG_DIR, bucket_name, *object_name.split('/'))
+
+    def _existing_path(self, bucket_name, object_name):
+        self._check_bucket(bucket_name)
+        path = self.local_path(bucket_name, object_name)
+        if object_name.endswith('/') or not os.path.isfile(path):
+            raise storage_error('NoSuchKey', bucket_name, object_name)
+        return path
+
+    def _store_etag(self, bucket_name, object_name, etag):
+        etag_path = self._etag_path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(etag_path), exist_ok=True)
+        with open(etag_path, 'w') as f:
+            f.write(etag)
+
+    def _etag(self, bucket_name, object_name, path):
+        """MD5 of the content like MinIO, cached next to the data (recomputed for files changed outside)."""
+        etag_path = self._etag_path(bucket_name, object_name)
+        try:
+            if os.stat(etag_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                with open(etag_path) as f:
+                    return f.read()
+        except OSError:
+            pass
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                md5.update(chunk)
+        etag = md5.hexdigest()
+        self._store_etag(bucket_name, object_name, etag)
+        return etag
+
+    def _describe(self, bucket_name, object_name):
+        path = self.local_path(bucket_name, object_name)
+        file_stat = os.stat(path)
+        return Object(
+            bucket_name, object_name,
+            last_modified=datetime.datetime.fromtimestamp(file_stat.st_mtime, tz=datetime.timezone.utc),
+            etag=self._etag(bucket_name, object_name, path),
+            size=file_stat.st_size,
+        )
+
+    def bucket_exists(self, bucket_name):
+        return os.path.isdir(self._bucket_path(bucket_name))
+
+    def make_bucket(self, bucket_name):
+        try:
+            os.makedirs(self._bucket_path(bucket_name))
+        except FileExistsError:
+            raise storage_error('BucketAlreadyOwnedByYou', bucket_name)
+
+    def put_object(self, bucket_name, object_name, data, length, content_type='application/octet-stream', part_size=0, **kwargs):
+        self._check_bucket(bucket_name)
+        path = self.local_path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        md5 = hashlib.md5()
+        # Fichero temporal en el mismo directorio: el rename es atómico
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in _read_stream(data, length):
+                    md5.update(chunk)
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        etag = md5.hexdigest()
+        self._store_etag(bucket_name, object_name, etag)
+        return ObjectWriteResult(bucket_name, object_name, etag)
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type='application/octet-stream', **kwargs):
+        with open(file_path, 'rb') as f:
+            return self.put_object(bucket_name, object_name, f, os.path.getsize(file_path), content_type)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        path = self._existing_path(bucket_name, object_name)
+        size = os.path.getsize(path)
+        f = open(path, 'rb')
+        f.seek(offset)
+        available = max(size - offset, 0)
+        return ObjectResponse(f, min(length, available) if length else available)
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        path = self._existing_path(bucket_name, object_name)
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        shutil.copyfile(path, file_path)
+        return self._describe(bucket_name, object_name)
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        self._existing_path(bucket_name, object_name)
+        return self._describe(bucket_name, object_name)
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None, **kwargs):
+        self._check_bucket(bucket_name)
+        bucket_path = self._bucket_path(bucket_name)
+        # Solo se recorre la carpeta que contiene el prefijo
+        start = os.path.join(bucket_path, *(prefix or '').split('/')[:-1])
+        keys = []
+        for directory, subdirectories, files in os.walk(start):
+            relative = os.path.relpath(directory, bucket_path)
+            base = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+            if start_after:
+                # Se saltan las carpetas cuyas claves son todas anteriores a start_after
+                subdirectories[:] = [name for name in subdirectories
+                                     if base + name + '/' >= start_after[:len(base + name + '/')]]
+            keys.extend(base + name for name in files if not name.startswith('.tmp-'))
+        return _list_keys(keys, bucket_name, prefix, recursive,
+                          lambda key: self._describe(bucket_name, key), start_after)
+
+    def copy_object(self, bucket_name, object_name, source, **kwargs):
+        with open(self._existing_path(source.bucket_name, source.object_name), 'rb') as f:
+            return self.put_object(bucket_name, object_name, f, -1)
+
+    def remove_objects(self, bucket_name, delete_object_list, **kwargs):
+        for delete_object in delete_object_list:
+            for path in (self.local_path(bucket_name, delete_object.name), self._etag_path(bucket_name, delete_object.name)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return iter([])
+
+    def open_arrow_file(self, bucket_name, object_name):
+        """Memory-mapped Arrow file over an object (zero-copy Parquet reads)."""
+        return pa.memory_map(self._existing_path(bucket_name, object_name))
+
+class MemoryStorage:
+    """In-memory object storage with the Minio client methods the pipeline uses.
+
+    Objects live in the process that wrote them: for tests and single
+    process benchmarks that should not touch disk or network.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get(self, bucket_name, object_name):
+        with self._lock:
+            if bucket_name not in self._buckets:
+                raise storage_error('NoSuchBucket', bucket_name)
+            try:
+                return self._buckets[bucket_name][object_name]
+            except KeyError:
+                raise storage_error('NoSuchKey', bucket_name, object_name)
+
+    def _describe(self, bucket_name, object_name, stored):
+        return Object(bucket_name, object_name, last_modified=stored['last_modified'],
+                      etag=stored['etag'], size=len(stored['data']), content_type=stored['content_type'])
+
+    def bucket_exists(self, bucket_name):
+        with self._lock:
+            return bucket_name in self._buckets
+
+    def make_bucket(self, bucket_name):
+        with self._lock:
+            if bucket_name in self._buckets:
+                raise storage_error('BucketAlreadyOwnedByYou', bucket_name)
+            self._buckets[bucket_name] = {}
+
+    def put_object(self, bucket_name, object_name, data, length, content_type='application/octet-stream', part_size=0, **kwargs):
+        content = b''.join(_read_stream(data, length))
+        etag = hashlib.md5(content).hexdigest()
+        with self._lock:
+            if bucket_name not in self._buckets:
+                raise storage_error('NoSuchBucket', bucket_name)
+            self._buckets[bucket_name][object_name] = {
+                'data': content,
+                'etag': etag,
+                'content_type': content_type,
+                'last_modified': datetime.datetime.now(datetime.timezone.utc),
+            }
+        return ObjectWriteResult(bucket_name, object_name, etag)
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type='application/octet-stream', **kwargs):
+        with open(file_path, 'rb') as f:
+            return self.put_object(bucket_name, object_name, f, -1, content_type)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        data = self._get(bucket_name, object_name)['data']
+        view = memoryview(data)[offset:offset + length] if length else memoryview(data)[offset:]
+        return ObjectResponse(io.BytesIO(view), len(view))
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        stored = self._get(bucket_name, object_name)
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(stored['data'])
+        return self._describe(bucket_name, object_name, stored)
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        return self._describe(bucket_name, object_name, self._get(bucket_name, object_name))
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, start_after=None, **kwargs):
+        with self._lock:
+            if bucket_name not in self._buckets:
+                raise storage_error('NoSuchBucket', bucket_name)
+            objects = dict(self._buckets[bucket_name])
+        return _list_keys(objects, bucket_name, prefix, recursive,
+                          lambda key: self._describe(bucket_name, key, objects[key]), start_after)
+
+    def copy_object(self, bucket_name, object_name, source, **kwargs):
+        stored = self._get(source.bucket_name, source.object_name)
+        return self.put_object(bucket_name, object_name, io.BytesIO(stored['data']), len(stored['data']), stored['content_type'])
+
+    def remove_objects(self, bucket_name, delete_object_list, **kwargs):
+        with self._lock:
+            objects = self._buckets.get(bucket_name, {})
+            for delete_object in delete_object_list:
+                objects.pop(delete_object.name, None)
+        return iter([])
+
+    def open_arrow_file(self, bucket_name, object_name):
+        """Arrow reader over the stored bytes (no copy)."""
+        return pa.BufferReader(pa.py_buffer(self._get(bucket_name, object_name)['data']))
+
+def create_storage_client(backend=STORAGE_BACKEND, root=STORAGE_ROOT):
+    """Build the local or in-memory backend (MinIO clients are built in utils)."""
+    if backend == 'local':
+        return LocalStorage(root)
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unsupported storage backend: {backend}")
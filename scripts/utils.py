@@ -1,21 +1,154 @@
 # File: scripts/utils.py
 from minio import Minio
+from minio.error import S3Error
 import pandas as pd
+import numpy as np
 import io
+import re
 import trino
 import os
 import json
 import datetime
 import hashlib
+import threading
+import time
+import uuid
+import atexit
+import sqlite3
+import tempfile
+import contextlib
+import urllib3
+import operator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from metrics import instrument, CountingPoolManager
+from storage import create_storage_client, STORAGE_BACKEND
+
+# Connection settings for the shared MinIO session
+MINIO_ENDPOINT = os.environ.get('MINIO_ENDPOINT', 'minio:9000')
+MINIO_ACCESS_KEY = os.environ.get('MINIO_ACCESS_KEY', 'minioadmin')
+MINIO_SECRET_KEY = os.environ.get('MINIO_SECRET_KEY', 'minioadmin')
+MINIO_POOL_SIZE = int(os.environ.get('MINIO_POOL_SIZE', '32'))
+MINIO_CONNECT_TIMEOUT = float(os.environ.get('MINIO_CONNECT_TIMEOUT', '10'))
+MINIO_READ_TIMEOUT = float(os.environ.get('MINIO_READ_TIMEOUT', '300'))
+MINIO_MAX_RETRIES = int(os.environ.get('MINIO_MAX_RETRIES', '5'))
+
+# Raw files are streamed to MinIO in parts of this size (bounded memory)
+RAW_UPLOAD_PART_SIZE = int(os.environ.get('RAW_UPLOAD_PART_SIZE', str(16 * 1024 * 1024)))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Governance events buffered during a pipeline run
+GOVERNANCE_BUCKET = 'govern-zone-metadata'
+GOVERNANCE_FLUSH_MAX_EVENTS = int(os.environ.get('GOVERNANCE_FLUSH_MAX_EVENTS', '1000'))
+GOVERNANCE_FLUSH_INTERVAL = float(os.environ.get('GOVERNANCE_FLUSH_INTERVAL', '60'))
+GOVERNANCE_BACKGROUND_FLUSH = os.environ.get('GOVERNANCE_BACKGROUND_FLUSH', '0') == '1'
+# Los logs de eventos se nombran por instante de escritura (UTC), así que su
+# orden de claves es el de escritura: events/at=<instante>/run=<id>/part-*.jsonl
+EVENTS_LOG_PREFIX = 'events/at='
+EVENTS_LEGACY_PREFIX = 'events/run='
+EVENTS_STAMP_FORMAT = '%Y%m%d_%H%M%S_%f'
+# Margen (s) en el que un log puede aparecer con un instante anterior a otro ya leído
+GOVERNANCE_EVENTS_LAG = float(os.environ.get('GOVERNANCE_EVENTS_LAG', '600'))
+
+# Lineage graph index: target dataset -> the edge that produced it
+LINEAGE_INDEX = 'indexes/lineage.json'
+
+# SQLite snapshot of every metadata record, queryable without listing
+METADATA_CATALOG = 'catalog/metadata.sqlite'
+CATALOG_FETCH_WORKERS = int(os.environ.get('CATALOG_FETCH_WORKERS', '16'))
+
+# Data quality: 'full' checks every row, 'sample' a random subset and
+# 'stream' the data batch by batch (Arrow record batches or DataFrames)
+QUALITY_MODE = os.environ.get('QUALITY_MODE', 'full')
+QUALITY_SAMPLE_ROWS = int(os.environ.get('QUALITY_SAMPLE_ROWS', '100000'))
+QUALITY_BATCH_ROWS = int(os.environ.get('QUALITY_BATCH_ROWS', '250000'))
+
+# Manifest of the last ingested version of every raw source
+INGESTION_MANIFEST = 'manifests/raw-ingestion-zone.json'
+
+# Partitioned datasets: Hive-style key=value folders, one part file each
+DEFAULT_PARTITION_COLS = ('year', 'month', 'day')
+HIVE_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+PARTITION_IO_WORKERS = int(os.environ.get('PARTITION_IO_WORKERS', '8'))
+
+RAW_CONTENT_TYPES = {
+    '.csv': 'text/csv',
+    '.json': 'application/json',
+    '.sql': 'application/sql',
+}
+
+_client_lock = threading.Lock()
+_minio_client = None
+_minio_client_pid = None
+_known_buckets = set()
+
+def _build_http_client():
+    """Create the keep-alive urllib3 pool shared by every MinIO request."""
+    return CountingPoolManager(
+        num_pools=4,
+        maxsize=MINIO_POOL_SIZE,
+        timeout=urllib3.Timeout(connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT),
+        retries=urllib3.Retry(
+            total=MINIO_MAX_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
 
 def get_minio_client():
-    """Create and return a MinIO client."""
-    return Minio(
-        "minio:9000",
-        access_key="minioadmin",
-        secret_key="minioadmin",
-        secure=False
-    )
+    """Return the process-wide storage client, creating it on first use.
+
+    It is a MinIO client unless STORAGE_BACKEND selects the local or the
+    in-memory backend (see storage.py), which expose the same methods.
+    """
+    global _minio_client, _minio_client_pid
+
+    # A forked worker must not reuse the parent's sockets
+    if _minio_client is not None and (_minio_client_pid == os.getpid() or STORAGE_BACKEND != 'minio'):
+        return _minio_client
+
+    with _client_lock:
+        if _minio_client is None or _minio_client_pid != os.getpid():
+            if STORAGE_BACKEND == 'minio':
+                _minio_client = Minio(
+                    MINIO_ENDPOINT,
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=False,
+                    http_client=_build_http_client()
+                )
+            elif _minio_client is None:
+                _minio_client = create_storage_client(STORAGE_BACKEND)
+            _minio_client_pid = os.getpid()
+            _known_buckets.clear()
+    return _minio_client
+
+def reset_minio_client():
+    """Drop the shared MinIO client and the bucket cache."""
+    global _minio_client, _minio_client_pid
+
+    with _client_lock:
+        _minio_client = None
+        _minio_client_pid = None
+        _known_buckets.clear()
+
+def ensure_bucket(bucket_name):
+    """Make sure a bucket exists, checking MinIO only once per process."""
+    if bucket_name in _known_buckets:
+        return
+
+    client = get_minio_client()
+    if not client.bucket_exists(bucket_name):
+        try:
+            client.make_bucket(bucket_name)
+        except S3Error as e:
+            # Another worker may have created it in the meantime
+            if e.code not in ('BucketAlreadyOwnedByYou', 'BucketAlreadyExists'):
+                raise
+
+    with _client_lock:
+        _known_buckets.add(bucket_name)
 
 def get_trino_connection():
     """Create and return a Trino connection."""
@@ -27,24 +160,73 @@ def get_trino_connection():
         schema="default",
     )
 
-def upload_file_to_minio(file_path, bucket_name, object_name=None):
-    """Upload a file to MinIO."""
+class _HashingReader:
+    """File wrapper that hashes and counts the bytes MinIO reads from it."""
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._file_obj.read(size)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+@instrument
+def stream_file_to_minio(file_path, bucket_name, object_name=None, part_size=RAW_UPLOAD_PART_SIZE):
+    """Stream a local file byte-for-byte into MinIO, hashing it in the same pass."""
     if object_name is None:
         object_name = os.path.basename(file_path)
 
     client = get_minio_client()
 
     # Make sure the bucket exists
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    ensure_bucket(bucket_name)
+
+    file_size = os.path.getsize(file_path)
+    content_type = RAW_CONTENT_TYPES.get(os.path.splitext(file_path)[1].lower(), 'application/octet-stream')
+
+    # MinIO pulls at most part_size bytes at a time and switches to a
+    # multipart upload for files bigger than one part
+    with open(file_path, 'rb') as f:
+        reader = _HashingReader(f)
+        result = client.put_object(
+            bucket_name, object_name, reader,
+            length=file_size,
+            part_size=part_size,
+            content_type=content_type
+        )
+
+    if reader.size != file_size:
+        raise IOError(f"{file_path} changed while uploading ({reader.size} of {file_size} bytes read)")
+
+    print(f"File {file_path} streamed to {bucket_name}/{object_name} ({file_size} bytes)")
+
+    return {
+        'file_hash': reader.sha256.hexdigest(),
+        'file_size': file_size,
+        'etag': result.etag,
+    }
+
+@instrument
+def upload_file_to_minio(file_path, bucket_name, object_name=None):
+    """Upload a file to MinIO without modifying its bytes."""
+    if object_name is None:
+        object_name = os.path.basename(file_path)
 
-    # Upload the file
-    client.fput_object(bucket_name, object_name, file_path)
-    print(f"File {file_path} uploaded to {bucket_name}/{object_name}")
+    upload = stream_file_to_minio(file_path, bucket_name, object_name)
 
     # Store metadata in govern-zone-metadata
-    store_file_metadata(bucket_name, object_name, file_path)
+    store_file_metadata(
+        bucket_name, object_name, file_path,
+        file_hash=upload['file_hash'],
+        file_size=upload['file_size']
+    )
+    return upload
 
+@instrument
 def download_file_from_minio(bucket_name, object_name, file_path=None):
     """Download a file from MinIO."""
     if file_path is None:
@@ -54,13 +236,13 @@ def download_file_from_minio(bucket_name, object_name, file_path=None):
     client.fget_object(bucket_name, object_name, file_path)
     print(f"File {bucket_name}/{object_name} downloaded to {file_path}")
 
+@instrument
 def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metadata=None):
     """Upload a pandas DataFrame to MinIO with metadata."""
     client = get_minio_client()
 
     # Make sure the bucket exists
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    ensure_bucket(bucket_name)
 
     # Convert DataFrame to bytes in the specified format
     if format.lower() == 'csv':
@@ -101,13 +283,13 @@ def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metada
     # Store metadata in govern-zone-metadata
     store_object_metadata(bucket_name, object_name, metadata)
 
+@instrument
 def upload_json_to_minio(data, bucket_name, object_name, metadata=None):
     """Upload a JSON object to MinIO with metadata."""
     client = get_minio_client()
 
     # Asegúrate de que el bucket existe
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+    ensure_bucket(bucket_name)
 
     # Convertir el diccionario o string JSON a bytes
     if isinstance(data, dict):
@@ -143,21 +325,419 @@ def upload_json_to_minio(data, bucket_name, object_name, metadata=None):
 
     store_object_metadata(bucket_name, object_name, metadata)
 
-def download_dataframe_from_minio(bucket_name, object_name, format='csv'):
-    """Download a file from MinIO into a pandas DataFrame."""
+class MinioRangeFile(io.RawIOBase):
+    """Seekable read-only file over a MinIO object, served with range requests.
+
+    Lets pyarrow read only the Parquet footer and the column chunks / row
+    groups it needs instead of downloading the whole object.
+    """
+
+    def __init__(self, bucket_name, object_name, size=None):
+        super().__init__()
+        self._client = get_minio_client()
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        if size is None:
+            size = self._client.stat_object(bucket_name, object_name).size
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self._position)
+        if length <= 0:
+            return 0
+
+        response = self._client.get_object(
+            self.bucket_name, self.object_name, offset=self._position, length=length
+        )
+        try:
+            view = memoryview(buffer).cast('B')
+            read = 0
+            while read < length:
+                n = response.readinto(view[read:length])
+                if not n:
+                    break
+                read += n
+        finally:
+            response.close()
+            response.release_conn()
+
+        self._position += read
+        return read
+
+def open_object_file(bucket_name, object_name):
+    """Random-access Arrow/Python file over an object.
+
+    Memory-mapped (local backend) or zero-copy (in-memory backend) when the
+    storage backend supports it, range requests on MinIO otherwise.
+    """
     client = get_minio_client()
+    if hasattr(client, 'open_arrow_file'):
+        return client.open_arrow_file(bucket_name, object_name)
+    return MinioRangeFile(bucket_name, object_name)
+
+def _read_object_into_arrow_buffer(bucket_name, object_name):
+    """Read a whole object into a single pre-allocated Arrow buffer.
+
+    The response is written straight into Arrow memory (no intermediate
+    Python bytes or BytesIO copy) and its connection goes back to the pool.
+    """
+    client = get_minio_client()
+    response = client.get_object(bucket_name, object_name)
+    try:
+        size = int(response.headers['Content-Length'])
+        buffer = pa.allocate_buffer(size)
+        view = memoryview(buffer).cast('B')
+        read = 0
+        while read < size:
+            n = response.readinto(view[read:])
+            if not n:
+                raise IOError(f"Truncated read of {bucket_name}/{object_name} ({read} of {size} bytes)")
+            read += n
+    finally:
+        response.close()
+        response.release_conn()
+    return buffer
+
+def _concat_tables(tables):
+    """Concatenate Arrow tables, unifying schemas (all-null or narrower columns)."""
+    try:
+        return pa.concat_tables(tables, promote_options='permissive')
+    except TypeError:
+        # pyarrow < 14
+        return pa.concat_tables(tables, promote=True)
+
+def _table_to_dataframe(table):
+    """Convert an Arrow Table to pandas, releasing Arrow memory as it goes."""
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+@instrument
+def dataframe_to_arrow_ipc(df):
+    """Serialize a DataFrame as an Arrow IPC stream (to hand it to another process)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+@instrument
+def dataframe_from_arrow_ipc(data):
+    """Read a DataFrame back from an Arrow IPC stream."""
+    return _table_to_dataframe(pa.ipc.open_stream(data).read_all())
+
+@instrument
+def download_dataframe_from_minio(bucket_name, object_name, format='csv', columns=None, filters=None, as_arrow=False):
+    """Download a file from MinIO into a pandas DataFrame.
+
+    For Parquet, columns and filters (pyarrow DNF, e.g. [('hour', '>=', 7)])
+    are pushed down so only the needed columns and row groups are fetched.
+    With as_arrow=True a Parquet object is returned as a pyarrow Table.
+    """
+    client = get_minio_client()
+
+    if format.lower() == 'parquet':
+        if columns is not None or filters is not None or hasattr(client, 'open_arrow_file'):
+            # Projection/predicates: read through range requests (or the
+            # memory-mapped file of the local backend)
+            source = open_object_file(bucket_name, object_name)
+        else:
+            source = pa.BufferReader(_read_object_into_arrow_buffer(bucket_name, object_name))
+
+        table = pq.read_table(source, columns=columns, filters=filters)
+        if as_arrow:
+            return table
+        return _table_to_dataframe(table)
+
+    if filters is not None:
+        raise ValueError(f"Row filters are only supported for parquet, not {format}")
 
     # Get the object
     response = client.get_object(bucket_name, object_name)
 
     # Convert to DataFrame based on format
-    if format.lower() == 'csv':
-        return pd.read_csv(response)
-    elif format.lower() == 'parquet':
-        return pd.read_parquet(io.BytesIO(response.read()))
-    else:
-        raise ValueError(f"Unsupported format: {format}")
+    try:
+        if format.lower() == 'csv':
+            return pd.read_csv(response, usecols=columns)
+        else:
+            raise ValueError(f"Unsupported format: {format}")
+    finally:
+        response.close()
+        response.release_conn()
+
+def _format_partition_value(value):
+    """Render a partition value the way it appears in the object key."""
+    if pd.isna(value):
+        return HIVE_NULL_PARTITION
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def _parse_partition_value(value):
+    """Turn a key=value path segment back into a Python value."""
+    if value == HIVE_NULL_PARTITION:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+@instrument
+def upload_partitioned_dataframe_to_minio(df, bucket_name, prefix, partition_cols=DEFAULT_PARTITION_COLS, metadata=None):
+    """Upload a DataFrame as a Hive-style partitioned Parquet dataset.
+
+    Each partition is written to {prefix}/col=value/.../part-0.parquet, so only
+    the partitions present in df are (re)written. Partition columns are kept
+    inside the files as well, which preserves their dtypes on read.
+    """
+    client = get_minio_client()
+    prefix = prefix.rstrip('/')
+    partition_cols = list(partition_cols)
+
+    # Make sure the bucket exists
+    ensure_bucket(bucket_name)
+
+    def upload_partition(item):
+        keys, part = item
+        if not isinstance(keys, tuple):
+            keys = (keys,)
+        partition_path = '/'.join(
+            f"{col}={_format_partition_value(value)}" for col, value in zip(partition_cols, keys)
+        )
+
+        buffer = io.BytesIO()
+        part.to_parquet(buffer, index=False)
+        buffer.seek(0)
+        client.put_object(
+            bucket_name, f"{prefix}/{partition_path}/part-0.parquet", buffer,
+            length=buffer.getbuffer().nbytes,
+            content_type='application/octet-stream'
+        )
+        return partition_path
+
+    groups = df.groupby(partition_cols, sort=True, dropna=False, observed=True)
+    with ThreadPoolExecutor(max_workers=PARTITION_IO_WORKERS) as executor:
+        partitions = list(executor.map(upload_partition, groups))
+
+    print(f"DataFrame uploaded to {bucket_name}/{prefix}/ ({len(partitions)} partitions)")
+
+    # Store metadata
+    if metadata is None:
+        metadata = {}
+
+    metadata.update({
+        'uploaded_at': datetime.datetime.now().isoformat(),
+        'format': 'parquet',
+        'layout': 'hive-partitioned',
+        'partition_cols': partition_cols,
+        'partitions_written': partitions,
+        'rows': len(df),
+        'columns': list(df.columns),
+        'column_types': {col: str(df[col].dtype) for col in df.columns}
+    })
+
+    # Store metadata in govern-zone-metadata
+    store_object_metadata(bucket_name, f"{prefix}/", metadata)
+    return partitions
+
+@instrument
+def list_dataset_partitions(bucket_name, prefix, partition_filter=None):
+    """List the part files of a partitioned dataset with their partition values.
+
+    partition_filter maps a partition column to a value, a list/set of values
+    or a predicate; partitions that do not match are skipped without reading.
+    """
+    client = get_minio_client()
+    prefix = prefix.rstrip('/') + '/'
+
+    partitions = []
+    for obj in client.list_objects(bucket_name, prefix=prefix, recursive=True):
+        if not obj.object_name.endswith('.parquet'):
+            continue
+
+        relative_path = obj.object_name[len(prefix):]
+        values = {}
+        for segment in relative_path.split('/')[:-1]:
+            if '=' in segment:
+                col, value = segment.split('=', 1)
+                values[col] = _parse_partition_value(value)
+
+        if partition_filter and not _partition_matches(values, partition_filter):
+            continue
+
+        partitions.append({
+            'object_name': obj.object_name,
+            'partition': relative_path.rsplit('/', 1)[0],
+            'values': values,
+            'etag': obj.etag,
+            'size': obj.size,
+        })
+
+    return partitions
+
+def _partition_matches(values, partition_filter):
+    """Check partition values against a partition_filter mapping."""
+    for col, condition in partition_filter.items():
+        if col not in values:
+            continue
+        value = values[col]
+        if callable(condition):
+            if not condition(value):
+                return False
+        elif isinstance(condition, (list, tuple, set, frozenset)):
+            if value not in condition:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+_FILTER_OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, options: value in options,
+    'not in': lambda value, options: value not in options,
+}
+
+def _filters_allow_partition(values, filters):
+    """Evaluate pyarrow DNF filters against the partition values of a path.
+
+    Predicates on non-partition columns are left to the Parquet reader.
+    """
+    if not filters:
+        return True
+
+    # A flat list of tuples is a single conjunction
+    disjunction = filters if isinstance(filters[0], list) else [filters]
+    for conjunction in disjunction:
+        matches = True
+        for col, op, value in conjunction:
+            if col not in values or values[col] is None:
+                continue
+            if not _FILTER_OPERATORS[op](values[col], value):
+                matches = False
+                break
+        if matches:
+            return True
+    return False
+
+@instrument
+def download_partitioned_dataframe_from_minio(bucket_name, prefix, partition_filter=None, columns=None, filters=None, as_arrow=False):
+    """Download the matching partitions of a partitioned dataset into one DataFrame.
+
+    filters prune whole partitions on the partition columns and are pushed
+    down to the Parquet row groups of the remaining files. With as_arrow=True
+    the partitions are returned as a single pyarrow Table.
+    """
+    partitions = [
+        partition for partition in list_dataset_partitions(bucket_name, prefix, partition_filter)
+        if _filters_allow_partition(partition['values'], filters)
+    ]
+    if not partitions:
+        return pa.table({}) if as_arrow else pd.DataFrame(columns=columns)
+
+    def read_partition(partition):
+        return download_dataframe_from_minio(
+            bucket_name, partition['object_name'], format='parquet',
+            columns=columns, filters=filters, as_arrow=True
+        )
+
+    with ThreadPoolExecutor(max_workers=PARTITION_IO_WORKERS) as executor:
+        tables = list(executor.map(read_partition, partitions))
+
+    # Concatenating the Arrow tables only stitches chunks together (no copy)
+    table = _concat_tables(tables)
+    del tables
+    if as_arrow:
+        return table
+    return _table_to_dataframe(table)
+
+@instrument
+def read_json_object(bucket_name, object_name, default=None):
+    """Read a JSON document from MinIO, returning default if it does not exist."""
+    client = get_minio_client()
+
+    try:
+        response = client.get_object(bucket_name, object_name)
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchBucket'):
+            return default
+        raise
+
+    try:
+        return json.loads(response.read().decode('utf-8'))
+    finally:
+        response.close()
+        response.release_conn()
+
+@instrument
+def write_json_object(bucket_name, object_name, data):
+    """Write a JSON document to MinIO as-is (no governance metadata)."""
+    client = get_minio_client()
+    ensure_bucket(bucket_name)
+
+    json_bytes = json.dumps(data).encode('utf-8')
+    client.put_object(
+        bucket_name,
+        object_name,
+        io.BytesIO(json_bytes),
+        length=len(json_bytes),
+        content_type='application/json'
+    )
+
+@instrument
+def read_parquet_object(bucket_name, object_name, default=None):
+    """Read a Parquet object into a DataFrame, returning default if it does not exist."""
+    try:
+        return download_dataframe_from_minio(bucket_name, object_name, format='parquet')
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchBucket'):
+            return default
+        raise
+
+@instrument
+def write_parquet_object(bucket_name, object_name, df):
+    """Write a DataFrame as Parquet to MinIO as-is (no governance metadata)."""
+    client = get_minio_client()
+    ensure_bucket(bucket_name)
+
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    client.put_object(
+        bucket_name, object_name, io.BytesIO(buffer.getbuffer()),
+        length=buffer.getbuffer().nbytes,
+        content_type='application/octet-stream'
+    )
+
+@instrument
+def load_ingestion_manifest():
+    """Load the raw-ingestion manifest recorded by incremental ingestion."""
+    return read_json_object('govern-zone-metadata', INGESTION_MANIFEST, default={'sources': {}})
 
+@instrument
 def execute_trino_query(query):
     """Execute a query in Trino and return the results as a DataFrame."""
     conn = get_trino_connection()
@@ -174,12 +754,488 @@ def execute_trino_query(query):
     else:
         return pd.DataFrame()
 
-def store_file_metadata(bucket_name, object_name, file_path):
-    """Store file metadata in the govern-zone-metadata bucket."""
+class GovernanceBuffer:
+    """Collects metadata, lineage and quality events of a pipeline run.
+
+    Events are flushed as JSONL log objects under
+    events/at={flush time}/run={run_id}/ when max_events or flush_interval
+    is reached and when the run ends, either inline or from a background
+    thread.
+    """
+
+    def __init__(self, run_id=None, max_events=GOVERNANCE_FLUSH_MAX_EVENTS,
+                 flush_interval=GOVERNANCE_FLUSH_INTERVAL, background=GOVERNANCE_BACKGROUND_FLUSH,
+                 index_records=True):
+        self.run_id = run_id or datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Worker processes leave the indexes to the parent (see index_governance_logs)
+        self.index_records = index_records
+        self.max_events = max_events
+        self.flush_interval = flush_interval
+        self.background = background
+        self.written_objects = []
+
+        # Several processes may share a run_id; each writes its own parts
+        self._writer_id = uuid.uuid4().hex[:8]
+        self._events = []
+        self._part = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._flush_loop, name='governance-flush', daemon=True)
+            self._thread.start()
+
+    def add(self, kind, object_name, record):
+        """Queue a governance record; object_name is the key it would have had."""
+        event = {
+            'kind': kind,
+            'object_name': object_name,
+            'run_id': self.run_id,
+            'recorded_at': datetime.datetime.now().isoformat(),
+            'record': record,
+        }
+        with self._lock:
+            self._events.append(event)
+            pending = len(self._events)
+
+        due = (pending >= self.max_events or
+               time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            if self.background:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        """Write the queued events as one JSONL object. Returns its name, if any."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            self._last_flush = time.monotonic()
+            if not events:
+                return None
+
+            flushed_at = datetime.datetime.now(datetime.timezone.utc).strftime(EVENTS_STAMP_FORMAT)
+            object_name = f"{EVENTS_LOG_PREFIX}{flushed_at}/run={self.run_id}/part-{self._writer_id}-{self._part:05d}.jsonl"
+            self._part += 1
+
+            body = ''.join(json.dumps(event) + '\n' for event in events).encode('utf-8')
+            ensure_bucket(GOVERNANCE_BUCKET)
+            get_minio_client().put_object(
+                GOVERNANCE_BUCKET, object_name, io.BytesIO(body),
+                length=len(body),
+                content_type='application/x-ndjson'
+            )
+            self.written_objects.append(object_name)
+            if self.index_records:
+                _index_governance_records(events, log_object=object_name)
+
+        print(f"{len(events)} governance events flushed to {GOVERNANCE_BUCKET}/{object_name}")
+        return object_name
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep the events for the next attempt or the final flush
+                print(f"Error flushing governance events: {e}")
+
+    def close(self):
+        """Stop the background flusher and write any remaining events."""
+        self._closed = True
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+        self.flush()
+
+_governance_buffer = None
+
+def start_governance_run(run_id=None, background=GOVERNANCE_BACKGROUND_FLUSH, **options):
+    """Start buffering governance events for this process until end_governance_run()."""
+    global _governance_buffer
+
+    if _governance_buffer is not None:
+        end_governance_run()
+    _governance_buffer = GovernanceBuffer(run_id=run_id, background=background, **options)
+    return _governance_buffer
+
+def end_governance_run():
+    """Flush the buffered governance events and go back to direct writes."""
+    global _governance_buffer
+
+    buffer, _governance_buffer = _governance_buffer, None
+    if buffer is not None:
+        buffer.close()
+    return buffer
+
+def governance_run_id():
+    """Return the id of the active governance run, or None."""
+    buffer = _governance_buffer
+    return buffer.run_id if buffer is not None else None
+
+# Do not lose buffered events if a script exits without ending its run
+atexit.register(end_governance_run)
+
+def _store_governance_record(kind, object_name, record):
+    """Store a governance record as its own object, or queue it if a run is buffering."""
+    buffer = _governance_buffer
+    if buffer is not None:
+        buffer.add(kind, object_name, record)
+        return f"{GOVERNANCE_BUCKET}/events/ (run={buffer.run_id}, {object_name})"
+
+    record_json = json.dumps(record).encode('utf-8')
+    ensure_bucket(GOVERNANCE_BUCKET)
+    get_minio_client().put_object(
+        GOVERNANCE_BUCKET,
+        object_name,
+        io.BytesIO(record_json),
+        length=len(record_json),
+        content_type='application/json'
+    )
+    _index_governance_records([{'kind': kind, 'object_name': object_name, 'record': record}])
+    return f"{GOVERNANCE_BUCKET}/{object_name}"
+
+def _index_governance_records(events, log_object=None):
+    """Fold freshly written governance records into the governance indexes.
+
+    log_object is the events log the records were flushed to; individual
+    metadata objects are picked up later by refresh_metadata_catalog().
+    """
+    lineage = [event['record'] for event in events if event['kind'] == 'lineage']
+    if lineage:
+        update_lineage_index(lineage)
+
+    if log_object is not None:
+        metadata = [(event['object_name'], event['record']) for event in events if event['kind'] == 'metadata']
+        if metadata:
+            with open_metadata_catalog(write=True) as catalog:
+                _merge_catalog_records(catalog, metadata)
+                catalog.execute('INSERT OR IGNORE INTO processed_logs (object_name) VALUES (?)', (log_object,))
+
+@instrument
+def index_governance_logs(log_objects):
+    """Fold events logs written without indexing (by worker processes) into the indexes."""
+    for log_object in log_objects:
+        _index_governance_records(read_event_log(log_object), log_object=log_object)
+
+def lineage_key(bucket_name, object_name):
+    """Key of a dataset node in the lineage index."""
+    return f"{bucket_name}/{object_name}"
+
+def _lineage_edge(record):
+    """Normalize a lineage record into an edge with a list of sources."""
+    if record['source'] == 'multiple':
+        sources = record.get('sources', [])
+    else:
+        sources = [record['source']]
+    return {
+        'sources': [{'bucket': source['bucket'], 'object': source['object']} for source in sources],
+        'target': {'bucket': record['target']['bucket'], 'object': record['target']['object']},
+        'transformation': record['transformation'],
+        'timestamp': record['timestamp'],
+    }
+
+def _merge_lineage_edges(index, records):
+    """Merge lineage records into an index, keeping the newest edge per target."""
+    upstream = index.setdefault('upstream', {})
+    for record in records:
+        edge = _lineage_edge(record)
+        key = lineage_key(edge['target']['bucket'], edge['target']['object'])
+        current = upstream.get(key)
+        if current is None or current['timestamp'] <= edge['timestamp']:
+            upstream[key] = edge
+
+    # The reverse adjacency is derived in memory, no extra reads needed
+    downstream = {}
+    for key, edge in upstream.items():
+        for source in edge['sources']:
+            downstream.setdefault(lineage_key(source['bucket'], source['object']), []).append(key)
+    index['downstream'] = {key: sorted(set(targets)) for key, targets in downstream.items()}
+    index['updated_at'] = datetime.datetime.now().isoformat()
+    return index
+
+_lineage_index_lock = threading.Lock()
+
+@instrument
+def update_lineage_index(records):
+    """Add new lineage records to the persisted lineage index."""
+    with _lineage_index_lock:
+        index = read_json_object(GOVERNANCE_BUCKET, LINEAGE_INDEX)
+        if index is None:
+            # First use: build it from the full history (includes records)
+            index = rebuild_lineage_index()
+        else:
+            _merge_lineage_edges(index, records)
+            write_json_object(GOVERNANCE_BUCKET, LINEAGE_INDEX, index)
+    return index
+
+@instrument
+def rebuild_lineage_index():
+    """Rebuild the lineage index from every lineage record ever written."""
+    records = [record for _, record in load_governance_records('lineage/')]
+    index = _merge_lineage_edges({'upstream': {}}, records)
+    write_json_object(GOVERNANCE_BUCKET, LINEAGE_INDEX, index)
+    return index
+
+@instrument
+def load_lineage_index():
+    """Load the lineage index, building it the first time it is needed."""
+    index = read_json_object(GOVERNANCE_BUCKET, LINEAGE_INDEX)
+    if index is None:
+        with _lineage_index_lock:
+            index = rebuild_lineage_index()
+    return index
+
+@instrument
+def load_governance_records(prefix):
+    """Load the governance records written under a prefix (metadata/, lineage/, quality/).
+
+    Returns (object_name, record) pairs from the individual objects and
+    from the buffered event logs, oldest run first.
+    """
     client = get_minio_client()
+    kind = prefix.strip('/')
+
+    records = []
+    for obj in client.list_objects(GOVERNANCE_BUCKET, prefix=prefix, recursive=True):
+        try:
+            records.append((obj.object_name, read_json_object(GOVERNANCE_BUCKET, obj.object_name)))
+        except Exception as e:
+            print(f"Error reading {obj.object_name}: {e}")
 
-    # Calculate file hash for data lineage
-    file_hash = calculate_file_hash(file_path)
+    for event in iter_governance_events(kind):
+        records.append((event['object_name'], event['record']))
+    return records
+
+def iter_governance_events(kind=None, prefix='events/'):
+    """Yield the buffered governance events, optionally only those of one kind."""
+    client = get_minio_client()
+
+    # Los logs antiguos (events/run=) van antes que los nombrados por instante
+    # de escritura, de modo que el orden es cronológico
+    prefixes = [EVENTS_LEGACY_PREFIX, EVENTS_LOG_PREFIX] if prefix == 'events/' else [prefix]
+    for log_prefix in prefixes:
+        for obj in client.list_objects(GOVERNANCE_BUCKET, prefix=log_prefix, recursive=True):
+            for event in read_event_log(obj.object_name):
+                if kind is None or event['kind'] == kind:
+                    yield event
+
+def _event_log_stamp(object_name):
+    return object_name[len(EVENTS_LOG_PREFIX):].split('/', 1)[0]
+
+def list_new_event_logs(watermark='', seen=(), lag=GOVERNANCE_EVENTS_LAG):
+    """Events logs written since a watermark, in write order.
+
+    Log keys start with their flush time, so the listing resumes from the
+    watermark instead of listing every log. Logs flushed up to lag seconds
+    before the watermark are listed again and filtered with seen: a writer
+    whose upload finished after a later log was read is not missed. Returns
+    the new logs plus the watermark and seen names to keep for the next call.
+    With no watermark the logs of the old events/run= layout are included.
+    """
+    client = get_minio_client()
+    seen = set(seen)
+
+    listed = []
+    if not watermark:
+        listed.extend(obj.object_name for obj in client.list_objects(GOVERNANCE_BUCKET, prefix=EVENTS_LEGACY_PREFIX, recursive=True))
+        start_after = None
+    else:
+        resume = datetime.datetime.strptime(watermark, EVENTS_STAMP_FORMAT) - datetime.timedelta(seconds=lag)
+        start_after = EVENTS_LOG_PREFIX + resume.strftime(EVENTS_STAMP_FORMAT)
+    listed.extend(obj.object_name for obj in client.list_objects(GOVERNANCE_BUCKET, prefix=EVENTS_LOG_PREFIX, recursive=True, start_after=start_after))
+    new_logs = [name for name in listed if name not in seen]
+
+    # El watermark avanza también con los logs ya vistos; se recuerdan solo
+    # los logs dentro del margen del nuevo watermark
+    stamped = [name for name in listed if name.startswith(EVENTS_LOG_PREFIX)]
+    watermark = max([watermark] + [_event_log_stamp(name) for name in stamped])
+    if watermark:
+        cutoff = (datetime.datetime.strptime(watermark, EVENTS_STAMP_FORMAT)
+                  - datetime.timedelta(seconds=lag)).strftime(EVENTS_STAMP_FORMAT)
+        seen = {name for name in seen.union(stamped)
+                if name.startswith(EVENTS_LOG_PREFIX) and _event_log_stamp(name) >= cutoff}
+    else:
+        # Aún sin logs con instante: se recuerdan los del formato antiguo
+        seen.update(new_logs)
+    return new_logs, watermark, sorted(seen)
+
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    source_bucket TEXT NOT NULL,
+    object_name TEXT NOT NULL,
+    format TEXT,
+    rows INTEGER,
+    uploaded_at TEXT,
+    file_hash TEXT,
+    size_bytes INTEGER,
+    metadata_key TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (source_bucket, object_name)
+);
+CREATE INDEX IF NOT EXISTS objects_object_name ON objects (object_name);
+CREATE INDEX IF NOT EXISTS objects_format ON objects (format);
+CREATE INDEX IF NOT EXISTS objects_rows ON objects (rows);
+CREATE INDEX IF NOT EXISTS objects_uploaded_at ON objects (uploaded_at);
+CREATE TABLE IF NOT EXISTS catalog_state (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS processed_logs (object_name TEXT PRIMARY KEY);
+"""
+
+_catalog_lock = threading.Lock()
+
+@contextlib.contextmanager
+def open_metadata_catalog(write=False):
+    """Open a local copy of the metadata catalog snapshot.
+
+    With write=True the snapshot is uploaded back when the block succeeds.
+    """
+    client = get_minio_client()
+    handle, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+
+    with _catalog_lock:
+        try:
+            try:
+                client.fget_object(GOVERNANCE_BUCKET, METADATA_CATALOG, path)
+            except S3Error as e:
+                if e.code not in ('NoSuchKey', 'NoSuchBucket'):
+                    raise
+
+            connection = sqlite3.connect(path)
+            try:
+                connection.executescript(_CATALOG_SCHEMA)
+                yield connection
+                connection.commit()
+            finally:
+                connection.close()
+
+            if write:
+                ensure_bucket(GOVERNANCE_BUCKET)
+                client.fput_object(GOVERNANCE_BUCKET, METADATA_CATALOG, path, content_type='application/x-sqlite3')
+        finally:
+            os.remove(path)
+
+def _merge_catalog_records(catalog, records):
+    """Upsert (metadata_key, metadata) records, keeping the newest per object."""
+    rows = []
+    for metadata_key, metadata in records:
+        rows.append((
+            metadata.get('source_bucket', 'unknown'),
+            metadata.get('object_name', 'unknown'),
+            metadata.get('format'),
+            metadata.get('rows'),
+            metadata.get('uploaded_at'),
+            metadata.get('file_hash'),
+            metadata.get('file_size', metadata.get('object_size_bytes')),
+            metadata_key,
+            json.dumps(metadata),
+        ))
+
+    catalog.executemany("""
+        INSERT INTO objects (source_bucket, object_name, format, rows, uploaded_at,
+                             file_hash, size_bytes, metadata_key, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source_bucket, object_name) DO UPDATE SET
+            format = excluded.format,
+            rows = excluded.rows,
+            uploaded_at = excluded.uploaded_at,
+            file_hash = excluded.file_hash,
+            size_bytes = excluded.size_bytes,
+            metadata_key = excluded.metadata_key,
+            metadata = excluded.metadata
+        WHERE COALESCE(excluded.uploaded_at, '') >= COALESCE(objects.uploaded_at, '')
+    """, rows)
+
+@instrument
+def fetch_json_objects(object_names, max_workers=CATALOG_FETCH_WORKERS):
+    """Fetch several JSON objects from the governance bucket concurrently."""
+    def fetch(object_name):
+        try:
+            return object_name, read_json_object(GOVERNANCE_BUCKET, object_name)
+        except Exception as e:
+            print(f"Error reading {object_name}: {e}")
+            return object_name, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [(name, data) for name, data in executor.map(fetch, object_names) if data is not None]
+
+@instrument
+def read_event_log(object_name):
+    """Read the events of one governance events log."""
+    client = get_minio_client()
+    response = client.get_object(GOVERNANCE_BUCKET, object_name)
+    try:
+        lines = response.read().decode('utf-8').splitlines()
+    finally:
+        response.close()
+        response.release_conn()
+    return [json.loads(line) for line in lines if line]
+
+@instrument
+def refresh_metadata_catalog(rebuild=False, max_workers=CATALOG_FETCH_WORKERS):
+    """Merge new metadata records into the catalog snapshot.
+
+    Only metadata/ objects modified after the stored watermark and events
+    logs written after the events watermark (list_new_event_logs) are
+    downloaded, concurrently. rebuild=True starts from an empty catalog.
+    """
+    client = get_minio_client()
+
+    with open_metadata_catalog(write=True) as catalog:
+        if rebuild:
+            catalog.execute('DELETE FROM objects')
+            catalog.execute('DELETE FROM catalog_state')
+            catalog.execute('DELETE FROM processed_logs')
+
+        row = catalog.execute("SELECT value FROM catalog_state WHERE key = 'metadata_watermark'").fetchone()
+        watermark = row[0] if row else ''
+
+        # Individual metadata objects written since the last refresh
+        new_objects = []
+        latest = watermark
+        for obj in client.list_objects(GOVERNANCE_BUCKET, prefix='metadata/', recursive=True):
+            modified = obj.last_modified.isoformat() if obj.last_modified else ''
+            if modified >= watermark:
+                new_objects.append(obj.object_name)
+                latest = max(latest, modified)
+        _merge_catalog_records(catalog, fetch_json_objects(new_objects, max_workers))
+
+        # Buffered events logs not merged at flush time, from the events
+        # watermark on; processed_logs only keeps the logs inside its margin
+        row = catalog.execute("SELECT value FROM catalog_state WHERE key = 'events_watermark'").fetchone()
+        processed = [name for (name,) in catalog.execute('SELECT object_name FROM processed_logs')]
+        new_logs, events_watermark, processed = list_new_event_logs(row[0] if row else '', processed)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for events in executor.map(read_event_log, new_logs):
+                _merge_catalog_records(catalog, [
+                    (event['object_name'], event['record']) for event in events if event['kind'] == 'metadata'
+                ])
+        catalog.execute('DELETE FROM processed_logs')
+        catalog.executemany('INSERT INTO processed_logs (object_name) VALUES (?)', [(name,) for name in processed])
+
+        catalog.execute(
+            "INSERT OR REPLACE INTO catalog_state (key, value) VALUES ('metadata_watermark', ?)", (latest,)
+        )
+        catalog.execute(
+            "INSERT OR REPLACE INTO catalog_state (key, value) VALUES ('events_watermark', ?)", (events_watermark,)
+        )
+
+    print(f"Metadata catalog refreshed: {len(new_objects)} metadata objects and {len(new_logs)} event logs merged")
+
+@instrument
+def store_file_metadata(bucket_name, object_name, file_path, file_hash=None, file_size=None):
+    """Store file metadata in the govern-zone-metadata bucket."""
+    # Calculate file hash for data lineage (unless the upload already did)
+    if file_hash is None:
+        file_hash = calculate_file_hash(file_path)
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
 
     # Prepare metadata
     metadata = {
@@ -188,32 +1244,18 @@ def store_file_metadata(bucket_name, object_name, file_path):
         'original_file_path': file_path,
         'uploaded_at': datetime.datetime.now().isoformat(),
         'file_hash': file_hash,
-        'file_size': os.path.getsize(file_path)
+        'file_size': file_size
     }
 
     # Store metadata
-    metadata_json = json.dumps(metadata)
-    metadata_buffer = io.BytesIO(metadata_json.encode('utf-8'))
-
     metadata_object_name = f"metadata/{bucket_name}/{object_name.replace('/', '_')}.json"
+    location = _store_governance_record('metadata', metadata_object_name, metadata)
 
-    if not client.bucket_exists('govern-zone-metadata'):
-        client.make_bucket('govern-zone-metadata')
-
-    client.put_object(
-        'govern-zone-metadata',
-        metadata_object_name,
-        metadata_buffer,
-        length=len(metadata_json),
-        content_type='application/json'
-    )
-
-    print(f"Metadata stored in govern-zone-metadata/{metadata_object_name}")
+    print(f"Metadata stored in {location}")
 
+@instrument
 def store_object_metadata(bucket_name, object_name, metadata):
     """Store object metadata in the govern-zone-metadata bucket."""
-    client = get_minio_client()
-
     # Add source information
     metadata.update({
         'source_bucket': bucket_name,
@@ -221,39 +1263,30 @@ def store_object_metadata(bucket_name, object_name, metadata):
     })
 
     # Store metadata
-    metadata_json = json.dumps(metadata)
-    metadata_buffer = io.BytesIO(metadata_json.encode('utf-8'))
-
     metadata_object_name = f"metadata/{bucket_name}/{object_name.replace('/', '_')}.json"
+    location = _store_governance_record('metadata', metadata_object_name, metadata)
 
-    if not client.bucket_exists('govern-zone-metadata'):
-        client.make_bucket('govern-zone-metadata')
-
-    client.put_object(
-        'govern-zone-metadata',
-        metadata_object_name,
-        metadata_buffer,
-        length=len(metadata_json),
-        content_type='application/json'
-    )
-
-    print(f"Metadata stored in govern-zone-metadata/{metadata_object_name}")
+    print(f"Metadata stored in {location}")
 
+@instrument
 def calculate_file_hash(file_path):
     """Calculate SHA-256 hash of a file for data lineage tracking."""
     sha256_hash = hashlib.sha256()
 
     with open(file_path, "rb") as f:
-        # Read and update hash in chunks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
+        # Read and update hash in 1 MiB chunks
+        for byte_block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
             sha256_hash.update(byte_block)
 
     return sha256_hash.hexdigest()
 
+@instrument
 def log_data_transformation(source_bucket, source_object, target_bucket, target_object, transformation_description):
-    """Log data transformation details for data lineage and governance."""
-    client = get_minio_client()
+    """Log data transformation details for data lineage and governance.
 
+    For a transformation with several inputs pass source_bucket='multiple'
+    and a list of (bucket, object) pairs as source_object.
+    """
     # Prepare lineage metadata
     lineage = {
         'timestamp': datetime.datetime.now().isoformat(),
@@ -268,24 +1301,18 @@ def log_data_transformation(source_bucket, source_object, target_bucket, target_
         'transformation': transformation_description
     }
 
-    # Store lineage information
-    lineage_json = json.dumps(lineage)
-    lineage_buffer = io.BytesIO(lineage_json.encode('utf-8'))
-
-    lineage_object_name = f"lineage/{source_bucket}_{source_object.replace('/', '_')}_to_{target_bucket}_{target_object.replace('/', '_')}.json"
-
-    if not client.bucket_exists('govern-zone-metadata'):
-        client.make_bucket('govern-zone-metadata')
+    if source_bucket == 'multiple':
+        lineage['source'] = 'multiple'
+        lineage['sources'] = [{'bucket': bucket, 'object': obj} for bucket, obj in source_object]
+        source_name = 'multiple'
+    else:
+        source_name = f"{source_bucket}_{source_object.replace('/', '_')}"
 
-    client.put_object(
-        'govern-zone-metadata',
-        lineage_object_name,
-        lineage_buffer,
-        length=len(lineage_json),
-        content_type='application/json'
-    )
+    # Store lineage information
+    lineage_object_name = f"lineage/{source_name}_to_{target_bucket}_{target_object.replace('/', '_')}.json"
+    location = _store_governance_record('lineage', lineage_object_name, lineage)
 
-    print(f"Transformation lineage stored in govern-zone-metadata/{lineage_object_name}")
+    print(f"Transformation lineage stored in {location}")
 
 def convert_to_serializable(obj):
     """Convert object to JSON serializable type."""
@@ -300,8 +1327,100 @@ def convert_to_serializable(obj):
         return obj.tolist()
     return obj
 
-def validate_data_quality(df, dataset_name, rules=None):
-    """Perform basic data quality checks and log results to govern-zone."""
+def _iter_quality_batches(data, mode, sample_rows, batch_rows):
+    """Yield the DataFrame batches a quality check runs over."""
+    if isinstance(data, pd.DataFrame):
+        if mode == 'sample' and len(data) > sample_rows:
+            yield data.sample(n=sample_rows, random_state=0)
+        elif mode == 'stream':
+            for start in range(0, len(data), batch_rows):
+                yield data.iloc[start:start + batch_rows]
+        else:
+            yield data
+        return
+
+    if isinstance(data, pa.Table):
+        data = data.to_batches(max_chunksize=batch_rows)
+    for batch in data:
+        yield batch.to_pandas() if isinstance(batch, pa.RecordBatch) else batch
+
+def _regex_mismatches(values, pattern):
+    """Mask of non-null values that do not fully match pattern."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Evaluar el patrón una vez por categoría, no por fila
+        # (el código -1 de los nulos cae en el True añadido al final)
+        matches = np.append(np.asarray(values.cat.categories.astype(str).str.fullmatch(pattern), dtype=bool), True)
+        return ~matches[values.cat.codes.to_numpy()]
+    matches = values.astype(str).str.fullmatch(pattern)
+    return values.notna().to_numpy() & ~matches.to_numpy(dtype=bool)
+
+def _count_rule_failures(batch, rules, references):
+    """Count the failing rows of every rule on one batch."""
+    failures = {}
+
+    null_cols = [col for col in rules.get('no_nulls', []) if col in batch.columns]
+    if null_cols:
+        for col, count in batch[null_cols].isna().sum().items():
+            failures[('no_nulls', col)] = count
+
+    for col, (low, high) in rules.get('range', {}).items():
+        if col in batch.columns:
+            values = batch[col]
+            mask = pd.Series(False, index=batch.index)
+            if low is not None:
+                mask |= (values < low).fillna(False)
+            if high is not None:
+                mask |= (values > high).fillna(False)
+            failures[('range', col)] = mask.sum()
+
+    for check, value_sets in (('allowed', rules.get('allowed', {})), ('references', references)):
+        for col, allowed in value_sets.items():
+            if col in batch.columns:
+                values = batch[col]
+                failures[(check, col)] = (values.notna() & ~values.isin(allowed)).sum()
+
+    for col, pattern in rules.get('regex', {}).items():
+        if col in batch.columns:
+            failures[('regex', col)] = _regex_mismatches(batch[col], pattern).sum()
+
+    for name, expression in rules.get('expressions', {}).items():
+        # df.eval no admite enteros nullable: se evalúa sobre float64 y las
+        # filas con nulos no cuentan como fallo (eso lo comprueba no_nulls)
+        used = [col for col in dict.fromkeys(re.findall(r'[A-Za-z_]\w*', expression)) if col in batch.columns]
+        frame = pd.DataFrame({
+            col: batch[col].astype('float64')
+            if pd.api.types.is_extension_array_dtype(batch[col].dtype) and pd.api.types.is_numeric_dtype(batch[col].dtype)
+            else batch[col]
+            for col in used
+        }, index=batch.index)
+        failed = ~np.asarray(frame.eval(expression), dtype=bool) & ~batch[used].isna().any(axis=1).to_numpy()
+        failures[('expressions', name)] = failed.sum()
+
+    return failures
+
+_RULE_DETAILS = {
+    'no_nulls': "{} null values found",
+    'unique': "{} duplicate values found",
+    'range': "{} values out of range",
+    'allowed': "{} values outside the allowed set",
+    'references': "{} values without a match in the reference dataset",
+    'regex': "{} values not matching the pattern",
+    'expressions': "{} rows failing the expression",
+}
+
+@instrument
+def validate_data_quality(df, dataset_name, rules=None, mode=QUALITY_MODE,
+                          sample_rows=QUALITY_SAMPLE_ROWS, batch_rows=QUALITY_BATCH_ROWS, store=True):
+    """Perform data quality checks and log results to govern-zone.
+
+    Every rule is evaluated in a single vectorized pass per batch. Rules:
+    no_nulls and unique (column lists), range ({col: (min, max)}), allowed
+    ({col: values}), regex ({col: pattern}), expressions ({name: boolean
+    df.eval expression}) and references ({col: values of the referenced
+    key}). df may be a DataFrame, an Arrow table or an iterable of record
+    batches/DataFrames (stream mode). With store=False the results are
+    only returned.
+    """
     if rules is None:
         # Default rules: check for nulls and duplicates
         rules = {
@@ -309,65 +1428,58 @@ def validate_data_quality(df, dataset_name, rules=None):
             'unique': []     # Columns that should be unique
         }
 
+    if isinstance(df, (pd.DataFrame, pa.Table)):
+        row_count = len(df) if isinstance(df, pd.DataFrame) else df.num_rows
+    else:
+        row_count = None
+        mode = 'stream'
+
+    # Las claves de referencia se indexan una sola vez para todos los lotes
+    references = {col: pd.Index(pd.unique(pd.Series(values).dropna()))
+                  for col, values in rules.get('references', {}).items()}
+
+    totals = {}
+    unique_hashes = {col: [] for col in rules.get('unique', [])}
+    rows_checked = 0
+    columns = set()
+    for batch in _iter_quality_batches(df, mode, sample_rows, batch_rows):
+        rows_checked += len(batch)
+        columns.update(batch.columns)
+        for key, count in _count_rule_failures(batch, rules, references).items():
+            totals[key] = totals.get(key, 0) + int(count)
+        for col, hashes in unique_hashes.items():
+            if col in batch.columns:
+                values = batch[col].dropna()
+                hashes.append(pd.util.hash_pandas_object(values, index=False).to_numpy())
+
+    for col, hashes in unique_hashes.items():
+        if col in columns:
+            distinct = len(np.unique(np.concatenate(hashes))) if hashes else 0
+            totals[('unique', col)] = rows_checked - distinct
+
     quality_results = {
         'dataset': dataset_name,
         'timestamp': datetime.datetime.now().isoformat(),
-        'row_count': len(df),
-        'checks': []
+        'row_count': rows_checked if row_count is None else row_count,
+        'rows_checked': rows_checked,
+        'mode': mode,
+        'checks': [
+            {
+                'check': check,
+                'column': column,
+                'passed': failures == 0,
+                'details': _RULE_DETAILS[check].format(failures),
+            }
+            for (check, column), failures in totals.items()
+        ]
     }
 
-    # Check for nulls
-    for col in rules.get('no_nulls', []):
-        if col in df.columns:
-            null_count = df[col].isnull().sum()
-            quality_results['checks'].append({
-                'check': 'no_nulls',
-                'column': col,
-                'passed': null_count == 0,
-                'details': f"{null_count} null values found"
-            })
-
-    # Check for uniqueness
-    for col in rules.get('unique', []):
-        if col in df.columns:
-            unique_count = df[col].nunique()
-            is_unique = unique_count == len(df)
-            quality_results['checks'].append({
-                'check': 'unique',
-                'column': col,
-                'passed': is_unique,
-                'details': f"{len(df) - unique_count} duplicate values found"
-            })
-
-    # Store quality check results
-    client = get_minio_client()
-
-    # Convert to serializable format before JSON dump
-    def make_serializable(data):
-        if isinstance(data, dict):
-            return {k: make_serializable(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [make_serializable(i) for i in data]
-        else:
-            return convert_to_serializable(data)
-
-    serializable_results = make_serializable(quality_results)
-    quality_json = json.dumps(serializable_results)
-
-    quality_buffer = io.BytesIO(quality_json.encode('utf-8'))
+    if not store:
+        return quality_results
 
+    # Store quality check results (already plain Python types)
     quality_object_name = f"quality/{dataset_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    location = _store_governance_record('quality', quality_object_name, quality_results)
 
-    if not client.bucket_exists('govern-zone-metadata'):
-        client.make_bucket('govern-zone-metadata')
-
-    client.put_object(
-        'govern-zone-metadata',
-        quality_object_name,
-        quality_buffer,
-        length=len(quality_json),
-        content_type='application/json'
-    )
-
-    print(f"Data quality results stored in govern-zone-metadata/{quality_object_name}")
-    return quality_results
\ No newline at end of file
+    print(f"Data quality results stored in {location}")
+    return quality_results